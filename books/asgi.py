@@ -2,15 +2,91 @@
 ASGI config for books project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Asynchronous book endpoints are served under ``api/v1/async/`` (see store/asyncviews.py)
+by a separate handler with the async-capable middleware stack ``BOOK_ASYNC_MIDDLEWARE``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'books.settings')
 
-application = get_asgi_application()
+logger = logging.getLogger('django.request')
+
+
+class AsyncApiHandler(ASGIHandler):
+    """
+    ASGI handler with the settings.BOOK_ASYNC_MIDDLEWARE stack instead of settings.MIDDLEWARE
+    """
+    def get_middleware_paths(self):
+        return settings.BOOK_ASYNC_MIDDLEWARE
+
+    def load_middleware(self, is_async=False):
+        """
+        Same as BaseHandler.load_middleware, but the chain is built from get_middleware_paths(),
+        global settings.MIDDLEWARE is neither read nor changed
+        """
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        get_response = self._get_response_async if is_async else self._get_response
+        handler = convert_exception_to_response(get_response)
+        handler_is_async = is_async
+        for middleware_path in reversed(self.get_middleware_paths()):
+            middleware = import_string(middleware_path)
+            middleware_can_sync = getattr(middleware, 'sync_capable', True)
+            middleware_can_async = getattr(middleware, 'async_capable', False)
+            if not middleware_can_sync and not middleware_can_async:
+                raise RuntimeError(f'Middleware {middleware_path} must have at least one of '
+                                   f'sync_capable/async_capable set to True.')
+            elif not handler_is_async and middleware_can_sync:
+                middleware_is_async = False
+            else:
+                middleware_is_async = middleware_can_async
+            try:
+                handler = self.adapt_method_mode(middleware_is_async, handler, handler_is_async,
+                                                 debug=settings.DEBUG, name=f'middleware {middleware_path}')
+                mw_instance = middleware(handler)
+            except MiddlewareNotUsed as exc:
+                if settings.DEBUG:
+                    logger.debug('MiddlewareNotUsed(%r): %s', middleware_path, exc)
+                continue
+
+            if mw_instance is None:
+                raise ImproperlyConfigured(f'Middleware factory {middleware_path} returned None.')
+
+            if hasattr(mw_instance, 'process_view'):
+                self._view_middleware.insert(0, self.adapt_method_mode(is_async, mw_instance.process_view))
+            if hasattr(mw_instance, 'process_template_response'):
+                self._template_response_middleware.append(
+                    self.adapt_method_mode(is_async, mw_instance.process_template_response))
+            if hasattr(mw_instance, 'process_exception'):
+                # exception middleware is always synchronous in Django 3.1
+                self._exception_middleware.append(self.adapt_method_mode(False, mw_instance.process_exception))
+
+            handler = convert_exception_to_response(mw_instance)
+            handler_is_async = middleware_is_async
+
+        # assigned last, Django uses it as the "initialization complete" flag
+        self._middleware_chain = self.adapt_method_mode(is_async, handler, handler_is_async)
+
+
+django_application = get_asgi_application()
+async_api_application = AsyncApiHandler()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].startswith(settings.BOOK_ASYNC_PATH_PREFIX):
+        return await async_api_application(scope, receive, send)
+    return await django_application(scope, receive, send)
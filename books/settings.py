@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'debug_toolbar',
     'rest_framework',
     'django_filters',
@@ -51,6 +52,7 @@ INTERNAL_IPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -148,6 +150,97 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+'''
+Кэш ответов API книг, инвалидируется по номеру версии при изменении книг и оценок
+'''
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+BOOK_CACHE_ALIAS = 'default'
+BOOK_CACHE_TIMEOUT = 60 * 5
+
+'''
+Максимальное количество читателей, которые встраиваются в каждую книгу в списке,
+полный список доступен в api/v1/book/{id}/readers/
+'''
+BOOK_READERS_LIMIT = 10
+
+'''
+Быстрая сериализация списка и отдельной книги через .values() (BooksFastSerializer),
+результат совпадает с BooksSerializer
+'''
+BOOK_FAST_SERIALIZATION = True
+
+'''
+Поисковый движок для книг, по умолчанию выбирается по типу базы данных,
+см. store/services/search.py
+'''
+BOOK_SEARCH_BACKEND = None
+
+'''
+Пересчет рейтинга книг: 'sync' - сразу при оценке, 'deferred' - книги отмечаются, а рейтинг
+пересчитывается не позже чем через BOOK_RATING_MAX_DELAY секунд потоком приложения
+(BOOK_RATING_WORKER = 'thread') или командой manage.py rating_worker (BOOK_RATING_WORKER = None)
+'''
+BOOK_RATING_MODE = 'sync'
+BOOK_RATING_WORKER = 'thread'
+BOOK_RATING_MAX_DELAY = 5
+BOOK_RATING_BATCH_SIZE = 500
+
+'''
+Лидерборды книг (api/v1/leaderboard/{board}/): место в рейтинге по оценкам - байесовское среднее
+с BOOK_LEADERBOARD_PRIOR_VOTES условными оценками BOOK_LEADERBOARD_PRIOR_MEAN
+'''
+BOOK_LEADERBOARD_PRIOR_MEAN = 3.0
+BOOK_LEADERBOARD_PRIOR_VOTES = 5
+
+'''
+Похожие книги (api/v1/book/{id}/similar/): BOOK_SIMILAR_TOP_K соседей по совместным лайкам
+и оценкам от BOOK_SIMILAR_MIN_RATE. Книги, оценка которых стала или перестала быть положительной,
+отмечаются и пересчитываются пачками вместе с соседями не позже чем через BOOK_SIMILAR_MAX_DELAY секунд
+потоком приложения (BOOK_SIMILAR_WORKER = 'thread') или командой manage.py similar_books (None).
+Расчет использует NumPy/SciPy, если они установлены
+'''
+BOOK_SIMILAR_TOP_K = 20
+BOOK_SIMILAR_MIN_RATE = 4
+BOOK_SIMILAR_WORKER = 'thread'
+BOOK_SIMILAR_MAX_DELAY = 60
+BOOK_SIMILAR_BATCH_SIZE = 500
+
+'''
+Количество потоков для работы с БД асинхронных представлений (api/v1/async/)
+'''
+BOOK_ASYNC_DB_WORKERS = 8
+
+'''
+При запуске через ASGI (books/asgi.py) запросы BOOK_ASYNC_PATH_PREFIX обрабатываются цепочкой
+BOOK_ASYNC_MIDDLEWARE без синхронных middleware (debug_toolbar, requestlogs): синхронный middleware
+в ASGI выполняет остаток запроса вместе с представлением в одном общем потоке, и асинхронные запросы
+выполнялись бы по одному. Идентификатор запроса requestlogs хранится в threading.local
+и в асинхронной обработке не разделялся бы между запросами
+'''
+BOOK_ASYNC_PATH_PREFIX = '/api/v1/async/'
+BOOK_ASYNC_MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+                         if not middleware.startswith(('debug_toolbar', 'requestlogs'))]
+
+'''
+Размер пачки bulk_create при импорте книг из CSV/NDJSON
+'''
+BOOK_IMPORT_BATCH_SIZE = 500
+
+'''
+Размер пачки книг при потоковой выгрузке каталога
+'''
+BOOK_EXPORT_CHUNK_SIZE = 1000
+
+'''
+Заголовок Server-Timing (количество SQL запросов, время БД, представления и отрисовки) в ответах,
+те же данные всегда пишутся в лог store.timing
+'''
+BOOK_SERVER_TIMING = True
+
 '''
 create settings for social auth with github
 '''
@@ -167,6 +260,8 @@ REQUESTLOGS = {
 }
 
 # logging with django-requestlogs and default django logging
+# файлы пишутся фоновым потоком пачками (store.loghandlers.QueueFileHandler),
+# запросы не ждут записи на диск, при переполнении очереди записи отбрасываются
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -189,8 +284,15 @@ LOGGING = {
     'handlers': {
         'requestlogs_to_file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'store.loghandlers.QueueFileHandler',
             'filename': '.\\log\\requestlogs.log',
+            'max_bytes': 50 * 1024 * 1024,
+            'backup_count': 5,
+            'batch_size': 200,
+            'flush_interval': 1.0,
+            'queue_size': 10000,
+            # доля записей об успешных GET запросах, например 0.1 - каждая десятая
+            'sample_rate': 1.0,
         },
         'console': {
             'level': 'INFO',
@@ -200,8 +302,10 @@ LOGGING = {
         },
         'file_debug': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'store.loghandlers.QueueFileHandler',
             'filename': '.\\log\\debug.log',
+            'max_bytes': 50 * 1024 * 1024,
+            'backup_count': 5,
             'formatter': 'verbose'
         },
     },
@@ -226,6 +330,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'store.timing': {
+            'handlers': ['file_debug', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django.db.backends': {
             'handlers': ['file_debug'],
             'level': 'WARNING',
@@ -14,4 +14,5 @@ class BookAdmin(ModelAdmin):
 
 @admin.register(UserBookRelation)
 class UserBookRelationAdmin(ModelAdmin):
-    pass
+    # __str__ оценки обращается к пользователю и книге
+    list_select_related = ('user', 'book')
@@ -1,5 +1,24 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate, pre_delete, post_delete
 
 
 class StoreConfig(AppConfig):
     name = 'store'
+
+    def ready(self):
+        from store.middleware import install_query_counter
+        from store.models import Book, UserBookRelation
+        from store.services import logic
+        from store.services.search import setup_search
+
+        post_migrate.connect(setup_search, sender=self)
+        # запросы каждого соединения учитываются в ServerTimingMiddleware
+        connection_created.connect(install_query_counter)
+        # счетчики книг при удалении оценок, в том числе каскадном и через QuerySet.delete()
+        post_delete.connect(logic.relation_post_delete, sender=UserBookRelation)
+        pre_delete.connect(logic.user_pre_delete, sender=get_user_model())
+        post_delete.connect(logic.user_post_delete, sender=get_user_model())
+        pre_delete.connect(logic.book_pre_delete, sender=Book)
+        post_delete.connect(logic.book_post_delete, sender=Book)
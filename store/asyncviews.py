@@ -0,0 +1,68 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from store.views import BookViewSet, UserBookRelationView
+
+'''
+Асинхронные представления книг и оценок для ASGI приложения.
+ORM Django 3.1 синхронный, поэтому работа с базой данных, фильтрация, поиск, сортировка,
+кэш и сериализация выполняются теми же представлениями DRF в ограниченном пуле потоков
+(BOOK_ASYNC_DB_WORKERS), а цикл событий в это время обслуживает других клиентов.
+'''
+executor = ThreadPoolExecutor(max_workers=settings.BOOK_ASYNC_DB_WORKERS, thread_name_prefix='books-db')
+
+book_list_view = BookViewSet.as_view({'get': 'list'})
+book_detail_view = BookViewSet.as_view({'get': 'retrieve'})
+book_relation_view = UserBookRelationView.as_view({'put': 'update', 'patch': 'partial_update'})
+
+
+def run_view(view, request, **kwargs):
+    """
+    Выполнение синхронного представления в потоке пула с закрытием устаревших соединений с БД,
+    как это делает Django в начале и в конце запроса
+    """
+    close_old_connections()
+    try:
+        response = view(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(view, request, **kwargs):
+    # контекст копируется в поток пула, как в sync_to_async: запросы учитываются в ServerTimingMiddleware
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(context.run, run_view, view, request, **kwargs))
+
+
+async def book_list(request):
+    """
+    Список книг, как GET api/v1/book/
+    """
+    return await run_in_executor(book_list_view, request)
+
+
+async def book_detail(request, pk):
+    """
+    Книга, как GET api/v1/book/{id}/
+    """
+    return await run_in_executor(book_detail_view, request, pk=pk)
+
+
+async def book_relation(request, book):
+    """
+    Оценка книги, как PUT/PATCH api/v1/book_relation/{book}/
+    """
+    return await run_in_executor(book_relation_view, request, book=book)
+
+
+# CSRF проверяет SessionAuthentication DRF, как и для синхронных представлений
+book_relation.csrf_exempt = True
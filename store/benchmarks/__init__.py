@@ -0,0 +1,5 @@
+'''
+Нагрузочные тесты API книг на больших объемах данных:
+generator - воспроизводимая генерация пользователей, книг и оценок (manage.py benchmark_data),
+runner - замеры задержек и количества запросов к БД с сохранением в JSON (manage.py benchmark).
+'''
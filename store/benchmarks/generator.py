@@ -0,0 +1,121 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from store.models import Book, UserBookRelation
+from store.services.logic import rebuild_book_counters
+
+'''
+Генерация данных для нагрузочных тестов. Все значения берутся из random.Random(seed),
+поэтому на пустой базе данных одинаковые параметры дают одинаковые данные.
+Записи вставляются пачками через bulk_create, счетчики книг пересчитываются в конце одним UPDATE.
+'''
+USERNAME_PREFIX = 'bench_user_'
+WORDS = (
+    'war', 'peace', 'night', 'day', 'river', 'stone', 'garden', 'city', 'winter', 'summer',
+    'shadow', 'light', 'silver', 'golden', 'last', 'first', 'secret', 'story', 'house', 'road',
+    'sea', 'mountain', 'forest', 'dream', 'time', 'star', 'fire', 'glass', 'king', 'queen',
+)
+
+
+def chunks(items, size):
+    """
+    Разбиение итератора на списки длиной size
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def skewed_index(rng, size, skew=2.0):
+    """
+    Индекс от 0 до size - 1, небольшие индексы выпадают чаще (популярные книги)
+    """
+    return min(int(size * rng.random() ** skew), size - 1)
+
+
+def iter_users(count):
+    # пароль один для всех, хэширование для каждого пользователя заняло бы большую часть генерации
+    password = make_password(None)
+    for index in range(count):
+        yield User(username=f'{USERNAME_PREFIX}{index}', password=password)
+
+
+def iter_books(rng, count, user_ids):
+    authors = [f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son'
+               for _ in range(max(count // 20, 1))]
+    for index in range(count):
+        price = Decimal(rng.randint(100, 99999)) / 100
+        discount = Decimal(rng.randint(0, int(price * 50))) / 100 if rng.random() < 0.3 else None
+        yield Book(
+            name=' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize() + f' {index}',
+            price=price,
+            discount=discount,
+            author_name=rng.choice(authors),
+            owner_id=rng.choice(user_ids) if rng.random() < 0.1 else None,
+        )
+
+
+def iter_relations(rng, count, user_ids, book_ids):
+    """
+    Оценки распределяются между пользователями поровну, пара (пользователь, книга) не повторяется
+    """
+    if not user_ids or not book_ids:
+        return
+    per_user, extra = divmod(min(count, len(user_ids) * len(book_ids)), len(user_ids))
+    for index, user_id in enumerate(user_ids):
+        chosen = set()
+        for _ in range(per_user + (index < extra)):
+            book_index = skewed_index(rng, len(book_ids))
+            while book_index in chosen:
+                book_index = rng.randrange(len(book_ids))
+            chosen.add(book_index)
+            yield UserBookRelation(
+                user_id=user_id,
+                book_id=book_ids[book_index],
+                like=rng.random() < 0.3,
+                in_bookmarks=rng.random() < 0.2,
+                rate=rng.randint(1, 5) if rng.random() < 0.6 else None,
+            )
+
+
+def generate_data(books=100000, users=50000, relations=2000000, seed=42, batch_size=5000, log=None):
+    """
+    Создание users пользователей, books книг и relations оценок.
+    Идентификаторы созданных записей перечитываются из базы данных, так как
+    bulk_create возвращает их не во всех СУБД. Возвращает количество созданных записей
+    """
+    if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+        raise ValueError('Benchmark data already exists, use an empty database.')
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    with transaction.atomic():
+        for batch in chunks(iter_users(users), batch_size):
+            User.objects.bulk_create(batch)
+        user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id')
+                        .values_list('id', flat=True))
+        log(f'Created {len(user_ids)} users')
+
+        last_book_id = Book.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        for batch in chunks(iter_books(rng, books, user_ids), batch_size):
+            Book.objects.bulk_create(batch)
+        book_ids = list(Book.objects.filter(id__gt=last_book_id).order_by('id').values_list('id', flat=True))
+        log(f'Created {len(book_ids)} books')
+
+        created = 0
+        for batch in chunks(iter_relations(rng, relations, user_ids, book_ids), batch_size):
+            UserBookRelation.objects.bulk_create(batch)
+            created += len(batch)
+            log(f'Created {created} relations')
+
+        rebuild_book_counters(Book.objects.filter(id__gt=last_book_id))
+    return {'users': len(user_ids), 'books': len(book_ids), 'relations': created}
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+from base64 import b64encode
+from datetime import datetime
+from time import perf_counter
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.test import APIClient
+
+from store.benchmarks.generator import WORDS
+from store.models import Book
+from store.renderers import get_renderer_classes
+from store.services.logic import set_rating
+
+'''
+Замеры задержек API книг и логики рейтинга.
+Каждый сценарий выполняется warmup раз без замеров и repeat раз с замером времени и количества
+запросов к БД. Случайные параметры берутся из random.Random(seed), сценарии с записью выполняются
+в транзакции с откатом, поэтому повторные запуски на одних данных сравнимы между собой.
+'''
+PERCENTILES = (50, 90, 95, 99)
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class BenchmarkContext:
+    """
+    Общие данные сценариев: клиенты API, идентификаторы книг и пользователь для оценок
+    """
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.book_ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+        self.user = User.objects.order_by('id').first()
+        if not self.book_ids or self.user is None:
+            raise BenchmarkError('No books or users, run "manage.py benchmark_data" first.')
+        self.client = APIClient()
+        self.user_client = APIClient()
+        self.user_client.force_login(self.user)
+
+    def random_book_id(self):
+        return self.rng.choice(self.book_ids)
+
+
+def get(client, url, **params):
+    response = client.get(url, data=params)
+    if response.status_code != 200:
+        raise BenchmarkError(f'GET {url} {params}: status {response.status_code}')
+    return response
+
+
+def book_list(context):
+    get(context.client, reverse('book-list'))
+
+
+def book_search(context):
+    get(context.client, reverse('book-list'), search=context.rng.choice(WORDS))
+
+
+def book_ordering(context):
+    get(context.client, reverse('book-list'), ordering=context.rng.choice(('price', '-price', 'author_name')))
+
+
+def deep_page(context):
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    pages = (len(context.book_ids) + page_size - 1) // page_size
+    get(context.client, reverse('book-list'), page=max(pages // 2, 1))
+
+
+def deep_cursor(context):
+    # курсор KeysetPagination, указывающий на середину списка
+    position = {'p': {'id': context.book_ids[len(context.book_ids) // 2]}}
+    get(context.client, reverse('book-list'), cursor=b64encode(json.dumps(position).encode('utf-8')).decode('ascii'))
+
+
+def leaderboard(context):
+    get(context.client, reverse('leaderboard', args=(context.rng.choice(('rating', 'likes')),)))
+
+
+def similar(context):
+    get(context.client, reverse('book-similar', args=(context.random_book_id(),)))
+
+
+def rate_patch(context):
+    url = reverse('userbookrelation-detail', args=(context.random_book_id(),))
+    response = context.user_client.patch(url, data={'rate': context.rng.randint(1, 5)}, format='json')
+    if response.status_code != 200:
+        raise BenchmarkError(f'PATCH {url}: status {response.status_code}')
+
+
+def recompute_rating(context):
+    set_rating(Book(pk=context.random_book_id()))
+
+
+# сценарий: (функция, выполняется ли в транзакции с откатом)
+CASES = {
+    'book_list': (book_list, False),
+    'book_search': (book_search, False),
+    'book_ordering': (book_ordering, False),
+    'deep_page': (deep_page, False),
+    'deep_cursor': (deep_cursor, False),
+    'leaderboard': (leaderboard, False),
+    'similar': (similar, False),
+    'rate_patch': (rate_patch, True),
+    'set_rating': (recompute_rating, True),
+}
+
+
+def percentile(values, percent):
+    """
+    Перцентиль с линейной интерполяцией между соседними значениями
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(timings, queries):
+    """
+    Статистика замеров: задержки в миллисекундах и количество запросов к БД
+    """
+    result = {'runs': len(timings)}
+    result.update({f'p{percent}_ms': round(percentile(timings, percent), 3) for percent in PERCENTILES})
+    result.update({
+        'mean_ms': round(statistics.mean(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+        'queries_min': min(queries),
+    })
+    return result
+
+
+def measure(function, context, rollback):
+    with CaptureQueriesContext(connection) as queries:
+        if rollback:
+            with transaction.atomic():
+                start = perf_counter()
+                function(context)
+                elapsed = perf_counter() - start
+                transaction.set_rollback(True)
+        else:
+            start = perf_counter()
+            function(context)
+            elapsed = perf_counter() - start
+    return elapsed * 1000, len(queries)
+
+
+def measure_renderers(context, repeat, page_size=100):
+    """
+    Время кодирования и размер страницы из page_size книг в каждом формате ответа API книг
+    """
+    data = get(context.client, reverse('book-list'), pagination='cursor', page_size=page_size).data
+    results = {}
+    for renderer_class in get_renderer_classes():
+        if issubclass(renderer_class, BrowsableAPIRenderer):
+            continue
+        renderer = renderer_class()
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            content = renderer.render(data, renderer.media_type, {})
+            timings.append((perf_counter() - start) * 1000)
+        results[renderer.media_type] = {
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'bytes': len(content),
+        }
+    return results
+
+
+async def asgi_get(application, path):
+    """
+    GET запрос к ASGI приложению без сервера, возвращает статус ответа
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode('ascii'), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+async def measure_concurrent(application, path, concurrency, requests):
+    """
+    requests запросов к application, не больше concurrency одновременно: пропускная способность и задержки
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def request():
+        async with semaphore:
+            start = perf_counter()
+            status = await asgi_get(application, path)
+            timings.append((perf_counter() - start) * 1000)
+        if status != 200:
+            raise BenchmarkError(f'GET {path}: status {status}')
+
+    start = perf_counter()
+    await asyncio.gather(*[request() for _ in range(requests)])
+    elapsed = perf_counter() - start
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+    }
+
+
+def measure_async(concurrency, requests):
+    """
+    Параллельные запросы к асинхронному списку книг через ASGI с цепочкой MIDDLEWARE (синхронные middleware
+    выполняют запросы по одному в общем потоке) и с цепочкой BOOK_ASYNC_MIDDLEWARE (books/asgi.py)
+    """
+    from books.asgi import AsyncApiHandler
+
+    path = reverse('async-book-list')
+    return {
+        name: asyncio.run(measure_concurrent(handler_class(), path, concurrency, requests))
+        for name, handler_class in (('middleware', ASGIHandler), ('async_middleware', AsyncApiHandler))
+    }
+
+
+def run_benchmarks(cases=None, repeat=50, warmup=5, seed=42, use_cache=False, log=None, renderers=False,
+                   concurrency=0):
+    """
+    Выполнение сценариев cases (по умолчанию всех) и сбор результатов в словарь для JSON.
+    По умолчанию кэш ответов отключен, чтобы замерять работу с базой данных и сериализацию.
+    Замеры выполняются как в рабочем режиме: без DEBUG и debug_toolbar.
+    renderers - дополнительно замерить кодирование страницы книг в каждом формате ответа,
+    concurrency - дополнительно замерить repeat параллельных запросов асинхронного списка книг через ASGI
+    """
+    log = log or (lambda message: None)
+    overrides = {
+        'DEBUG': False,
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        'MIDDLEWARE': [middleware for middleware in settings.MIDDLEWARE
+                       if not middleware.startswith('debug_toolbar')],
+    }
+    if not use_cache:
+        overrides['BOOK_CACHE_TIMEOUT'] = 0
+
+    with override_settings(**overrides):
+        context = BenchmarkContext(seed)
+        results = {}
+        for name in cases or CASES:
+            function, rollback = CASES[name]
+            for _ in range(warmup):
+                measure(function, context, rollback)
+            timings, queries = zip(*[measure(function, context, rollback) for _ in range(repeat)])
+            results[name] = summarize(timings, queries)
+            log(f'{name}: p50 {results[name]["p50_ms"]} ms, p95 {results[name]["p95_ms"]} ms, '
+                f'{results[name]["queries"]} queries')
+        renderer_results = measure_renderers(context, repeat) if renderers else {}
+        for media_type, result in renderer_results.items():
+            log(f'{media_type}: encode p50 {result["p50_ms"]} ms, {result["bytes"]} bytes')
+        async_results = measure_async(concurrency, repeat) if concurrency else {}
+        for name, result in async_results.items():
+            log(f'async {name}: {result["rps"]} requests/s, p50 {result["p50_ms"]} ms, p95 {result["p95_ms"]} ms')
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'seed': seed,
+            'repeat': repeat,
+            'warmup': warmup,
+            'use_cache': use_cache,
+            'books': len(context.book_ids),
+            'users': User.objects.count(),
+        },
+        'results': results,
+        'renderers': renderer_results,
+        'async': async_results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    Сравнение двух запусков: рост p50/p95 больше чем на threshold или рост количества запросов
+    считается регрессией. Возвращает список строк сравнения и список регрессий
+    """
+    rows, regressions = [], []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries'):
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0
+            row = {'case': name, 'metric': metric, 'baseline': old[metric], 'current': result[metric],
+                   'change': round(change, 3)}
+            rows.append(row)
+            if (metric == 'queries' and result[metric] > old[metric]) or \
+                    (metric != 'queries' and change > threshold):
+                regressions.append(row)
+    return rows, regressions
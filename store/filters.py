@@ -0,0 +1,34 @@
+from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
+
+from store.models import Book
+from store.services.search import get_search_backend
+
+
+class BookSearchFilter(SearchFilter):
+    """
+    Поиск книг через поисковый движок (см. .services/search.py) вместо OR из icontains.
+    Результаты сортируются по релевантности, если не задан параметр ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        return get_search_backend().search(queryset, search_terms)
+
+
+class BookFilter(filters.FilterSet):
+    """
+    Фильтры книг: точная цена, диапазоны цены и цены с учетом скидки (хранимое поле effective_price)
+    и автор. Каждому фильтру соответствует индекс (поле, id), см. Book.Meta.indexes
+    """
+    price_min = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    price_max = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    price_with_discount_min = filters.NumberFilter(field_name='effective_price', lookup_expr='gte')
+    price_with_discount_max = filters.NumberFilter(field_name='effective_price', lookup_expr='lte')
+    author = filters.CharFilter(field_name='author_name')
+
+    class Meta:
+        model = Book
+        fields = ['price']
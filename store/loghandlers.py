@@ -0,0 +1,179 @@
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+'''
+Неблокирующая запись логов в файл. Обработчик только форматирует запись и кладет строку
+в ограниченную очередь в памяти, запись на диск выполняет фоновый поток пачками,
+поэтому обработка запросов не ждет ввода-вывода. При переполнении очереди записи
+отбрасываются и учитываются в счетчике dropped. Фоновый поток пишет в файл, открытый
+напрямую, а не через зарегистрированный logging.Handler, который logging.shutdown()
+закрыл бы раньше этого обработчика, потеряв последнюю пачку.
+'''
+STOP = object()
+
+
+def is_successful_get(record):
+    """
+    Запись об успешном GET запросе: запись requestlogs (словарь с request и response)
+    или запись store.timing (атрибут timing)
+    """
+    timing = getattr(record, 'timing', None)
+    if timing is not None:
+        method, status = timing.get('method'), timing.get('status')
+    elif isinstance(record.msg, dict):
+        method = (record.msg.get('request') or {}).get('method')
+        status = (record.msg.get('response') or {}).get('status_code')
+    else:
+        return False
+    return method == 'GET' and status is not None and 200 <= status < 400
+
+
+class QueueFileHandler(logging.Handler):
+    """
+    Обработчик логов с фоновой записью в файл:
+    - batch_size, flush_interval - размер пачки и максимальное время ожидания пачки в секундах;
+    - max_bytes, backup_count - ротация файла по размеру, как в RotatingFileHandler;
+    - queue_size - размер очереди, при переполнении записи отбрасываются (dropped);
+    - sample_rate - доля записей об успешных GET запросах, которые попадают в лог.
+    """
+    terminator = '\n'
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, batch_size=100,
+                 flush_interval=1.0, queue_size=10000, sample_rate=1.0, encoding='utf-8'):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.sample_rate = sample_rate
+        self.encoding = encoding
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.stream = None
+        self.thread = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    def emit(self, record):
+        if self.sample_rate < 1 and is_successful_get(record) and random.random() >= self.sample_rate:
+            return
+        try:
+            self.ensure_started()
+            self.queue.put_nowait(self.format(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def ensure_started(self):
+        """
+        Запуск фонового потока при первой записи, в том числе заново после fork процесса
+        """
+        if self.pid == os.getpid() and self.thread is not None:
+            return
+        with self.start_lock:
+            if self.pid == os.getpid() and self.thread is not None:
+                return
+            if self.pid is not None:
+                # после fork очередь и поток родительского процесса недоступны
+                self.queue = queue.Queue(maxsize=self.queue_size)
+                self.stream = None
+            self.start()
+            self.pid = os.getpid()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not STOP and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is STOP
+            self.write([line for line in batch if line is not STOP])
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                self.close_stream()
+                return
+
+    def write(self, lines):
+        """
+        Запись пачки строк одним вызовом write и ротация файла по размеру
+        """
+        if self.dropped > self.reported_dropped:
+            lines.append(f'{self.dropped - self.reported_dropped} log records dropped, queue is full')
+            self.reported_dropped = self.dropped
+        if not lines:
+            return
+        try:
+            if self.stream is None:
+                self.stream = open(self.filename, 'a', encoding=self.encoding)
+            self.stream.write(self.terminator.join(lines) + self.terminator)
+            self.stream.flush()
+            if self.max_bytes and self.backup_count and self.stream.tell() >= self.max_bytes:
+                self.rollover()
+        except Exception as error:
+            # любая ошибка только отбрасывает пачку, фоновый поток продолжает работу
+            self.dropped += len(lines)
+            self.reported_dropped = self.dropped
+            self.close_stream()
+            sys.stderr.write(f'QueueFileHandler: cannot write {self.filename}: {error!r}\n')
+
+    def rollover(self):
+        """
+        Ротация как в RotatingFileHandler: файл.N-1 -> файл.N, ..., файл -> файл.1
+        """
+        self.close_stream()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f'{self.filename}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.filename}.{index + 1}')
+        os.replace(self.filename, f'{self.filename}.1')
+        self.stream = open(self.filename, 'a', encoding=self.encoding)
+
+    def close_stream(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def flush(self, timeout=None):
+        """
+        Ожидание записи уже поставленных в очередь строк, не дольше timeout секунд
+        """
+        if self.thread is None or self.pid != os.getpid():
+            return
+        deadline = time.monotonic() + (self.flush_interval * 2 if timeout is None else timeout)
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            try:
+                self.queue.put(STOP, timeout=self.flush_interval)
+            except queue.Full:
+                pass
+            self.thread.join(self.flush_interval * 2)
+        if self.thread is None or not self.thread.is_alive():
+            self.close_stream()
+        self.thread = None
+        super().close()
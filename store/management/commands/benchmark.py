@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.benchmarks.runner import CASES, BenchmarkError, run_benchmarks, compare_results
+
+
+class Command(BaseCommand):
+    """
+    Замеры задержек и количества запросов API книг с сохранением результатов в JSON
+    и сравнением с предыдущим запуском
+    """
+    help = 'Run book API benchmarks, save results as JSON and compare them with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cases', nargs='+', choices=list(CASES), help='Cases to run, all by default')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--use-cache', action='store_true', help='Do not disable the response cache')
+        parser.add_argument('--renderers', action='store_true',
+                            help='Also measure encoding time and size of a books page in every response format')
+        parser.add_argument('--concurrency', type=int, default=0,
+                            help='Also send --repeat concurrent ASGI requests to the async book list, '
+                                 'with the full and the async-only middleware stack')
+        parser.add_argument('--output', help='Path to the JSON file with results')
+        parser.add_argument('--compare', help='Path to the JSON file with baseline results')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative growth of p50/p95 latency')
+
+    def handle(self, *args, **options):
+        try:
+            result = run_benchmarks(options['cases'], options['repeat'], options['warmup'],
+                                    options['seed'], options['use_cache'], log=self.stdout.write,
+                                    renderers=options['renderers'], concurrency=options['concurrency'])
+        except BenchmarkError as error:
+            raise CommandError(error)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(result, output, indent=2)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline:
+                rows, regressions = compare_results(json.load(baseline), result, options['threshold'])
+            for row in rows:
+                self.stdout.write('{case:<16} {metric:<8} {baseline:>10} -> {current:>10} ({change:+.1%})'.format(**row))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions: ' + ', '.join(
+                    f'{row["case"]} {row["metric"]}' for row in regressions))
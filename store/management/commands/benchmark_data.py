@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.benchmarks.generator import generate_data
+
+
+class Command(BaseCommand):
+    """
+    Генерация пользователей, книг и оценок для нагрузочных тестов
+    """
+    help = 'Generate reproducible benchmark data (users, books and relations) in an empty database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--relations', type=int, default=2000000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            created = generate_data(options['books'], options['users'], options['relations'],
+                                    options['seed'], options['batch_size'], log=self.stdout.write)
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created["users"]} users, {created["books"]} books, {created["relations"]} relations'))
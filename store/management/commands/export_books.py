@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.services.bookexport import export_books, FORMATS
+from store.services.getqueryfromdb import get_books_with_annotate
+
+
+class Command(BaseCommand):
+    """
+    Потоковая выгрузка всех книг в NDJSON или CSV
+    """
+    help = 'Export all books to NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Path to the file, "-" for stdout')
+        parser.add_argument('--file-format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--chunk-size', type=int, default=settings.BOOK_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        lines = export_books(get_books_with_annotate(), options['file_format'], options['chunk_size'])
+        if options['path'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['path'], 'w', encoding='utf-8', newline='') as output:
+            output.writelines(lines)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from store.services.bookimport import import_books, get_import_format, FORMATS
+
+
+class Command(BaseCommand):
+    """
+    Импорт книг из файла CSV или NDJSON
+    """
+    help = 'Import books from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the file, "-" for stdin')
+        parser.add_argument('--file-format', choices=FORMATS, help='Default: by file extension, csv otherwise')
+        parser.add_argument('--batch-size', type=int, default=settings.BOOK_IMPORT_BATCH_SIZE)
+        parser.add_argument('--owner', help='Username of the books owner')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["owner"]}" does not exist.')
+
+        file_format = options['file_format'] or get_import_format(options['path'])
+        if options['path'] == '-':
+            result = import_books(self.stdin.buffer, file_format, owner, options['batch_size'])
+        else:
+            with open(options['path'], 'rb') as stream:
+                result = import_books(stream, file_format, owner, options['batch_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+        self.stdout.write(f'Created {result["created"]} books, {len(result["errors"])} errors')
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.services.ratingworker import process_dirty_ratings
+
+
+class Command(BaseCommand):
+    """
+    Отдельный процесс отложенного пересчета рейтинга книг
+    """
+    help = 'Recompute ratings of books marked as dirty (BOOK_RATING_MODE = "deferred")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.BOOK_RATING_MAX_DELAY,
+                            help='Seconds between runs, the eventual consistency bound')
+        parser.add_argument('--batch-size', type=int, default=settings.BOOK_RATING_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Process marked books once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            processed = process_dirty_ratings(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Recomputed rating of {processed} books')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.services.authors import rebuild_authors
+
+
+class Command(BaseCommand):
+    """
+    Полное перестроение статистики авторов
+    """
+    help = 'Rebuild author statistics (AuthorStats) from books'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Rebuilt statistics of {rebuild_authors()} authors')
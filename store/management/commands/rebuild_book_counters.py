@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.services.logic import rebuild_book_counters
+
+
+class Command(BaseCommand):
+    """
+    Полный пересчет счетчиков книг по оценкам
+    """
+    help = 'Rebuild book counters (rating, likes and readers) from user book relations'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Rebuilt counters of {rebuild_book_counters()} books')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.services.leaderboard import rebuild_rankings
+
+
+class Command(BaseCommand):
+    """
+    Полное перестроение лидербордов книг
+    """
+    help = 'Rebuild book leaderboards (BookRanking) from book counters'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Rebuilt {rebuild_rankings()} rankings')
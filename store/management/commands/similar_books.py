@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.services.recommendations import process_dirty_similar, rebuild_similar
+
+
+class Command(BaseCommand):
+    """
+    Полный пересчет похожих книг или отдельный процесс пересчета отмеченных книг
+    """
+    help = 'Recompute similar books of books marked as dirty, or rebuild all with --rebuild'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild similar books of all books and exit')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Books per chunk for --rebuild')
+        parser.add_argument('--interval', type=float, default=settings.BOOK_SIMILAR_MAX_DELAY,
+                            help='Seconds between runs, the eventual consistency bound')
+        parser.add_argument('--batch-size', type=int, default=settings.BOOK_SIMILAR_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Process marked books once and exit')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            log = self.stdout.write if options['verbosity'] > 1 else None
+            books = rebuild_similar(chunk_size=options['chunk_size'], log=log)
+            self.stdout.write(f'Rebuilt similar books of {books} books')
+            return
+        while True:
+            close_old_connections()
+            processed = process_dirty_similar(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Recomputed similar books of {processed} books')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
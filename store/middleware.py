@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+logger = logging.getLogger('store.timing')
+
+# QueryTimer текущего запроса: контекст копируется в потоки sync_to_async и пула асинхронных представлений
+current_timer = ContextVar('current_timer', default=None)
+
+
+class QueryTimer:
+    """
+    Обертка выполнения SQL запросов (connection.execute_wrapper): количество и общее время запросов,
+    работает и без DEBUG, в отличие от connection.queries
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL запросов каждого соединения: запрос учитывается в QueryTimer текущего
+    запроса (current_timer) в любом потоке, где выполняется запрос
+    """
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Обработчик connection_created: соединения с БД создаются в каждом потоке отдельно
+    """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def get_view_action(view_func, method):
+    """
+    Класс представления DRF и действие (list, retrieve, ...) для функции из as_view()
+    """
+    view_class = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None) or {}
+    return view_class, actions.get(method.lower(), method.lower())
+
+
+class ServerTimingMiddleware:
+    """
+    Количество SQL запросов, время работы с БД, время представления (с сериализацией)
+    и отрисовки ответа для каждого запроса. Выводятся в заголовке Server-Timing
+    (отключается BOOK_SERVER_TIMING) и в лог store.timing. Если для действия представления
+    задан бюджет запросов (query_budgets) и он превышен, в лог пишется предупреждение.
+    Учитываются запросы всех потоков запроса (пул асинхронных представлений, sync_to_async).
+    Потоковые ответы (выгрузка) пишутся в лог после отправки содержимого вместе с его запросами,
+    заголовок Server-Timing содержит только запросы до начала отправки.
+    Работает в синхронной (WSGI) и асинхронной (ASGI) цепочке middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # асинхронная цепочка вызывает middleware как корутину, как MiddlewareMixin Django
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timer, start = QueryTimer(), perf_counter()
+        request.timing = {'view_start': None, 'view_end': None, 'view': None}
+        token = current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.process_timing(request, response, timer, start)
+
+    async def __acall__(self, request):
+        timer, start = QueryTimer(), perf_counter()
+        request.timing = {'view_start': None, 'view_end': None, 'view': None}
+        token = current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.process_timing(request, response, timer, start)
+
+    def process_timing(self, request, response, timer, start):
+        timing = self.get_timing(request, timer, start, perf_counter())
+        if settings.BOOK_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={timing["db_ms"]};desc="{timing["queries"]} queries"',
+                f'view;dur={timing["view_ms"]}',
+                f'render;dur={timing["render_ms"]}',
+                f'total;dur={timing["total_ms"]}',
+            ])
+        if response.streaming:
+            response.streaming_content = self.stream(request, response, iter(response.streaming_content), timer, start)
+        else:
+            self.log(request, response, timing)
+        return response
+
+    def stream(self, request, response, content, timer, start):
+        """
+        Содержимое потокового ответа: запросы при получении каждой части учитываются в timer,
+        лог пишется после отправки всего ответа или его прерывания
+        """
+        try:
+            while True:
+                token = current_timer.set(timer)
+                try:
+                    chunk = next(content, None)
+                finally:
+                    current_timer.reset(token)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.log(request, response, self.get_timing(request, timer, start, perf_counter()))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing['view'] = get_view_action(view_func, request.method)
+        request.timing['view_start'] = perf_counter()
+
+    def process_template_response(self, request, response):
+        # вызывается после представления и перед отрисовкой ответа (Response DRF)
+        request.timing['view_end'] = perf_counter()
+        return response
+
+    @staticmethod
+    def get_timing(request, timer, start, end):
+        view_start = request.timing['view_start'] or start
+        view_end = request.timing['view_end'] or end
+        return {
+            'queries': timer.count,
+            'db_ms': round(timer.duration * 1000, 3),
+            'view_ms': round((view_end - view_start) * 1000, 3),
+            'render_ms': round((end - view_end) * 1000, 3),
+            'total_ms': round((end - start) * 1000, 3),
+        }
+
+    @staticmethod
+    def log(request, response, timing):
+        view_class, action = request.timing['view'] or (None, None)
+        view = f'{view_class.__name__}.{action}' if view_class is not None else None
+        data = dict(method=request.method, path=request.path, status=response.status_code, view=view, **timing)
+        logger.info(' '.join(f'{key}={value}' for key, value in data.items()), extra={'timing': data})
+
+        budget = getattr(view_class, 'query_budgets', {}).get(action)
+        if budget is not None and timing['queries'] > budget:
+            logger.warning(f'Query budget exceeded: {view} made {timing["queries"]} queries, budget {budget}',
+                           extra={'timing': data})
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:28
+
+from django.db import migrations, models
+from django.db.models import Sum, Count
+
+
+def fill_rating_counters(apps, schema_editor):
+    """
+    Заполняем сумму и количество оценок для уже существующих книг
+    """
+    Book = apps.get_model('store', 'Book')
+    UserBookRelation = apps.get_model('store', 'UserBookRelation')
+    counters = UserBookRelation.objects.filter(rate__isnull=False).values('book_id').annotate(
+        rating_sum=Sum('rate'), rating_count=Count('rate'))
+    for row in counters.iterator():
+        Book.objects.filter(pk=row['book_id']).update(rating_sum=row['rating_sum'],
+                                                      rating_count=row['rating_count'],
+                                                      rating=row['rating_sum'] / row['rating_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_counters, migrations.RunPython.noop),
+    ]
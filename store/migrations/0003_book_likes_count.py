@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:29
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_likes_count(apps, schema_editor):
+    """
+    Заполняем количество лайков для уже существующих книг
+    """
+    Book = apps.get_model('store', 'Book')
+    UserBookRelation = apps.get_model('store', 'UserBookRelation')
+    counters = UserBookRelation.objects.filter(like=True).values('book_id').annotate(likes_count=Count('id'))
+    for row in counters.iterator():
+        Book.objects.filter(pk=row['book_id']).update(likes_count=row['likes_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_book_rating_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_likes_count, migrations.RunPython.noop),
+    ]
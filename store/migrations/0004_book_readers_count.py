@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:31
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_readers_count(apps, schema_editor):
+    """
+    Заполняем количество читателей для уже существующих книг
+    """
+    Book = apps.get_model('store', 'Book')
+    UserBookRelation = apps.get_model('store', 'UserBookRelation')
+    counters = UserBookRelation.objects.values('book_id').annotate(readers_count=Count('id'))
+    for row in counters.iterator():
+        Book.objects.filter(pk=row['book_id']).update(readers_count=row['readers_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_book_likes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='readers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_readers_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:31
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    '''
+    CREATE FUNCTION store_book_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+                             setweight(to_tsvector('simple', coalesce(NEW.author_name, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER store_book_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, author_name ON store_book
+    FOR EACH ROW EXECUTE PROCEDURE store_book_search_vector_update()
+    ''',
+    'UPDATE store_book SET name = name',
+    'CREATE INDEX store_book_search_vector_gin ON store_book USING gin (search_vector)',
+    'CREATE INDEX store_book_name_trgm ON store_book USING gin (name gin_trgm_ops)',
+    'CREATE INDEX store_book_author_name_trgm ON store_book USING gin (author_name gin_trgm_ops)',
+]
+
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS store_book_author_name_trgm',
+    'DROP INDEX IF EXISTS store_book_name_trgm',
+    'DROP INDEX IF EXISTS store_book_search_vector_gin',
+    'DROP TRIGGER IF EXISTS store_book_search_vector_trigger ON store_book',
+    'DROP FUNCTION IF EXISTS store_book_search_vector_update()',
+]
+
+SQLITE_FORWARD = [
+    '''
+    CREATE VIRTUAL TABLE store_book_fts USING fts5(
+        name, author_name, content='store_book', content_rowid='id'
+    )
+    ''',
+    '''
+    CREATE TRIGGER store_book_fts_insert AFTER INSERT ON store_book BEGIN
+        INSERT INTO store_book_fts(rowid, name, author_name) VALUES (new.id, new.name, new.author_name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER store_book_fts_delete AFTER DELETE ON store_book BEGIN
+        INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name)
+        VALUES ('delete', old.id, old.name, old.author_name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER store_book_fts_update AFTER UPDATE OF name, author_name ON store_book BEGIN
+        INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name)
+        VALUES ('delete', old.id, old.name, old.author_name);
+        INSERT INTO store_book_fts(rowid, name, author_name) VALUES (new.id, new.name, new.author_name);
+    END
+    ''',
+    "INSERT INTO store_book_fts(store_book_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS store_book_fts_update',
+    'DROP TRIGGER IF EXISTS store_book_fts_delete',
+    'DROP TRIGGER IF EXISTS store_book_fts_insert',
+    'DROP TABLE IF EXISTS store_book_fts',
+]
+
+
+def run_for_vendor(postgresql, sqlite):
+    """
+    Выполняем SQL, подходящий для базы данных: индексы и триггер для PostgreSQL,
+    таблицу FTS5 и триггеры для SQLite
+    """
+    def run(apps, schema_editor):
+        statements = {'postgresql': postgresql, 'sqlite': sqlite}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_book_readers_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_for_vendor(POSTGRESQL_FORWARD, SQLITE_FORWARD),
+                             run_for_vendor(POSTGRESQL_BACKWARD, SQLITE_BACKWARD)),
+    ]
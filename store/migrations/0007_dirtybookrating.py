@@ -0,0 +1,22 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyBookRating',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.book')),
+            ],
+        ),
+    ]
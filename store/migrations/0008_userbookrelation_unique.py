@@ -0,0 +1,62 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:54
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Объединение повторных оценок одной книги одним пользователем перед добавлением ограничения:
+    остается первая запись, лайк и закладка - если они есть хотя бы в одной записи,
+    оценка - из последней записи с оценкой. Затем пересчитываются счетчики затронутых книг.
+    """
+    UserBookRelation = apps.get_model('store', 'UserBookRelation')
+    Book = apps.get_model('store', 'Book')
+    db_alias = schema_editor.connection.alias
+    relations = UserBookRelation.objects.using(db_alias)
+
+    duplicates = relations.values('user_id', 'book_id').annotate(count=Count('id')).filter(count__gt=1).order_by()
+    book_ids = set()
+    for duplicate in duplicates.iterator():
+        rows = list(relations.filter(user_id=duplicate['user_id'], book_id=duplicate['book_id']).order_by('id'))
+        first = rows[0]
+        first.like = any(row.like for row in rows)
+        first.in_bookmarks = any(row.in_bookmarks for row in rows)
+        first.rate = next((row.rate for row in reversed(rows) if row.rate is not None), None)
+        first.save(update_fields=['like', 'in_bookmarks', 'rate'])
+        relations.filter(id__in=[row.id for row in rows[1:]]).delete()
+        book_ids.add(duplicate['book_id'])
+
+    if not book_ids:
+        return
+
+    def counter(aggregate):
+        book_relations = relations.filter(book=OuterRef('pk')).order_by().values('book')
+        return Subquery(book_relations.annotate(value=aggregate).values('value'))
+
+    Book.objects.using(db_alias).filter(id__in=book_ids).update(
+        rating_sum=Coalesce(counter(Sum('rate')), Value(0)),
+        rating_count=Coalesce(counter(Count('rate')), Value(0)),
+        rating=counter(Avg('rate')),
+        likes_count=Coalesce(counter(Count('id', filter=Q(like=True))), Value(0)),
+        readers_count=Coalesce(counter(Count('id')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+    # данные и ограничение изменяются в разных транзакциях
+    # (PostgreSQL не изменяет таблицу с отложенными проверками внешних ключей)
+    atomic = False
+
+    dependencies = [
+        ('store', '0007_dirtybookrating'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userbookrelation',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='store_userbookrelation_user_book_unique'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_rankings(apps, schema_editor):
+    """
+    Рейтинги существующих книг, далее они обновляются при изменении счетчиков
+    (полное перестроение - manage.py rebuild_leaderboards)
+    """
+    Book = apps.get_model('store', 'Book')
+    BookRanking = apps.get_model('store', 'BookRanking')
+    db_alias = schema_editor.connection.alias
+    prior_votes = settings.BOOK_LEADERBOARD_PRIOR_VOTES
+    prior_sum = settings.BOOK_LEADERBOARD_PRIOR_MEAN * prior_votes
+
+    rankings = []
+    for book in Book.objects.using(db_alias).only('id', 'author_name', 'rating_sum', 'rating_count',
+                                                  'likes_count').iterator():
+        rating = (book.rating_sum + prior_sum) / (book.rating_count + prior_votes) if book.rating_count else None
+        rankings.append(BookRanking(board='rating', book_id=book.id, author_name=book.author_name, score=rating))
+        rankings.append(BookRanking(board='likes', book_id=book.id, author_name=book.author_name,
+                                    score=book.likes_count or None))
+    BookRanking.objects.using(db_alias).bulk_create(rankings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_userbookrelation_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRanking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('rating', 'Top rated'), ('likes', 'Most liked')], max_length=16)),
+                ('author_name', models.CharField(max_length=255)),
+                ('score', models.FloatField(null=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='store.book')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bookranking',
+            index=models.Index(fields=['board', '-score', 'id'], name='store_ranking_board_score'),
+        ),
+        migrations.AddIndex(
+            model_name='bookranking',
+            index=models.Index(fields=['board', 'author_name', '-score', 'id'], name='store_ranking_author_score'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookranking',
+            constraint=models.UniqueConstraint(fields=('board', 'book'), name='store_bookranking_board_book_unique'),
+        ),
+        migrations.RunPython(fill_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.2 on 2026-10-18 04:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_booksimilarity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userbookrelation',
+            index=models.Index(condition=models.Q(in_bookmarks=True), fields=['user', 'id'], name='store_relation_bookmarks'),
+        ),
+        migrations.AddIndex(
+            model_name='userbookrelation',
+            index=models.Index(condition=models.Q(like=True), fields=['user', 'id'], name='store_relation_likes'),
+        ),
+        migrations.AddIndex(
+            model_name='userbookrelation',
+            index=models.Index(condition=models.Q(rate__isnull=False), fields=['user', 'id'], name='store_relation_rated'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.2 on 2026-10-18 04:06
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+import store.models
+
+
+def fill_effective_price(apps, schema_editor):
+    """
+    Цена с учетом скидки существующих книг одним UPDATE
+    """
+    Book = apps.get_model('store', 'Book')
+    Book.objects.using(schema_editor.connection.alias).update(
+        effective_price=F('price') - Coalesce(F('discount'), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_relation_shelf_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='effective_price',
+            field=store.models.EffectivePriceField(decimal_places=2, editable=False, max_digits=7, null=True),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['price', 'id'], name='store_book_price_id'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['effective_price', 'id'], name='store_book_effective_price_id'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author_name', 'id'], name='store_book_author_name_id'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.1.2 on 2026-10-18 04:08
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def fill_authors(apps, schema_editor):
+    """
+    Статистика авторов существующих книг, далее она обновляется при изменении книг
+    (полное перестроение - manage.py rebuild_authors)
+    """
+    Book = apps.get_model('store', 'Book')
+    AuthorStats = apps.get_model('store', 'AuthorStats')
+    db_alias = schema_editor.connection.alias
+
+    rows = Book.objects.using(db_alias).values('author_name').annotate(
+        stats_books_count=Count('id'), stats_rating_sum=Sum('rating_sum'), stats_rating_count=Sum('rating_count'),
+        stats_likes_count=Sum('likes_count'), stats_readers_count=Sum('readers_count'),
+        stats_min_price=Min('price'), stats_max_price=Max('price'),
+    ).order_by()
+    AuthorStats.objects.using(db_alias).bulk_create([
+        AuthorStats(
+            author_name=row['author_name'],
+            books_count=row['stats_books_count'],
+            rating_sum=row['stats_rating_sum'],
+            rating_count=row['stats_rating_count'],
+            rating=row['stats_rating_sum'] / row['stats_rating_count'] if row['stats_rating_count'] else None,
+            likes_count=row['stats_likes_count'],
+            readers_count=row['stats_readers_count'],
+            min_price=row['stats_min_price'],
+            max_price=row['stats_max_price'],
+        ) for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_book_effective_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author_name', models.CharField(max_length=255, unique=True)),
+                ('books_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating', models.FloatField(null=True)),
+                ('likes_count', models.PositiveIntegerField(default=0)),
+                ('readers_count', models.PositiveIntegerField(default=0)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=7, null=True)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=7, null=True)),
+            ],
+        ),
+        migrations.RunPython(fill_authors, migrations.RunPython.noop),
+    ]
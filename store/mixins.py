@@ -0,0 +1,269 @@
+import hashlib
+from calendar import timegm
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+from store.models import UserBookRelation
+from store.services.cache import get_books_cache, get_request_cache_key
+
+
+class BooksCacheMixin:
+    """
+    Кэширование данных ответов list и retrieve, при попадании в кэш
+    запросы к базе данных и сериализация не выполняются.
+    Ответы содержат ETag (по версии данных и строке запроса), на If-None-Match отвечаем 304.
+    Ответы last_modified_actions (одна книга) содержат и Last-Modified по её updated_at, на If-Modified-Since
+    тоже отвечаем 304. У списков Last-Modified нет: удаление книги или её выход из фильтра
+    не изменяет updated_at оставшихся книг, поэтому списки проверяются только по ETag.
+    """
+    cache_prefix = 'books'
+    last_modified_actions = ('retrieve',)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_last_modified(self):
+        """
+        Время последнего изменения книги ответа одним запросом MAX(updated_at)
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset().model.objects.order_by()
+        try:
+            # неверный ключ (например, не число) - ответ 404 вернет get_object обработчика
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            updated_at = queryset.aggregate(updated_at=Max('updated_at')).get('updated_at')
+        except (TypeError, ValueError):
+            return None
+        return timegm(updated_at.utctimetuple()) if updated_at else None
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        cache = get_books_cache()
+        key = get_request_cache_key(request, f'{self.cache_prefix}:{self.action}')
+        variant = self.get_etag_variant()
+        etag = quote_etag(hashlib.md5(f'{key}:{request.accepted_media_type}:{variant}'.encode('utf-8')).hexdigest())
+
+        # ETag не требует запросов к базе данных, поэтому проверяем его первым
+        if 'HTTP_IF_NONE_MATCH' in request.META:
+            not_modified = get_conditional_response(request._request, etag=etag)
+            if not_modified is not None:
+                return self.set_validators(not_modified, etag, None)
+
+        cached = cache.get(key)
+        if variant:
+            # ответ зависит не только от книг (например, от оценок пользователя), их updated_at не подходит
+            last_modified = None
+        elif cached is not None and cached['last_modified'] is not None:
+            last_modified = cached['last_modified']
+        else:
+            last_modified = self.get_last_modified() if self.action in self.last_modified_actions else None
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return self.set_validators(not_modified, etag, last_modified)
+
+        if cached is not None:
+            response = Response(cached['data'])
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, {'data': response.data, 'last_modified': last_modified},
+                          settings.BOOK_CACHE_TIMEOUT)
+
+        if response.status_code == status.HTTP_200_OK:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def get_etag_variant(self):
+        """
+        Дополнительная часть ETag для ответов, которые различаются не только строкой запроса.
+        Такие ответы проверяются только по ETag, без Last-Modified
+        """
+        return ''
+
+    @staticmethod
+    def set_validators(response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class FastReadMixin:
+    """
+    Быстрый путь list и retrieve: книги выбираются через .values() и сериализуются
+    fast_serializer_class (см. BooksFastSerializer) с тем же результатом, что и serializer_class.
+    Отключается настройкой BOOK_FAST_SERIALIZATION.
+    """
+    fast_serializer_class = None
+
+    def use_fast_serializer(self):
+        return self.fast_serializer_class is not None and settings.BOOK_FAST_SERIALIZATION
+
+    def get_fast_serializer_kwargs(self):
+        """
+        Дополнительные параметры prepare и fast_serializer_class (например, fields)
+        """
+        return {}
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_serializer():
+            return super().list(request, *args, **kwargs)
+
+        options = self.get_fast_serializer_kwargs()
+        queryset = self.fast_serializer_class.prepare(self.filter_queryset(self.get_queryset()), **options)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.fast_serializer_class(page, **options).data)
+        return Response(self.fast_serializer_class(queryset, **options).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_serializer():
+            return super().retrieve(request, *args, **kwargs)
+
+        options = self.get_fast_serializer_kwargs()
+        queryset = self.fast_serializer_class.prepare(self.filter_queryset(self.get_queryset()), **options)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, instance)
+        return Response(self.fast_serializer_class([instance], **options).data[0])
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа list и retrieve: ?fields=id,name,price - только эти поля,
+    ?exclude=readers - все поля, кроме этих. Сериализатор получает параметр fields,
+    queryset строится get_sparse_queryset(fields), чтобы не выбирать ненужные данные.
+    """
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+    sparse_actions = ('list', 'retrieve')
+
+    def get_requested_fields(self):
+        """
+        Список полей ответа или None, если выбираются все поля
+        """
+        if hasattr(self, '_requested_fields'):
+            return self._requested_fields
+        self._requested_fields = None
+        params = self.request.query_params
+        if self.action not in self.sparse_actions or not (
+                self.fields_query_param in params or self.exclude_query_param in params):
+            return None
+
+        available = [name for name, field in self.get_serializer_class()().fields.items() if not field.write_only]
+        fields = available
+        errors = {}
+        for param in (self.fields_query_param, self.exclude_query_param):
+            if param not in params:
+                continue
+            names = [name.strip() for name in params[param].split(',') if name.strip()]
+            unknown = [name for name in names if name not in available]
+            if unknown:
+                errors[param] = [f'Unknown fields: {", ".join(unknown)}.']
+            elif param == self.fields_query_param:
+                fields = [name for name in fields if name in names]
+            else:
+                fields = [name for name in fields if name not in names]
+        if errors:
+            raise ValidationError(errors)
+        self._requested_fields = fields
+        return fields
+
+    def get_queryset(self):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            return self.get_sparse_queryset(fields)
+        return super().get_queryset()
+
+    def get_sparse_queryset(self, fields):
+        """
+        Queryset только для полей fields, по умолчанию - обычный queryset
+        """
+        return super().get_queryset()
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_fast_serializer_kwargs(self):
+        kwargs = super().get_fast_serializer_kwargs()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return kwargs
+
+
+class ViewerStateMixin:
+    """
+    Оценка текущего пользователя в каждой книге ответа list и retrieve по запросу ?viewer=true:
+    поле viewer_relation с like, in_bookmarks и rate или null, если книга не оценена.
+    Оценки всех книг страницы выбираются одним запросом по индексу (user, book) поверх
+    закэшированного общего ответа, анонимные запросы не выполняют дополнительный запрос.
+    Ответы с оценкой пользователя проверяются только по ETag: изменение закладки не изменяет updated_at книги.
+    """
+    viewer_query_param = 'viewer'
+    viewer_field = 'viewer_relation'
+
+    def is_viewer_param_set(self):
+        return self.request.query_params.get(self.viewer_query_param, '').lower() in ('1', 'true')
+
+    def is_viewer_requested(self):
+        return self.request.user.is_authenticated and self.is_viewer_param_set()
+
+    def get_requested_fields(self):
+        # оценки сопоставляются книгам по id, поля выбирает SparseFieldsMixin. id выбирается при ?viewer=true
+        # и для анонимных запросов, чтобы общий кэш ответа не зависел от пользователя, и убирается
+        # из ответа, если не был запрошен
+        fields = getattr(super(), 'get_requested_fields', lambda: None)()
+        if fields is not None and 'id' not in fields and self.is_viewer_param_set():
+            fields.insert(0, 'id')
+            self.viewer_id_added = True
+        return fields
+
+    def get_etag_variant(self):
+        variant = super().get_etag_variant()
+        return f'{variant}:user={self.request.user.id}' if self.is_viewer_requested() else variant
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            self.finalize_books(response.data['results'] if isinstance(response.data, dict) else response.data)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            self.finalize_books([response.data])
+        return response
+
+    def finalize_books(self, books):
+        if self.is_viewer_requested():
+            self.add_viewer_state(books)
+        # ответ из кэша строится без get_requested_fields
+        self.get_requested_fields()
+        if getattr(self, 'viewer_id_added', False):
+            for book in books:
+                book.pop('id', None)
+
+    def add_viewer_state(self, books):
+        if not books:
+            return
+        relations = {
+            book_id: {'like': like, 'in_bookmarks': in_bookmarks, 'rate': rate}
+            for book_id, like, in_bookmarks, rate in UserBookRelation.objects.filter(
+                user=self.request.user, book_id__in=[book['id'] for book in books]
+            ).values_list('book_id', 'like', 'in_bookmarks', 'rate')
+        }
+        for book in books:
+            book[self.viewer_field] = relations.get(book['id'])
@@ -1,10 +1,29 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Q
+
+from store.services.cache import bump_books_version
 
 
 # Create your models here.
 
 
+class EffectivePriceField(models.DecimalField):
+    """
+    Цена с учетом скидки price - discount (без скидки - цена), вычисляется при каждом сохранении,
+    в том числе в bulk_create, как auto_now. Хранится для фильтрации и сортировки по индексу
+    """
+
+    def pre_save(self, model_instance, add):
+        price_field = model_instance._meta.get_field('price')
+        price = price_field.to_python(model_instance.price)
+        discount = price_field.to_python(model_instance.discount) or 0
+        value = price - discount if price is not None else None
+        setattr(model_instance, self.attname, value)
+        return value
+
+
 class Book(models.Model):
     """
     Модель книги
@@ -12,15 +31,74 @@ class Book(models.Model):
     name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=7, decimal_places=2)
     discount = models.DecimalField(max_digits=7, decimal_places=2, null=True)
+    effective_price = EffectivePriceField(max_digits=7, decimal_places=2, null=True, editable=False)
     author_name = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.SET_NULL,
                               null=True, related_name='my_books')
     readers = models.ManyToManyField(User, through='UserBookRelation', related_name='books')
     rating = models.DecimalField(max_digits=2, decimal_places=1, null=True)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    likes_count = models.PositiveIntegerField(default=0)
+    readers_count = models.PositiveIntegerField(default=0)
+    # заполняется триггером в PostgreSQL, в SQLite для поиска используется таблица FTS5
+    search_vector = SearchVectorField(null=True, editable=False)
+    # изменяется и при изменении счетчиков, используется для заголовка Last-Modified
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Счетчики изменяются только атомарными UPDATE через F() в .services/logic.py
+    COUNTER_FIELDS = ('rating', 'rating_sum', 'rating_count', 'likes_count', 'readers_count')
+
+    class Meta:
+        # индексы фильтров и сортировок BookFilter и постраничного вывода по ключу (поле, id)
+        indexes = [
+            models.Index(fields=('price', 'id'), name='store_book_price_id'),
+            models.Index(fields=('effective_price', 'id'), name='store_book_effective_price_id'),
+            models.Index(fields=('author_name', 'id'), name='store_book_author_name_id'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # автор до изменения, его статистика обновляется при смене автора
+        self.old_author_name = self.__dict__.get('author_name')
 
     def __str__(self):
         return f'Id {self.id}: {self.name}'
 
+    def save(self, *args, **kwargs):
+        """
+        При обновлении книги не перезаписываем счетчики значениями из памяти,
+        иначе параллельно выставленные оценки будут потеряны.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        elif kwargs.get('update_fields') is not None and {'price', 'discount'} & set(kwargs['update_fields']):
+            kwargs['update_fields'] = [*kwargs['update_fields'], 'effective_price']
+        from store.services.authors import move_book, refresh_prices
+        from store.services.leaderboard import refresh_rankings
+
+        adding = self._state.adding
+        renamed = not adding and self.old_author_name not in (None, self.author_name)
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            refresh_rankings(Book.objects.filter(pk=self.pk))
+            if adding or renamed:
+                move_book(self, None if adding else self.old_author_name, self.author_name)
+            refresh_prices({self.author_name, self.old_author_name} - {None}, delete_empty=renamed)
+        self.old_author_name = self.author_name
+        bump_books_version()
+
+    def delete(self, *args, **kwargs):
+        """
+        Статистика автора обновляется обработчиками pre_delete/post_delete книги (.services/logic.py),
+        поэтому и при QuerySet.delete(). Оценки удаляются каскадно, обработчик post_delete оценки
+        пропускает оценки удаляемой книги (get_deleting('books')), поэтому счетчики книги не изменяются
+        """
+        result = super().delete(*args, **kwargs)
+        bump_books_version()
+        return result
+
 
 class UserBookRelation(models.Model):
     """
@@ -40,22 +118,129 @@ class UserBookRelation(models.Model):
     in_bookmarks = models.BooleanField(default=False)
     rate = models.PositiveSmallIntegerField(choices=RATE_CHOICES, null=True)
 
+    class Meta:
+        # одна оценка книги пользователем, по этому ограничению работает upsert_relation в .services/logic.py
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'book'), name='store_userbookrelation_user_book_unique'),
+        ]
+        # частичные индексы полок личной библиотеки (SHELVES в .services/getqueryfromdb.py)
+        indexes = [
+            models.Index(fields=('user', 'id'), name='store_relation_bookmarks', condition=Q(in_bookmarks=True)),
+            models.Index(fields=('user', 'id'), name='store_relation_likes', condition=Q(like=True)),
+            models.Index(fields=('user', 'id'), name='store_relation_rated', condition=Q(rate__isnull=False)),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # при загрузке через only()/defer() не обращаемся к отложенным полям, чтобы не делать запрос
+        self.old_rate = self.__dict__.get('rate')
+        self.old_like = self.__dict__.get('like', False)
+
     def __str__(self):
         return f'{self.user.username}: {self.book.name}, RATE {self.rate}'
 
     def save(self, *args, **kwargs):
         """
-        При изменении или создании оценки производится автоматический пересчет средней оценки
-        книги в поле rating используя дополнительную логику, которая реализована в .services/logic.py
+        При изменении или создании оценки производится инкрементальное обновление суммы и
+        количества оценок книги, её рейтинга, количества лайков и читателей,
+        логика реализована в .services/logic.py. При удалении (в том числе каскадном и QuerySet.delete())
+        оценка вычитается из счетчиков обработчиком post_delete (relation_post_delete)
         """
-        from store.services.logic import set_rating
+        from store.services.logic import update_book_counters
+        from store.services.recommendations import is_positive_relation
 
         creating = not self.pk
-        old_rating = self.rate
+        old_rate = None if creating else self.old_rate
+        old_like = False if creating else self.old_like
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            update_book_counters(self.book_id, old_rate, self.rate, self.like - old_like, readers_delta=int(creating),
+                                 similar_dirty=is_positive_relation(self.like, self.rate) !=
+                                 is_positive_relation(old_like, old_rate))
+        bump_books_version()
+
+        self.old_rate = self.rate
+        self.old_like = self.like
 
-        super().save(*args, **kwargs)
 
-        new_rating = self.rate
+class DirtyBookRating(models.Model):
+    """
+    Отметка о том, что рейтинг книги нужно пересчитать (режим BOOK_RATING_MODE = 'deferred').
+    Отметки только добавляются, поэтому параллельные оценки не блокируют друг друга,
+    все отметки одной книги обрабатываются одним пересчетом, см. .services/ratingworker.py
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
 
-        if old_rating != new_rating or creating:
-            set_rating(self.book)
\ No newline at end of file
+
+class BookRanking(models.Model):
+    """
+    Материализованные рейтинги книг (лидерборды): строка на каждую книгу в каждом рейтинге,
+    score - значение, по которому сортируется рейтинг, NULL - книги нет в рейтинге.
+    Обновляются при изменении счетчиков книг, см. .services/leaderboard.py
+    """
+    BOARDS = (
+        ('rating', 'Top rated'),
+        ('likes', 'Most liked'),
+    )
+
+    board = models.CharField(max_length=16, choices=BOARDS)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='rankings')
+    author_name = models.CharField(max_length=255)
+    score = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('board', 'book'), name='store_bookranking_board_book_unique'),
+        ]
+        # страница рейтинга читается по индексу без сортировки всех книг
+        indexes = [
+            models.Index(fields=('board', '-score', 'id'), name='store_ranking_board_score'),
+            models.Index(fields=('board', 'author_name', '-score', 'id'), name='store_ranking_author_score'),
+        ]
+
+
+class BookSimilarity(models.Model):
+    """
+    Похожие книги ("читатели также оценили"): top-K соседей книги по совместным лайкам
+    и высоким оценкам, рассчитываются в .services/recommendations.py
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similar_books')
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('book', 'similar'), name='store_booksimilarity_book_similar_unique'),
+        ]
+        indexes = [
+            models.Index(fields=('book', '-score'), name='store_similarity_book_score'),
+        ]
+
+
+class DirtyBookSimilarity(models.Model):
+    """
+    Отметка о том, что похожие книги нужно пересчитать, аналогично DirtyBookRating
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class AuthorStats(models.Model):
+    """
+    Статистика автора по его книгам (Book.author_name): количество книг, оценки, лайки и диапазон цен.
+    Обновляется при изменении книг и их счетчиков, см. .services/authors.py
+    """
+    author_name = models.CharField(max_length=255, unique=True)
+    books_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating = models.FloatField(null=True)
+    likes_count = models.PositiveIntegerField(default=0)
+    readers_count = models.PositiveIntegerField(default=0)
+    min_price = models.DecimalField(max_digits=7, decimal_places=2, null=True)
+    max_price = models.DecimalField(max_digits=7, decimal_places=2, null=True)
+
+    def __str__(self):
+        return f'{self.author_name}: {self.books_count} books'
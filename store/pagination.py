@@ -0,0 +1,172 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (keyset/cursor).
+    Курсор хранит значения полей сортировки последней записи страницы, следующая страница
+    выбирается условием WHERE (поле, id) > (значение, id) без OFFSET и без запроса COUNT(*),
+    поэтому стоимость страницы не зависит от её глубины.
+    Сортировка берется из OrderingFilter представления, id добавляется для однозначности.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    mode = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    tie_breaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        """
+        Режим включается параметром ?pagination=cursor или наличием курсора в запросе
+        """
+        return (request.query_params.get(cls.mode_query_param) == cls.mode or
+                cls.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, reverse = self.decode_cursor(request, queryset)
+
+        ordering = [self.reverse_field(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_following if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_following
+        self.next_position = self.get_position(results[-1]) if results else position
+        self.previous_position = self.get_position(results[0]) if results else position
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Сортировка из OrderingFilter, либо сортировка queryset, с добавлением id
+        """
+        ordering = None
+        for filter_cls in getattr(view, 'filter_backends', []):
+            if hasattr(filter_cls, 'get_ordering'):
+                ordering = filter_cls().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = queryset.query.order_by or (self.tie_breaker,)
+        ordering = list(ordering)
+        if self.tie_breaker not in [field.lstrip('-') for field in ordering]:
+            ordering.append(self.tie_breaker)
+        return ordering
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def get_position_filter(ordering, position):
+        """
+        Условие "после позиции" для составного ключа:
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...
+        """
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {prev.lstrip('-'): position[prev.lstrip('-')] for prev in ordering[:index]}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[name]}))
+        return reduce(or_, conditions)
+
+    def get_position(self, instance):
+        if isinstance(instance, dict):
+            return {field.lstrip('-'): instance[field.lstrip('-')] for field in self.ordering}
+        return {field.lstrip('-'): getattr(instance, field.lstrip('-')) for field in self.ordering}
+
+    @staticmethod
+    def get_position_field(queryset, name):
+        """
+        Поле модели или аннотации queryset, по которому выполняется сортировка
+        """
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request, queryset):
+        """
+        Позиция и направление из курсора. Значения позиции приводятся к типам полей сортировки (to_python),
+        поэтому измененный клиентом курсор дает 404, а не ошибку в запросе к базе данных
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+            if sorted(position) != sorted(field.lstrip('-') for field in self.ordering):
+                raise ValueError
+            for name, value in position.items():
+                field = self.get_position_field(queryset, name)
+                if value is None and not field.null:
+                    raise ValueError
+                position[name] = field.to_python(value)
+        except (TypeError, ValueError, KeyError, UnicodeError, AttributeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'p': {key: str(value) if isinstance(value, Decimal) else value
+                        for key, value in position.items()}}
+        if reverse:
+            cursor['r'] = 1
+        encoded = b64encode(json.dumps(cursor, default=str).encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.base_url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
@@ -10,10 +10,11 @@ class IsOwnerOrStaffReadOnly(BasePermission):
     def has_object_permission(self, request, view, obj):
         """
         Return `True` if permission is granted, `False` otherwise.
+        Владелец сравнивается по owner_id, без запроса к БД за obj.owner.
         """
         return bool(
             request.method in SAFE_METHODS or
             request.user and
             request.user.is_authenticated and
-            (obj.owner == request.user or request.user.is_staff)
+            (obj.owner_id == request.user.id or request.user.is_staff)
         )
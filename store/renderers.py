@@ -0,0 +1,94 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+'''
+Дополнительные форматы API книг, выбираются заголовком Accept (или ?format=):
+- application/vnd.books.fast+json - тот же JSON, что и у JSONRenderer, кодируется orjson;
+- application/msgpack - MessagePack, такие же значения, как в JSON, но компактнее и быстрее в разборе.
+Форматы подключаются, только если установлены orjson и msgpack.
+'''
+_json_encoder = encoders.JSONEncoder()
+
+
+def encode_default(value):
+    """
+    Значения, которые orjson и msgpack не кодируют сами (Decimal, дата и время, ленивые строки),
+    преобразуются так же, как в JSONRenderer DRF
+    """
+    return _json_encoder.default(value)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON через orjson с теми же значениями, что и JSONRenderer (компактный вывод, UTF-8).
+    Текст совпадает, кроме чисел с плавающей точкой с экспонентой: orjson записывает 1e-05
+    как 0.00001 и 1e+16 как 1e16, значения после разбора те же.
+    С отступами (Accept: ...; indent=N) используется обычный JSONRenderer
+    """
+    media_type = 'application/vnd.books.fast+json'
+    format = 'fastjson'
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS |
+               orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        result = orjson.dumps(data, default=encode_default, option=self.options)
+        # как в JSONRenderer: U+2028 и U+2029 допустимы в JSON, но не в JavaScript
+        return result.replace('\u2028'.encode('utf-8'), b'\\u2028').replace('\u2029'.encode('utf-8'), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True, datetime=False)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as error:
+            raise ParseError(f'MessagePack parse error - {error}')
+
+
+def get_renderer_classes():
+    """
+    Форматы ответов по умолчанию и доступные дополнительные форматы
+    """
+    renderers = list(api_settings.DEFAULT_RENDERER_CLASSES)
+    if orjson is not None:
+        renderers.append(FastJSONRenderer)
+    if msgpack is not None:
+        renderers.append(MessagePackRenderer)
+    return renderers
+
+
+def get_parser_classes():
+    parsers = list(api_settings.DEFAULT_PARSER_CLASSES)
+    if msgpack is not None:
+        parsers.append(MessagePackParser)
+    return parsers
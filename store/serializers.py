@@ -1,8 +1,13 @@
+import decimal
+
 from django.contrib.auth.models import User
+from django.db.models import Manager
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
+from rest_framework.settings import api_settings
 
-from store.models import Book, UserBookRelation
+from store.models import Book, UserBookRelation, BookRanking, BookSimilarity, AuthorStats
+from store.services.getqueryfromdb import get_readers_preview, get_readers_previews
 
 
 class BookReaderSerializer(ModelSerializer):
@@ -18,24 +23,55 @@ class BookReaderSerializer(ModelSerializer):
         fields = ('first_name', 'last_name')
 
 
+class BooksListSerializer(serializers.ListSerializer):
+    """
+    Список книг: первые читатели всех книг выбираются одним запросом (get_readers_previews)
+    """
+
+    def to_representation(self, data):
+        books = list(data.all() if isinstance(data, Manager) else data)
+        if 'readers' in self.child.fields:
+            for book, readers in zip(books, get_readers_previews([book.id for book in books]).values()):
+                book.readers_preview = readers
+        return super().to_representation(books)
+
+
 class BooksSerializer(ModelSerializer):
     """
     Серилизатор для книг, с дополнительными полями, которые являются аннотацией для модели:
     - количество лайков
     - цена с учетом скидки
     - имя владельца
-    - читали книги
+    - читали книги (не более BOOK_READERS_LIMIT) и количество читателей
+    Параметр fields - выводить только эти поля (см. SparseFieldsMixin)
     """
     count_likes = serializers.IntegerField(read_only=True)
     price_with_discount = serializers.DecimalField(max_digits=7, decimal_places=2, read_only=True)
     owner_name = serializers.CharField(read_only=True)
-    readers = BookReaderSerializer(many=True, read_only=True)
+    readers = serializers.SerializerMethodField()
+    readers_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Book
+        list_serializer_class = BooksListSerializer
         fields = (
             'id', 'name', 'price', 'author_name', 'owner_name', 'rating', 'price_with_discount', 'count_likes',
-            'readers')
+            'readers', 'readers_count')
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_readers(self, instance):
+        """
+        Первые читатели книги, выбранные для списка книг (BooksListSerializer), или запросом для одной книги
+        """
+        readers = getattr(instance, 'readers_preview', None)
+        if readers is None:
+            readers = get_readers_previews([instance.id])[instance.id]
+        return BookReaderSerializer(readers, many=True).data
 
 
 class UserBookRelationSerializer(ModelSerializer):
@@ -45,3 +81,147 @@ class UserBookRelationSerializer(ModelSerializer):
     class Meta:
         model = UserBookRelation
         fields = ('book', 'like', 'in_bookmarks', 'rate')
+
+
+class UserBookRelationBulkSerializer(ModelSerializer):
+    """
+    Сериализатор для оценки нескольких книг одним запросом.
+    Книга передается числом и проверяется одним запросом для всего списка, а не отдельно для каждой.
+    """
+    book = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = UserBookRelation
+        fields = ('book', 'like', 'in_bookmarks', 'rate')
+
+
+class BookRankingSerializer(ModelSerializer):
+    """
+    Сериализатор строки лидерборда: книга и её значение в рейтинге score
+    """
+    name = serializers.CharField(source='book.name')
+    rating = serializers.DecimalField(source='book.rating', max_digits=2, decimal_places=1)
+    likes_count = serializers.IntegerField(source='book.likes_count')
+
+    class Meta:
+        model = BookRanking
+        fields = ('book', 'name', 'author_name', 'rating', 'likes_count', 'score')
+
+
+class BookSimilaritySerializer(ModelSerializer):
+    """
+    Сериализатор похожей книги: книга и её похожесть score
+    """
+    book = serializers.IntegerField(source='similar_id')
+    name = serializers.CharField(source='similar.name')
+    author_name = serializers.CharField(source='similar.author_name')
+    rating = serializers.DecimalField(source='similar.rating', max_digits=2, decimal_places=1)
+    likes_count = serializers.IntegerField(source='similar.likes_count')
+
+    class Meta:
+        model = BookSimilarity
+        fields = ('book', 'name', 'author_name', 'rating', 'likes_count', 'score')
+
+
+class AuthorStatsSerializer(ModelSerializer):
+    """
+    Сериализатор статистики автора: количество книг, средний рейтинг по всем оценкам,
+    лайки, читатели и диапазон цен
+    """
+    rating = serializers.DecimalField(max_digits=2, decimal_places=1, read_only=True)
+
+    class Meta:
+        model = AuthorStats
+        fields = ('author_name', 'books_count', 'rating', 'rating_count', 'likes_count', 'readers_count',
+                  'min_price', 'max_price')
+
+
+class BooksFastSerializer:
+    """
+    Быстрая сериализация книг только для чтения, результат совпадает с BooksSerializer.
+    Книги выбираются через .values() (см. prepare), каждое поле преобразуется заранее
+    подготовленной функцией вместо полей DRF, читатели выбираются одним запросом values_list.
+    """
+    serializer_class = BooksSerializer
+    readers_field = 'readers'
+    _converters = None
+
+    def __init__(self, rows, fields=None):
+        self.rows = rows
+        self.fields = fields
+
+    @classmethod
+    def get_converters(cls):
+        """
+        Функции преобразования значений для полей BooksSerializer, строятся один раз
+        """
+        if cls._converters is None:
+            cls._converters = [(name, None if name == cls.readers_field else cls.get_converter(field))
+                               for name, field in cls.serializer_class().fields.items()
+                               if not field.write_only]
+        return cls._converters
+
+    @staticmethod
+    def get_converter(field):
+        if isinstance(field, serializers.DecimalField) and field.decimal_places is not None and \
+                getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) and not field.localize:
+            exponent = decimal.Decimal('.1') ** field.decimal_places
+            context = decimal.getcontext().copy()
+            if field.max_digits is not None:
+                context.prec = field.max_digits
+            rounding = field.rounding
+
+            def to_decimal_string(value):
+                if not isinstance(value, decimal.Decimal):
+                    value = decimal.Decimal(str(value).strip())
+                return '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+            return to_decimal_string
+        if type(field) is serializers.IntegerField:
+            return int
+        if type(field) is serializers.CharField:
+            return str
+        return field.to_representation
+
+    @classmethod
+    def get_field_converters(cls, fields=None):
+        converters = cls.get_converters()
+        if fields is None:
+            return converters
+        return [(name, converter) for name, converter in converters if name in fields]
+
+    @classmethod
+    def prepare(cls, queryset, fields=None):
+        """
+        Queryset книг в виде словарей со столбцами, аннотациями и полями сортировки,
+        нужными для сериализации и постраничного вывода по ключу (id нужен всегда)
+        """
+        names = [name for name, converter in cls.get_field_converters(fields) if converter is not None]
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        extra = [name for name in dict.fromkeys(['id', *queryset.query.annotations, *ordering]) if name not in names]
+        return queryset.prefetch_related(None).values(*names, *extra)
+
+    @staticmethod
+    def get_readers(book_ids):
+        readers = {book_id: [] for book_id in book_ids}
+        for book_id, first_name, last_name in get_readers_preview(book_ids).values_list(
+                'book_id', 'user__first_name', 'user__last_name'):
+            readers[book_id].append({'first_name': first_name, 'last_name': last_name})
+        return readers
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        converters = self.get_field_converters(self.fields)
+        with_readers = any(converter is None for _, converter in converters)
+        readers = self.get_readers([row['id'] for row in rows]) if rows and with_readers else {}
+        result = []
+        for row in rows:
+            book = {}
+            for name, converter in converters:
+                if converter is None:
+                    book[name] = readers[row['id']]
+                    continue
+                value = row[name]
+                book[name] = None if value is None else converter(value)
+            result.append(book)
+        return result
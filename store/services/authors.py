@@ -0,0 +1,181 @@
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum, Min, Max, FloatField, ExpressionWrapper, Value, Case, When, F, \
+    OuterRef, Subquery
+from django.db.models.functions import Cast, NullIf
+
+from store.models import Book, AuthorStats
+
+'''
+Статистика авторов: таблица AuthorStats с одной строкой на Book.author_name.
+Счетчики авторов изменяются инкрементально: изменения счетчиков книг, добавление, удаление и смена
+автора книги прибавляются к строке автора атомарным UPDATE через F() (поле = поле + изменение),
+как счетчики книг в update_books_counters, поэтому параллельные изменения книг одного автора не теряются.
+Минимальная и максимальная цена пересчитываются по книгам автора (индекс (author_name, id))
+только при сохранении и удалении книг. Запросы API авторов читают только AuthorStats.
+'''
+BOOK_COUNTERS = ('rating_sum', 'rating_count', 'likes_count', 'readers_count')
+COUNTERS = ('books_count', *BOOK_COUNTERS)
+STATS_FIELDS = ('books_count', 'rating_sum', 'rating_count', 'rating', 'likes_count', 'readers_count',
+                'min_price', 'max_price')
+
+
+def get_rating_expression(rating_sum, rating_count):
+    return ExpressionWrapper(Cast(rating_sum, FloatField()) / NullIf(rating_count, Value(0)), output_field=FloatField())
+
+
+def get_author_books_stats(author_names):
+    """
+    Статистика книг авторов author_names (список имен или queryset .values('author_name'))
+    """
+    # имена аннотаций отличаются от полей книги, столбцы вставляются в порядке STATS_FIELDS
+    return Book.objects.filter(author_name__in=author_names).values('author_name').annotate(
+        stats_books_count=Count('id'),
+        stats_rating_sum=Sum('rating_sum'),
+        stats_rating_count=Sum('rating_count'),
+        stats_rating=get_rating_expression(Sum('rating_sum'), Sum('rating_count')),
+        stats_likes_count=Sum('likes_count'),
+        stats_readers_count=Sum('readers_count'),
+        stats_min_price=Min('price'),
+        stats_max_price=Max('price'),
+    ).order_by()
+
+
+def get_upsert_sql(stats):
+    """
+    INSERT строк статистики из queryset stats (столбцы author_name и STATS_FIELDS) ... ON CONFLICT DO UPDATE
+    """
+    quote = connection.ops.quote_name
+    table = quote(AuthorStats._meta.db_table)
+    select, params = stats.query.sql_with_params()
+    columns = ', '.join(quote(field) for field in ('author_name', *STATS_FIELDS))
+    updates = [f'{quote(field)} = EXCLUDED.{quote(field)}' for field in STATS_FIELDS]
+    # WHERE true - требование SQLite для INSERT ... SELECT с ON CONFLICT
+    sql = (f'INSERT INTO {table} ({columns}) '
+           f'SELECT * FROM ({select}) stats WHERE true '
+           f'ON CONFLICT (author_name) DO UPDATE SET {", ".join(updates)}')
+    return sql, params
+
+
+def execute_upsert(stats):
+    with connection.cursor() as cursor:
+        cursor.execute(*get_upsert_sql(stats))
+
+
+def apply_authors_deltas(author_deltas):
+    """
+    Прибавление изменений к счетчикам авторов, author_deltas: {имя автора: {счетчик: изменение}}.
+    Строки новых авторов создаются, затем счетчики и рейтинг всех авторов меняются одним
+    атомарным UPDATE через F(), как счетчики книг в update_books_counters
+    """
+    author_deltas = {name: delta for name, delta in author_deltas.items() if any(delta.values())}
+    if not author_deltas:
+        return
+    new_authors = [name for name, delta in author_deltas.items() if delta.get('books_count', 0) > 0]
+    if new_authors:
+        AuthorStats.objects.bulk_create([AuthorStats(author_name=name) for name in new_authors], ignore_conflicts=True)
+
+    def delta_expression(counter):
+        values = {name: delta.get(counter, 0) for name, delta in author_deltas.items()}
+        if len(set(values.values())) == 1:
+            return Value(next(iter(values.values())))
+        return Case(*[When(author_name=name, then=Value(value)) for name, value in values.items()], default=Value(0))
+
+    counters = {counter: F(counter) + delta_expression(counter) for counter in COUNTERS
+                if any(delta.get(counter) for delta in author_deltas.values())}
+
+    if 'rating_sum' in counters or 'rating_count' in counters:
+        counters['rating'] = get_rating_expression(F('rating_sum') + delta_expression('rating_sum'),
+                                                   F('rating_count') + delta_expression('rating_count'))
+
+    AuthorStats.objects.filter(author_name__in=list(author_deltas)).update(**counters)
+
+
+def update_authors_counters(deltas):
+    """
+    Изменение счетчиков авторов по изменениям счетчиков книг deltas ({id книги: {счетчик: изменение}}),
+    вызывается из update_books_counters. Два запроса: имена авторов книг и UPDATE
+    """
+    deltas = {book_id: delta for book_id, delta in deltas.items() if any(delta.get(counter) for counter in COUNTERS)}
+    if not deltas:
+        return
+    author_deltas = defaultdict(Counter)
+    for book_id, author_name in Book.objects.filter(pk__in=list(deltas)).values_list('id', 'author_name'):
+        author_deltas[author_name].update({counter: deltas[book_id].get(counter, 0) for counter in BOOK_COUNTERS})
+    apply_authors_deltas(author_deltas)
+
+
+def move_book(book, old_author_name, new_author_name):
+    """
+    Перенос вклада книги book (одна книга и её счетчики) от автора old_author_name к new_author_name:
+    при создании книги old_author_name - None, перед удалением new_author_name - None.
+    Счетчики существующей книги читаются из базы с блокировкой строки до конца транзакции,
+    чтобы параллельное изменение её счетчиков не попало к прежнему автору после переноса
+    """
+    if old_author_name is None:
+        contribution = {counter: getattr(book, counter) for counter in BOOK_COUNTERS}
+    else:
+        contribution = Book.objects.select_for_update().filter(pk=book.pk).values(*BOOK_COUNTERS).first()
+        if contribution is None:
+            return
+    contribution['books_count'] = 1
+    author_deltas = defaultdict(Counter)
+    if old_author_name is not None:
+        author_deltas[old_author_name].subtract(contribution)
+    if new_author_name is not None:
+        author_deltas[new_author_name].update(contribution)
+    apply_authors_deltas(author_deltas)
+
+
+def add_new_books(author_names):
+    """
+    Новые книги без оценок (импорт через bulk_create): количество книг авторов увеличивается
+    на количество их имен в author_names
+    """
+    apply_authors_deltas({name: {'books_count': count} for name, count in Counter(author_names).items()})
+
+
+def refresh_prices(author_names, delete_empty=False):
+    """
+    Пересчет минимальной и максимальной цены книг авторов author_names.
+    delete_empty - удалить авторов, у которых не осталось книг (после удаления книги или смены автора)
+    """
+    author_names = list(author_names)
+    books = Book.objects.filter(author_name=OuterRef('author_name')).order_by().values('author_name')
+    AuthorStats.objects.filter(author_name__in=author_names).update(
+        min_price=Subquery(books.annotate(value=Min('price')).values('value')),
+        max_price=Subquery(books.annotate(value=Max('price')).values('value')),
+    )
+    if delete_empty:
+        AuthorStats.objects.filter(author_name__in=author_names, books_count__lte=0).delete()
+
+
+def refresh_authors(author_names):
+    """
+    Полный пересчет статистики авторов author_names (список имен или queryset .values('author_name'))
+    по всем их книгам. Используется для восстановления статистики, в обычной работе
+    статистика изменяется инкрементально
+    """
+    execute_upsert(get_author_books_stats(author_names))
+
+
+def refresh_books_authors(books):
+    """
+    Полный пересчет статистики авторов книг из queryset books, один запрос
+    """
+    refresh_authors(books.order_by().values('author_name'))
+
+
+def rebuild_authors():
+    """
+    Полное перестроение статистики всех авторов
+    """
+    with transaction.atomic():
+        AuthorStats.objects.all().delete()
+        refresh_authors(Book.objects.order_by().values('author_name'))
+    return AuthorStats.objects.count()
+
+
+def get_authors():
+    return AuthorStats.objects.order_by('author_name')
@@ -0,0 +1,75 @@
+import csv
+import json
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from store.serializers import BooksSerializer
+
+'''
+Потоковая выгрузка книг в NDJSON или CSV с полями BooksSerializer.
+Книги выбираются пачками по ключу id > последний id пачки (каждая пачка - запрос книг и запрос читателей),
+поэтому расход памяти постоянный, а первые строки отдаются сразу после первой пачки.
+'''
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer, возвращает записанную строку
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_books(queryset, chunk_size=None):
+    """
+    Сериализованные книги queryset пачками по chunk_size в порядке id
+    """
+    chunk_size = chunk_size or settings.BOOK_EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('id')
+    last_id = None
+    while True:
+        chunk = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield from BooksSerializer(chunk, many=True).data
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].id
+
+
+def export_ndjson(books):
+    for book in books:
+        yield json.dumps(book, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+def export_csv(books):
+    """
+    Вложенные поля (readers) записываются в ячейку строкой JSON
+    """
+    writer = csv.writer(Echo())
+    fields = BooksSerializer.Meta.fields
+    yield writer.writerow(fields)
+    for book in books:
+        yield writer.writerow([
+            json.dumps(book[field], cls=JSONEncoder, ensure_ascii=False)
+            if isinstance(book[field], (list, dict)) else book[field]
+            for field in fields
+        ])
+
+
+def export_books(queryset, file_format='ndjson', chunk_size=None):
+    """
+    Генератор строк выгрузки книг в формате file_format
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown format "{file_format}", expected one of {", ".join(FORMATS)}.')
+    books = iter_books(queryset, chunk_size)
+    return export_csv(books) if file_format == 'csv' else export_ndjson(books)
@@ -0,0 +1,94 @@
+import codecs
+import csv
+import json
+
+from django.conf import settings
+
+from store.models import Book
+from store.serializers import BooksSerializer
+from store.services.authors import add_new_books, refresh_prices
+from store.services.cache import bump_books_version
+
+'''
+Потоковый импорт книг из CSV (с заголовком) или NDJSON (один JSON объект в строке).
+Файл читается построчно, строки проверяются по правилам BooksSerializer и сохраняются
+пачками через bulk_create, поэтому расход памяти не зависит от размера файла.
+'''
+FORMATS = ('csv', 'ndjson')
+
+
+def get_import_format(filename, default='csv'):
+    """
+    Формат файла по расширению
+    """
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return default
+
+
+def read_rows(stream, file_format, encoding='utf-8-sig'):
+    """
+    Построчное чтение бинарного потока, возвращает пары (номер строки, данные или ошибка)
+    """
+    lines = codecs.iterdecode(stream, encoding)
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # пустые ячейки считаем отсутствующими значениями, лишние ячейки без заголовка отбрасываем
+            yield reader.line_num, {key: value for key, value in row.items() if key is not None and value != ''}
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, ValueError('Invalid JSON.')
+            continue
+        if not isinstance(row, dict):
+            yield number, ValueError('Expected a JSON object.')
+            continue
+        yield number, row
+
+
+def save_batch(batch):
+    """
+    Сохранение пачки книг одним INSERT и обновление статистики их авторов
+    """
+    created = len(Book.objects.bulk_create(batch))
+    add_new_books(book.author_name for book in batch)
+    refresh_prices({book.author_name for book in batch})
+    return created
+
+
+def import_books(stream, file_format='csv', owner=None, batch_size=None):
+    """
+    Импорт книг из потока, ошибочные строки пропускаются и возвращаются в errors.
+    Возвращает {'created': количество созданных книг, 'errors': [{'row': номер строки, 'errors': ...}]}
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown format "{file_format}", expected one of {", ".join(FORMATS)}.')
+    batch_size = batch_size or settings.BOOK_IMPORT_BATCH_SIZE
+    created = 0
+    errors = []
+    batch = []
+
+    for number, row in read_rows(stream, file_format):
+        if isinstance(row, Exception):
+            errors.append({'row': number, 'errors': {'non_field_errors': [str(row)]}})
+            continue
+        serializer = BooksSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append({'row': number, 'errors': serializer.errors})
+            continue
+        batch.append(Book(owner=owner, **serializer.validated_data))
+        if len(batch) >= batch_size:
+            created += save_batch(batch)
+            batch = []
+
+    if batch:
+        created += save_batch(batch)
+    if created:
+        bump_books_version()
+    return {'created': created, 'errors': errors}
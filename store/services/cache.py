@@ -0,0 +1,58 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+'''
+Кэширование ответов API книг с инвалидацией по номеру версии.
+Номер версии увеличивается при любом изменении Book или UserBookRelation,
+ключи кэша содержат номер версии, поэтому старые ответы просто перестают использоваться.
+'''
+BOOKS_VERSION_KEY = 'books:version'
+
+
+def get_books_cache():
+    return caches[settings.BOOK_CACHE_ALIAS]
+
+
+def get_books_version():
+    """
+    Текущая версия данных книг. Начальное значение берется из времени,
+    чтобы после вытеснения ключа из кэша версия не повторилась.
+    """
+    cache = get_books_cache()
+    version = cache.get(BOOKS_VERSION_KEY)
+    if version is None:
+        cache.add(BOOKS_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(BOOKS_VERSION_KEY)
+    return version
+
+
+def _increment_books_version():
+    cache = get_books_cache()
+    try:
+        cache.incr(BOOKS_VERSION_KEY)
+    except ValueError:
+        get_books_version()
+
+
+def bump_books_version():
+    """
+    Инвалидация кэша книг: версия увеличивается сразу и ещё раз после фиксации транзакции,
+    чтобы не остались ответы, закэшированные по данным до фиксации
+    """
+    _increment_books_version()
+    transaction.on_commit(_increment_books_version)
+
+
+def get_request_cache_key(request, prefix):
+    """
+    Ключ кэша по адресу и нормализованной строке запроса (параметры отсортированы) и версии данных
+    """
+    query = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+    url = request.build_absolute_uri(request.path)
+    digest = hashlib.md5(f'{url}?{query}'.encode('utf-8')).hexdigest()
+    return f'{prefix}:{get_books_version()}:{digest}'
@@ -1,21 +1,95 @@
-from django.db.models import Count, Case, When, F
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
 from store.models import Book, UserBookRelation
 
+# полки личной библиотеки: условие на оценку пользователя
+SHELVES = {
+    'bookmarks': {'in_bookmarks': True},
+    'likes': {'like': True},
+    'rated': {'rate__isnull': False},
+}
 
-def get_books_with_annotate():
+
+def get_readers_preview(book_ids):
+    """
+    Оценки с первыми BOOK_READERS_LIMIT читателями книг book_ids в порядке добавления.
+    Номер оценки в книге считается оконной функцией ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id)
+    по оценкам только этих книг, один проход по индексу книги вместо подзапроса для каждой оценки
+    """
+    quote = connection.ops.quote_name
+    ranked = UserBookRelation.objects.filter(book_id__in=book_ids).annotate(
+        position=Window(RowNumber(), partition_by=[F('book_id')], order_by=F('id').asc())).values('id', 'position')
+    sql, params = ranked.query.sql_with_params()
+    first_relations = RawSQL(f'SELECT {quote("id")} FROM ({sql}) {quote("ranked")} WHERE {quote("position")} <= %s',
+                             (*params, settings.BOOK_READERS_LIMIT))
+    return UserBookRelation.objects.filter(id__in=first_relations).order_by('id')
+
+
+def get_readers_previews(book_ids):
+    """
+    Первые BOOK_READERS_LIMIT читателей каждой книги одним запросом: {id книги: [читатели]},
+    выбираются только имя и фамилия читателя
+    """
+    readers = {book_id: [] for book_id in book_ids}
+    if readers:
+        for relation in get_readers_preview(list(readers)).select_related('user').only(
+                'book', 'user__first_name', 'user__last_name'):
+            readers[relation.book_id].append(relation.user)
+    return readers
+
+
+# аннотации книг: поле сериализатора -> выражение
+BOOK_ANNOTATIONS = {
+    'count_likes': lambda: F('likes_count'),
+    'price_with_discount': lambda: F('price') - F('discount'),
+    'owner_name': lambda: F('owner__username'),
+}
+
+
+def get_books_with_annotate(fields=None, extra_columns=()):
     """
     Делаем запрос к Book и делаемвозвращаем queryset
     с дополнительной аннотацией:
-    - количество лайков
+    - количество лайков (хранится в книге и поддерживается при оценке, без GROUP BY)
     - цена с учетом скидки
     - имя владельца книги
+    Первые читатели книг выбираются сериализатором одним запросом на страницу (get_readers_previews).
+    При заданных fields (поля BooksSerializer) добавляются только нужные им аннотации и соединения,
+    из столбцов книги выбираются только эти поля и extra_columns (сортировка)
+    """
+    if fields is None:
+        fields = list(BOOK_ANNOTATIONS)
+        queryset = Book.objects.all()
+    else:
+        columns = {field.name for field in Book._meta.concrete_fields}
+        queryset = Book.objects.only('id', *[name for name in [*fields, *extra_columns] if name in columns])
+    queryset = queryset.annotate(**{name: expression() for name, expression in BOOK_ANNOTATIONS.items()
+                                    if name in fields})
+    return queryset.order_by('id')
+
+
+def get_user_books(user, shelf):
+    """
+    Делаем запрос к книгам полки пользователя (SHELVES) с аннотациями get_books_with_annotate,
+    последние добавленные первыми. Оценки выбираются по частичному индексу полки (user, id)
+    """
+    conditions = {f'userbookrelation__{lookup}': value for lookup, value in SHELVES[shelf].items()}
+    return get_books_with_annotate().filter(userbookrelation__user=user, **conditions).annotate(
+        relation_id=F('userbookrelation__id')).order_by('-relation_id')
+
+
+def get_book_readers(book_id):
+    """
+    Делаем запрос к читателям книги в порядке добавления оценок,
+    выбираются только имя и фамилия читателя
     """
-    return Book.objects.all().annotate(
-        count_likes=Count(Case(When(userbookrelation__like=True, then=1))),
-        price_with_discount=F('price') - F('discount'),
-        owner_name=F('owner__username')
-    ).prefetch_related('readers').order_by('id')
+    return User.objects.filter(userbookrelation__book_id=book_id).only(
+        'first_name', 'last_name').order_by('userbookrelation__id')
 
 
 def get_user_book_relation():
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+from store.models import Book, BookRanking
+
+'''
+Лидерборды книг: рейтинги хранятся в таблице BookRanking и обновляются при изменении
+счетчиков книг (refresh_rankings), страница рейтинга читается по индексу (board, score, id),
+поэтому время чтения не зависит от количества книг.
+Место в рейтинге по оценкам - байесовское среднее: (сумма оценок + BOOK_LEADERBOARD_PRIOR_MEAN *
+BOOK_LEADERBOARD_PRIOR_VOTES) / (количество оценок + BOOK_LEADERBOARD_PRIOR_VOTES), поэтому
+одна оценка 5 не поднимает книгу выше книги с сотней оценок 4.9. Рейтинг по лайкам - их количество.
+'''
+BOARDS = dict(BookRanking.BOARDS)
+
+
+def get_refresh_sql(books):
+    """
+    Один INSERT ... SELECT ... ON CONFLICT DO UPDATE значений всех рейтингов книг из queryset books
+    """
+    quote = connection.ops.quote_name
+    book_ids, params = books.order_by().values('id').query.sql_with_params()
+    prior_votes = settings.BOOK_LEADERBOARD_PRIOR_VOTES
+    prior_sum = settings.BOOK_LEADERBOARD_PRIOR_MEAN * prior_votes
+    sql = (
+        f'INSERT INTO {quote(BookRanking._meta.db_table)} (board, book_id, author_name, score) '
+        f'SELECT %s, id, author_name, CASE WHEN rating_count > 0 '
+        f'THEN (rating_sum + %s) / (rating_count + %s) END '
+        f'FROM {quote(Book._meta.db_table)} WHERE id IN ({book_ids}) '
+        f'UNION ALL '
+        f'SELECT %s, id, author_name, NULLIF(likes_count, 0) '
+        f'FROM {quote(Book._meta.db_table)} WHERE id IN ({book_ids}) '
+        f'ON CONFLICT (board, book_id) DO UPDATE SET author_name = EXCLUDED.author_name, score = EXCLUDED.score'
+    )
+    return sql, ['rating', float(prior_sum), prior_votes, *params, 'likes', *params]
+
+
+def refresh_rankings(books):
+    """
+    Обновление всех рейтингов книг из queryset books одним запросом
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(*get_refresh_sql(books))
+
+
+def rebuild_rankings():
+    """
+    Полное перестроение рейтингов всех книг
+    """
+    with transaction.atomic():
+        BookRanking.objects.all().delete()
+        refresh_rankings(Book.objects.all())
+    return BookRanking.objects.count()
+
+
+def get_leaderboard(board, author_name=None):
+    """
+    Книги рейтинга board (при author_name - только книги автора) в порядке убывания score
+    """
+    rankings = BookRanking.objects.filter(board=board, score__isnull=False)
+    if author_name is not None:
+        rankings = rankings.filter(author_name=author_name)
+    return rankings.select_related('book').only(
+        'id', 'score', 'author_name', 'book__id', 'book__name', 'book__rating', 'book__likes_count'
+    ).order_by('-score', 'id')
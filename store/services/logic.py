@@ -1,12 +1,409 @@
-from django.db.models import Avg
+import threading
+from collections import Counter, defaultdict
 
-from store.models import UserBookRelation
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum, Count, Case, When, F, FloatField, Value, ExpressionWrapper, PositiveIntegerField, \
+    Avg, OuterRef, Subquery, Q
+from django.db.models.functions import Cast, NullIf, Coalesce
+from django.utils import timezone
+
+from store.models import Book, UserBookRelation, DirtyBookRating
+from store.services.authors import refresh_books_authors, update_authors_counters, apply_authors_deltas, \
+    move_book, refresh_prices
+from store.services.cache import bump_books_version
+from store.services.leaderboard import refresh_rankings
+from store.services.recommendations import is_positive_relation, mark_similar_dirty
 
 '''
 Дополнительная логика для расчета среднего рейтинга книги
 '''
+COUNTERS = ('rating_sum', 'rating_count', 'likes_count', 'readers_count')
+RELATION_FIELDS = ('like', 'in_bookmarks', 'rate')
+
+
 def set_rating(book):
-    rating = UserBookRelation.objects.filter(book=book).aggregate(rating=Avg('rate')).get('rating')
-    book.rating = rating
-    book.save()
+    """
+    Полный пересчет суммы, количества оценок и рейтинга книги по всем её оценкам.
+    Используется для восстановления счетчиков, в обычной работе вызывается update_book_counters.
+    """
+    counters = recompute_ratings([book.pk])
+    book.rating_sum, book.rating_count, book.rating = counters.get(book.pk, (0, 0, None))
+
+
+def recompute_ratings(book_ids):
+    """
+    Полный пересчет суммы, количества оценок и рейтинга книг: один запрос агрегации оценок
+    и один UPDATE всех книг. Возвращает {id книги: (сумма, количество, рейтинг)}
+    """
+    book_ids = list(book_ids)
+    if not book_ids:
+        return {}
+    counters = {book_id: (0, 0, None) for book_id in book_ids}
+    # старые значения и авторы для изменения статистики авторов, строки книг блокируются до конца транзакции
+    old = {book_id: (author_name, rating_sum, rating_count) for book_id, author_name, rating_sum, rating_count in
+           Book.objects.select_for_update().filter(pk__in=book_ids).values_list(
+               'id', 'author_name', 'rating_sum', 'rating_count')}
+    for row in UserBookRelation.objects.filter(book_id__in=book_ids, rate__isnull=False).values(
+            'book_id').annotate(rating_sum=Sum('rate'), rating_count=Count('rate')).order_by():
+        counters[row['book_id']] = (row['rating_sum'], row['rating_count'],
+                                    row['rating_sum'] / row['rating_count'])
+
+    def value_expression(index, output_field):
+        return Case(*[When(pk=book_id, then=Value(values[index])) for book_id, values in counters.items()],
+                    output_field=output_field)
+
+    Book.objects.filter(pk__in=book_ids).update(
+        rating_sum=value_expression(0, PositiveIntegerField()),
+        rating_count=value_expression(1, PositiveIntegerField()),
+        rating=value_expression(2, FloatField()),
+        updated_at=timezone.now()
+    )
+    refresh_rankings(Book.objects.filter(pk__in=book_ids))
+    author_deltas = defaultdict(Counter)
+    for book_id, (author_name, rating_sum, rating_count) in old.items():
+        author_deltas[author_name].update(rating_sum=counters[book_id][0] - rating_sum,
+                                          rating_count=counters[book_id][1] - rating_count)
+    apply_authors_deltas(author_deltas)
+    bump_books_version()
+    return counters
+
+
+def rebuild_book_counters(queryset=None):
+    """
+    Полный пересчет всех счетчиков книг одним UPDATE с коррелированными подзапросами,
+    используется после массовой загрузки оценок в обход UserBookRelation.save (bulk_create).
+    Возвращает количество обновленных книг
+    """
+    queryset = Book.objects.all() if queryset is None else queryset
+
+    def counter(aggregate, output_field):
+        relations = UserBookRelation.objects.filter(book=OuterRef('pk')).order_by().values('book')
+        return Subquery(relations.annotate(value=aggregate).values('value'), output_field=output_field)
+
+    updated = queryset.update(
+        rating_sum=Coalesce(counter(Sum('rate'), PositiveIntegerField()), Value(0)),
+        rating_count=Coalesce(counter(Count('rate'), PositiveIntegerField()), Value(0)),
+        rating=counter(Avg('rate'), FloatField()),
+        likes_count=Coalesce(counter(Count('id', filter=Q(like=True)), PositiveIntegerField()), Value(0)),
+        readers_count=Coalesce(counter(Count('id'), PositiveIntegerField()), Value(0)),
+        updated_at=timezone.now()
+    )
+    refresh_rankings(queryset)
+    refresh_books_authors(queryset)
+    bump_books_version()
+    return updated
+
+
+def is_rating_deferred():
+    """
+    Режим отложенного пересчета рейтинга, см. BOOK_RATING_MODE в settings
+    """
+    return settings.BOOK_RATING_MODE == 'deferred'
+
+
+def mark_rating_dirty(book_ids):
+    """
+    Отметка книг для отложенного пересчета рейтинга, запускает фоновый обработчик, если он включен
+    """
+    from store.services.ratingworker import ensure_rating_worker
+
+    DirtyBookRating.objects.bulk_create([DirtyBookRating(book_id=book_id) for book_id in book_ids])
+    ensure_rating_worker()
+
+
+def get_counters_delta(old_rate=None, new_rate=None, likes_delta=0, readers_delta=0):
+    """
+    Изменение счетчиков книги при замене оценки old_rate на new_rate
+    """
+    return {
+        'rating_sum': (new_rate or 0) - (old_rate or 0),
+        'rating_count': (new_rate is not None) - (old_rate is not None),
+        'likes_count': likes_delta,
+        'readers_count': readers_delta,
+    }
+
+
+def update_book_counters(book_id, old_rate=None, new_rate=None, likes_delta=0, readers_delta=0,
+                         similar_dirty=False):
+    """
+    Инкрементальное обновление счетчиков книги при добавлении, изменении или удалении оценки и лайка.
+    similar_dirty - оценка стала положительной или перестала ею быть (is_positive_relation)
+    """
+    update_books_counters({book_id: get_counters_delta(old_rate, new_rate, likes_delta, readers_delta)},
+                          [book_id] if similar_dirty else ())
+
+
+def update_books_counters(deltas, similar_dirty=()):
+    """
+    Инкрементальное обновление счетчиков нескольких книг, deltas: {id книги: изменения счетчиков}.
+    Сумма и количество оценок, рейтинг, количество лайков и читателей всех книг меняются одним
+    атомарным UPDATE через F(), поэтому одновременные оценки разных пользователей не теряются
+    и оценки книг не перечитываются.
+    В режиме отложенного пересчета рейтинга книги с измененными оценками только отмечаются.
+    Книги similar_dirty, положительность оценок которых изменилась, отмечаются для пересчета похожих книг.
+    """
+    if similar_dirty:
+        mark_similar_dirty(similar_dirty)
+
+    if is_rating_deferred():
+        dirty = [book_id for book_id, delta in deltas.items() if delta['rating_sum'] or delta['rating_count']]
+        if dirty:
+            mark_rating_dirty(dirty)
+        deltas = {book_id: dict(delta, rating_sum=0, rating_count=0) for book_id, delta in deltas.items()}
+
+    deltas = {book_id: delta for book_id, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    def delta_expression(counter):
+        values = {book_id: delta[counter] for book_id, delta in deltas.items()}
+        if len(set(values.values())) == 1:
+            return Value(next(iter(values.values())))
+        return Case(*[When(pk=book_id, then=Value(value)) for book_id, value in values.items()], default=Value(0))
+
+    counters = {counter: F(counter) + delta_expression(counter) for counter in COUNTERS
+                if any(delta[counter] for delta in deltas.values())}
+
+    if 'rating_sum' in counters or 'rating_count' in counters:
+        counters['rating'] = ExpressionWrapper(
+            Cast(F('rating_sum') + delta_expression('rating_sum'), FloatField()) /
+            NullIf(F('rating_count') + delta_expression('rating_count'), Value(0)),
+            output_field=FloatField()
+        )
+
+    Book.objects.filter(pk__in=list(deltas)).update(updated_at=timezone.now(), **counters)
+    refresh_rankings(Book.objects.filter(pk__in=list(deltas)))
+    update_authors_counters(deltas)
+
+
+_deleting = threading.local()
+
+
+def get_deleting(name):
+    """
+    Множество id удаляемых в текущем потоке книг (books) или пользователей (users)
+    """
+    if not hasattr(_deleting, name):
+        setattr(_deleting, name, set())
+    return getattr(_deleting, name)
+
+
+def relation_post_delete(sender, instance, **kwargs):
+    """
+    Обработчик post_delete оценки: вычитаем её из суммы и количества оценок книги, из количества
+    лайков и читателей. Срабатывает и при QuerySet.delete() и каскадном удалении.
+    Оценки удаляемой книги пропускаются, оценки удаляемого пользователя уже вычтены в user_pre_delete
+    """
+    if instance.book_id in get_deleting('books') or instance.user_id in get_deleting('users'):
+        return
+    with transaction.atomic():
+        update_book_counters(instance.book_id, instance.old_rate, None, -instance.old_like, readers_delta=-1,
+                             similar_dirty=is_positive_relation(instance.old_like, instance.old_rate))
+    bump_books_version()
+
+
+def user_pre_delete(sender, instance, **kwargs):
+    """
+    Обработчик pre_delete пользователя: все его оценки вычитаются из счетчиков книг одним UPDATE
+    до каскадного удаления оценок
+    """
+    relations = UserBookRelation.objects.filter(user=instance).exclude(
+        book_id__in=get_deleting('books')).values_list('book_id', 'like', 'rate')
+    deltas, similar_dirty = {}, []
+    for book_id, like, rate in relations:
+        deltas[book_id] = get_counters_delta(rate, None, -int(like), readers_delta=-1)
+        if is_positive_relation(like, rate):
+            similar_dirty.append(book_id)
+    get_deleting('users').add(instance.pk)
+    if deltas:
+        update_books_counters(deltas, similar_dirty)
+        bump_books_version()
+
+
+def user_post_delete(sender, instance, **kwargs):
+    get_deleting('users').discard(instance.pk)
+
+
+def book_pre_delete(sender, instance, **kwargs):
+    """
+    Обработчик pre_delete книги, срабатывает и при QuerySet.delete(): вклад книги вычитается
+    из статистики её автора. Оценки удаляются вместе с книгой, её счетчики не изменяются
+    """
+    if instance.old_author_name is None:
+        instance.old_author_name = instance.author_name
+    move_book(instance, instance.old_author_name, None)
+    get_deleting('books').add(instance.pk)
+
+
+def book_post_delete(sender, instance, **kwargs):
+    """
+    Обработчик post_delete книги: цены автора пересчитываются без удаленной книги,
+    автор без книг удаляется
+    """
+    refresh_prices([instance.old_author_name], delete_empty=True)
+    get_deleting('books').discard(instance.pk)
+
+
+def get_insert_relation_sql():
+    """
+    INSERT ... ON CONFLICT (user_id, book_id) DO NOTHING для новой оценки книги пользователем.
+    Строка вставляется из SELECT по книге, поэтому для несуществующей книги ничего не возвращается,
+    для уже существующей оценки (в том числе вставленной параллельно, запрос ждет её фиксации) - тоже
+    """
+    quote = connection.ops.quote_name
+    table, book_table = quote(UserBookRelation._meta.db_table), quote(Book._meta.db_table)
+    columns = ', '.join(quote(field) for field in RELATION_FIELDS)
+    return (
+        f'INSERT INTO {table} ({quote("user_id")}, {quote("book_id")}, {columns}) '
+        f'SELECT %s, {quote("id")}, %s, %s, %s FROM {book_table} WHERE {quote("id")} = %s '
+        f'ON CONFLICT ({quote("user_id")}, {quote("book_id")}) DO NOTHING '
+        f'RETURNING {quote("id")}, {columns}'
+    )
+
+
+def get_update_relation_sql(fields):
+    """
+    UPDATE существующей оценки, который возвращает и новые, и старые значения like и rate (PostgreSQL):
+    старая строка читается подзапросом с FOR UPDATE, поэтому при параллельных изменениях
+    запрос ждет блокировку и видит последнюю зафиксированную версию строки
+    """
+    quote = connection.ops.quote_name
+    table = quote(UserBookRelation._meta.db_table)
+    updates = ', '.join(f'{quote(field)} = %s' for field in fields) or f'{quote("like")} = {table}.{quote("like")}'
+    returning = ', '.join(f'{table}.{quote(field)}' for field in ('id', *RELATION_FIELDS))
+    return (
+        f'UPDATE {table} SET {updates} '
+        f'FROM (SELECT {quote("id")}, {quote("like")}, {quote("rate")} FROM {table} '
+        f'WHERE {quote("user_id")} = %s AND {quote("book_id")} = %s FOR UPDATE) old '
+        f'WHERE {table}.{quote("id")} = old.{quote("id")} '
+        f'RETURNING {returning}, old.{quote("like")}, old.{quote("rate")}'
+    )
+
+
+def update_relation(cursor, user, book_id, values):
+    """
+    Изменение существующей оценки: (id, like, in_bookmarks, rate, старый like, старая оценка) или None.
+    В PostgreSQL - одним запросом get_update_relation_sql, в остальных базах данных (SQLite)
+    строка читается и изменяется после INSERT, который уже занял блокировку записи базы данных
+    """
+    fields = [field for field in RELATION_FIELDS if field in values]
+    if connection.vendor == 'postgresql':
+        cursor.execute(get_update_relation_sql(fields), [values[field] for field in fields] + [user.pk, book_id])
+        return cursor.fetchone()
+
+    relations = UserBookRelation.objects.select_for_update().filter(user=user, book_id=book_id)
+    old = relations.values_list('id', *RELATION_FIELDS).first()
+    if old is None:
+        return None
+    if fields:
+        relations.update(**{field: values[field] for field in fields})
+    new = dict(zip(RELATION_FIELDS, old[1:]), **values)
+    return (old[0], new['like'], new['in_bookmarks'], new['rate'], old[1], old[3])
+
+
+def upsert_relation(user, book_id, values):
+    """
+    Создание или изменение оценки книги пользователем по ограничению (user, book) вместо get_or_create
+    и save, с обновлением счетчиков книги. values - поля like, in_bookmarks, rate, отсутствующие поля
+    не изменяются (при создании - по умолчанию).
+    Новая оценка вставляется INSERT ... ON CONFLICT DO NOTHING, если оценка уже есть - изменяется
+    с блокировкой строки, и счетчики считаются от её значений на момент изменения, поэтому параллельные
+    первые оценки одной книги одним пользователем не учитываются дважды.
+    Возвращает UserBookRelation или None, если книги нет.
+    """
+    params = [user.pk, values.get('like', False), values.get('in_bookmarks', False), values.get('rate'), book_id]
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(get_insert_relation_sql(), params)
+            row = cursor.fetchone()
+            if row is not None:
+                row, old = tuple(row), None
+            else:
+                row = update_relation(cursor, user, book_id, values)
+                if row is None:
+                    return None
+                row, old = tuple(row[:4]), row[4:]
+        relation_id, like, in_bookmarks, rate = row
+        old_like, old_rate = (bool(old[0]), old[1]) if old else (False, None)
+        update_book_counters(book_id, old_rate, rate, bool(like) - old_like, readers_delta=int(old is None),
+                             similar_dirty=is_positive_relation(like, rate) != is_positive_relation(old_like, old_rate))
+
+    bump_books_version()
+    return UserBookRelation(id=relation_id, user=user, book_id=int(book_id), like=bool(like),
+                            in_bookmarks=bool(in_bookmarks), rate=rate)
+
+
+def get_insert_relations_sql(count):
+    """
+    INSERT ... ON CONFLICT (user_id, book_id) DO NOTHING для count новых оценок пользователя,
+    возвращает id и книгу только вставленных строк
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field) for field in ('user_id', 'book_id', *RELATION_FIELDS))
+    values = ', '.join(['(%s, %s, %s, %s, %s)'] * count)
+    return (
+        f'INSERT INTO {quote(UserBookRelation._meta.db_table)} ({columns}) VALUES {values} '
+        f'ON CONFLICT ({quote("user_id")}, {quote("book_id")}) DO NOTHING '
+        f'RETURNING {quote("id")}, {quote("book_id")}'
+    )
+
+
+def set_relations(user, items):
+    """
+    Применение оценок пользователя сразу к нескольким книгам за фиксированное число запросов:
+    INSERT ... ON CONFLICT DO NOTHING новых оценок, выборка с блокировкой и bulk_update уже существующих
+    (в том числе вставленных параллельно) и один UPDATE счетчиков книг.
+    items - список словарей с полями book (id книги), like, in_bookmarks, rate,
+    отсутствующие поля не изменяются, повторы одной книги применяются по порядку.
+    Для пустого items запросы не выполняются.
+    """
+    if not items:
+        return []
+
+    def apply(values, book_id):
+        for item in items:
+            if item['book'] == book_id:
+                values.update({field: item[field] for field in RELATION_FIELDS if field in item})
+        return values
+
+    book_ids = list(dict.fromkeys(item['book'] for item in items))
+    default = {'like': False, 'in_bookmarks': False, 'rate': None}
+    relations, deltas, similar_dirty = {}, {}, []
+
+    with transaction.atomic():
+        new = {book_id: apply(dict(default), book_id) for book_id in book_ids}
+        params = [value for book_id, values in new.items()
+                  for value in (user.pk, book_id, *(values[field] for field in RELATION_FIELDS))]
+        with connection.cursor() as cursor:
+            cursor.execute(get_insert_relations_sql(len(new)), params)
+            for relation_id, book_id in cursor.fetchall():
+                relations[book_id] = UserBookRelation(id=relation_id, user=user, book_id=book_id, **new[book_id])
+                deltas[book_id] = get_counters_delta(None, new[book_id]['rate'], int(new[book_id]['like']),
+                                                     readers_delta=1)
+                if is_positive_relation(new[book_id]['like'], new[book_id]['rate']):
+                    similar_dirty.append(book_id)
+
+        existing = [book_id for book_id in book_ids if book_id not in relations]
+        changed = []
+        if existing:
+            for relation in UserBookRelation.objects.select_for_update().filter(user=user, book_id__in=existing):
+                old = {field: getattr(relation, field) for field in RELATION_FIELDS}
+                for field, value in apply(dict(old), relation.book_id).items():
+                    setattr(relation, field, value)
+                relations[relation.book_id] = relation
+                deltas[relation.book_id] = get_counters_delta(old['rate'], relation.rate, relation.like - old['like'])
+                if is_positive_relation(relation.like, relation.rate) != is_positive_relation(old['like'], old['rate']):
+                    similar_dirty.append(relation.book_id)
+                if old != {field: getattr(relation, field) for field in RELATION_FIELDS}:
+                    changed.append(relation)
+        if changed:
+            UserBookRelation.objects.bulk_update(changed, RELATION_FIELDS)
+        update_books_counters(deltas, similar_dirty)
 
+    for relation in relations.values():
+        relation.old_rate = relation.rate
+        relation.old_like = relation.like
+    bump_books_version()
+    return [relations[book_id] for book_id in book_ids if book_id in relations]
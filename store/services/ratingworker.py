@@ -0,0 +1,100 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+
+from store.models import DirtyBookRating
+
+'''
+Отложенный пересчет рейтинга книг (BOOK_RATING_MODE = 'deferred').
+Оценки добавляют отметки DirtyBookRating, обработчик раз в BOOK_RATING_MAX_DELAY секунд
+пересчитывает отмеченные книги пачками, все отметки одной книги схлопываются в один пересчет.
+Обработчик запускается потоком в процессе приложения (BOOK_RATING_WORKER = 'thread')
+или отдельным процессом командой manage.py rating_worker, без внешнего брокера.
+'''
+logger = logging.getLogger(__name__)
+
+
+def claim_dirty_marks(marks, batch_size):
+    """
+    Отметки из queryset marks для пересчета не более чем batch_size книг: (id отметок, id книг).
+    Отметки блокируются, отметки, заблокированные другим обработчиком, пропускаются (SKIP LOCKED).
+    После пересчета удаляются именно эти отметки, а не все с id не больше прочитанного:
+    отметка с меньшим id может быть зафиксирована позже и тогда не попала бы в пересчет
+    """
+    marks = marks.select_for_update(skip_locked=True)
+    book_ids = sorted(set(marks.order_by('id').values_list('book_id', flat=True)[:batch_size]))
+    if not book_ids:
+        return [], []
+    # все отметки выбранных книг схлопываются в один пересчет
+    return list(marks.filter(book_id__in=book_ids).values_list('id', flat=True)), book_ids
+
+
+def process_dirty_ratings(batch_size=None):
+    """
+    Пересчет рейтинга всех отмеченных книг. Обрабатываются отметки, созданные до начала обработки,
+    более поздние отметки остаются для следующего запуска. Возвращает количество пересчитанных книг.
+    """
+    from store.services.logic import recompute_ratings
+
+    batch_size = batch_size or settings.BOOK_RATING_BATCH_SIZE
+    last_id = DirtyBookRating.objects.aggregate(last_id=Max('id')).get('last_id')
+    if last_id is None:
+        return 0
+
+    processed = 0
+    while True:
+        with transaction.atomic():
+            mark_ids, book_ids = claim_dirty_marks(DirtyBookRating.objects.filter(id__lte=last_id), batch_size)
+            if not book_ids:
+                return processed
+            recompute_ratings(book_ids)
+            DirtyBookRating.objects.filter(id__in=mark_ids).delete()
+        processed += len(book_ids)
+
+
+class RatingWorker(threading.Thread):
+    """
+    Фоновый поток, который пересчитывает отмеченные книги каждые interval секунд
+    """
+
+    def __init__(self, interval=None):
+        super().__init__(name='rating-worker', daemon=True)
+        self.interval = interval or settings.BOOK_RATING_MAX_DELAY
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.process()
+        close_old_connections()
+
+    def process(self):
+        try:
+            close_old_connections()
+            processed = process_dirty_ratings()
+            if processed:
+                logger.info('Recomputed rating of %s books', processed)
+        except Exception:
+            logger.exception('Rating recomputation failed')
+
+    def stop(self):
+        self.stopped.set()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def ensure_rating_worker():
+    """
+    Запуск фонового потока при первой отметке, если BOOK_RATING_WORKER = 'thread'
+    """
+    global _worker
+    if settings.BOOK_RATING_WORKER != 'thread' or (_worker is not None and _worker.is_alive()):
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = RatingWorker()
+            _worker.start()
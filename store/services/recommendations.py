@@ -0,0 +1,267 @@
+import heapq
+import logging
+import math
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max, Q
+
+from store.models import BookSimilarity, DirtyBookSimilarity, UserBookRelation
+from store.services.ratingworker import RatingWorker, claim_dirty_marks
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+'''
+Похожие книги по совместным положительным оценкам (лайк или оценка от BOOK_SIMILAR_MIN_RATE).
+Пользователи и книги образуют разреженную матрицу X (пользователь x книга), совместные оценки
+книг - произведение X.T @ X, похожесть - косинусная мера: common / sqrt(count_a * count_b).
+Для каждой книги сохраняются BOOK_SIMILAR_TOP_K соседей в BookSimilarity, поэтому запрос
+похожих книг читает несколько строк по индексу. Похожесть зависит только от того, положительна ли оценка,
+поэтому книга отмечается в DirtyBookSimilarity, только когда оценка становится положительной или перестает ею быть.
+Запрос отмечает только саму книгу, остальные книги пересчитывает обработчик отметок: вместе с отмеченными
+книгами пересчитываются их соседи - книги, в списках которых они есть, и их новые похожие книги.
+Изменение совместных оценок может вывести в соседи и другие книги, поэтому расписание должно включать
+и полный пересчет (manage.py similar_books --rebuild).
+Если NumPy/SciPy не установлены, используется расчет на чистом Python с тем же результатом.
+'''
+logger = logging.getLogger(__name__)
+
+
+def get_positive_relations():
+    return UserBookRelation.objects.filter(Q(like=True) | Q(rate__gte=settings.BOOK_SIMILAR_MIN_RATE))
+
+
+def is_positive_relation(like, rate):
+    """
+    Положительная ли оценка (лайк или оценка от BOOK_SIMILAR_MIN_RATE), аналогично get_positive_relations
+    """
+    return bool(like) or (rate is not None and rate >= settings.BOOK_SIMILAR_MIN_RATE)
+
+
+def ordered_top(candidates, top_k):
+    """
+    top_k пар (книга, похожесть) по убыванию похожести, при равенстве - по id книги
+    """
+    return heapq.nsmallest(top_k, candidates, key=lambda item: (-item[1], item[0]))
+
+
+class PythonCooccurrence:
+    """
+    Совместные оценки книг на словарях, для небольших данных и окружений без NumPy/SciPy
+    """
+
+    def __init__(self, pairs, counts):
+        self.counts = counts
+        self.books_by_user = defaultdict(list)
+        self.users_by_book = defaultdict(list)
+        for user_id, book_id in pairs:
+            self.books_by_user[user_id].append(book_id)
+            self.users_by_book[book_id].append(user_id)
+
+    def similar(self, book_ids, top_k):
+        result = {}
+        for book_id in book_ids:
+            common = Counter()
+            for user_id in self.users_by_book.get(book_id, ()):
+                common.update(self.books_by_user[user_id])
+            common.pop(book_id, None)
+            count = self.counts.get(book_id, 0)
+            result[book_id] = ordered_top(
+                [(other, value / math.sqrt(count * self.counts[other])) for other, value in common.items()], top_k)
+        return result
+
+
+class SparseCooccurrence:
+    """
+    Совместные оценки книг произведением разреженных матриц SciPy: строки матрицы X.T @ X
+    считаются сразу для пачки книг, выбор top_k - np.partition без полной сортировки
+    """
+
+    def __init__(self, pairs, counts):
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        users, user_index = np.unique(pairs[:, 0], return_inverse=True)
+        self.book_ids, book_index = np.unique(pairs[:, 1], return_inverse=True)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float64), (user_index.ravel(), book_index.ravel())),
+            shape=(len(users), len(self.book_ids)))
+        self.matrix_t = self.matrix.T.tocsr()
+        self.counts = np.array([counts.get(book_id, 0) for book_id in self.book_ids.tolist()], dtype=np.float64)
+
+    def similar(self, book_ids, top_k):
+        result = {book_id: [] for book_id in book_ids}
+        positions = np.searchsorted(self.book_ids, np.array(book_ids, dtype=np.int64))
+        found = [(book_id, position) for book_id, position in zip(book_ids, positions.tolist())
+                 if position < len(self.book_ids) and self.book_ids[position] == book_id]
+        if not found:
+            return result
+
+        common = (self.matrix_t[[position for _, position in found]] @ self.matrix).tocsr()
+        for row, (book_id, position) in enumerate(found):
+            start, end = common.indptr[row], common.indptr[row + 1]
+            columns, values = common.indices[start:end], common.data[start:end]
+            keep = columns != position
+            columns, values = columns[keep], values[keep]
+            scores = values / np.sqrt(self.counts[position] * self.counts[columns])
+            if len(scores) > top_k:
+                # с запасом на равные значения на границе, точный порядок - в ordered_top
+                bound = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+                selected = scores >= bound
+                columns, scores = columns[selected], scores[selected]
+            result[book_id] = ordered_top(zip(self.book_ids[columns].tolist(), scores.tolist()), top_k)
+        return result
+
+
+def get_cooccurrence_class():
+    return PythonCooccurrence if sparse is None else SparseCooccurrence
+
+
+def compute_similar(book_ids, top_k=None):
+    """
+    Похожие книги для book_ids: {id книги: [(id похожей книги, похожесть), ...]}.
+    Читаются только положительные оценки пользователей, которые положительно оценили эти книги,
+    и общее количество положительных оценок их книг - два запроса
+    """
+    book_ids = sorted(set(book_ids))
+    if not book_ids:
+        return {}
+    relations = get_positive_relations()
+    readers = relations.filter(book_id__in=book_ids).values('user_id')
+    pairs_queryset = relations.filter(user_id__in=readers)
+    pairs = list(pairs_queryset.values_list('user_id', 'book_id'))
+    counts = dict(relations.filter(book_id__in=pairs_queryset.values('book_id')).values('book_id').annotate(
+        count=Count('id')).order_by().values_list('book_id', 'count'))
+    return get_cooccurrence_class()(pairs, counts).similar(book_ids, top_k or settings.BOOK_SIMILAR_TOP_K)
+
+
+def save_similar(similar):
+    """
+    Замена сохраненных похожих книг для книг из similar
+    """
+    BookSimilarity.objects.filter(book_id__in=list(similar)).delete()
+    BookSimilarity.objects.bulk_create([
+        BookSimilarity(book_id=book_id, similar_id=other, score=score)
+        for book_id, items in similar.items() for other, score in items
+    ], batch_size=5000)
+
+
+def refresh_similar(book_ids, top_k=None):
+    """
+    Пересчет и сохранение похожих книг для book_ids. Возвращает количество книг
+    """
+    similar = compute_similar(book_ids, top_k)
+    with transaction.atomic():
+        save_similar(similar)
+    return len(similar)
+
+
+def rebuild_similar(top_k=None, chunk_size=1000, log=None):
+    """
+    Полный пересчет похожих книг: все положительные оценки читаются одним запросом,
+    матрица строится один раз, строки X.T @ X считаются и сохраняются пачками по chunk_size книг.
+    Возвращает количество книг, для которых найдены похожие
+    """
+    log = log or (lambda message: None)
+    top_k = top_k or settings.BOOK_SIMILAR_TOP_K
+    # удаляются только отметки, прочитанные до оценок: отметка с меньшим id может быть зафиксирована позже
+    mark_ids = list(DirtyBookSimilarity.objects.values_list('id', flat=True))
+    pairs = list(get_positive_relations().values_list('user_id', 'book_id'))
+    counts = Counter(book_id for _, book_id in pairs)
+    cooccurrence = get_cooccurrence_class()(pairs, counts)
+    book_ids = sorted(counts)
+
+    with transaction.atomic():
+        BookSimilarity.objects.all().delete()
+        for start in range(0, len(mark_ids), chunk_size):
+            DirtyBookSimilarity.objects.filter(id__in=mark_ids[start:start + chunk_size]).delete()
+        for start in range(0, len(book_ids), chunk_size):
+            save_similar(cooccurrence.similar(book_ids[start:start + chunk_size], top_k))
+            log(f'Computed similar books for {min(start + chunk_size, len(book_ids))} of {len(book_ids)} books')
+    return len(book_ids)
+
+
+def get_similar_books(book_id):
+    """
+    Сохраненные похожие книги по убыванию похожести, один запрос по индексу (book, -score)
+    """
+    return BookSimilarity.objects.filter(book_id=book_id).select_related('similar').only(
+        'book_id', 'score', 'similar__name', 'similar__author_name', 'similar__rating', 'similar__likes_count',
+    ).order_by('-score', 'similar_id')[:settings.BOOK_SIMILAR_TOP_K]
+
+
+def mark_similar_dirty(book_ids):
+    """
+    Отметка книг для пересчета похожих книг, запускает фоновый обработчик, если он включен
+    """
+    DirtyBookSimilarity.objects.bulk_create([DirtyBookSimilarity(book_id=book_id) for book_id in book_ids])
+    ensure_similar_worker()
+
+
+def process_dirty_similar(batch_size=None):
+    """
+    Пересчет похожих книг для всех отмеченных книг, аналогично process_dirty_ratings:
+    удаляются только прочитанные и заблокированные отметки (claim_dirty_marks).
+    Вместе с пачкой отмеченных книг пересчитываются их соседи: книги, в списках которых они есть,
+    и их новые похожие книги, - по batch_size книг. Возвращает количество пересчитанных книг
+    """
+    batch_size = batch_size or settings.BOOK_SIMILAR_BATCH_SIZE
+    last_id = DirtyBookSimilarity.objects.aggregate(last_id=Max('id')).get('last_id')
+    if last_id is None:
+        return 0
+
+    processed = 0
+    while True:
+        with transaction.atomic():
+            mark_ids, book_ids = claim_dirty_marks(DirtyBookSimilarity.objects.filter(id__lte=last_id), batch_size)
+            if not book_ids:
+                return processed
+            similar = compute_similar(book_ids)
+            neighbours = set(BookSimilarity.objects.filter(similar_id__in=book_ids).values_list('book_id', flat=True))
+            neighbours.update(other for items in similar.values() for other, _ in items)
+            neighbours = sorted(neighbours.difference(book_ids))
+            save_similar(similar)
+            for start in range(0, len(neighbours), batch_size):
+                save_similar(compute_similar(neighbours[start:start + batch_size]))
+            DirtyBookSimilarity.objects.filter(id__in=mark_ids).delete()
+        processed += len(book_ids) + len(neighbours)
+
+
+class SimilarWorker(RatingWorker):
+    """
+    Фоновый поток, который пересчитывает похожие книги отмеченных книг каждые interval секунд
+    """
+
+    def __init__(self, interval=None):
+        super().__init__(interval or settings.BOOK_SIMILAR_MAX_DELAY)
+        self.name = 'similar-worker'
+
+    def process(self):
+        try:
+            close_old_connections()
+            processed = process_dirty_similar()
+            if processed:
+                logger.info('Recomputed similar books of %s books', processed)
+        except Exception:
+            logger.exception('Similar books recomputation failed')
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def ensure_similar_worker():
+    """
+    Запуск фонового потока при первой отметке, если BOOK_SIMILAR_WORKER = 'thread'
+    """
+    global _worker
+    if settings.BOOK_SIMILAR_WORKER != 'thread' or (_worker is not None and _worker.is_alive()):
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = SimilarWorker()
+            _worker.start()
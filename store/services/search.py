@@ -0,0 +1,137 @@
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+
+'''
+Поисковые движки для книг по полям name и author_name.
+Движок выбирается по BOOK_SEARCH_BACKEND в settings, либо по типу базы данных.
+Каждый движок отбирает книги и аннотирует их релевантностью search_rank (больше - выше).
+'''
+
+
+class SearchBackend:
+    """
+    Поиск через icontains по всем полям, как в SearchFilter, без индексов
+    """
+    search_fields = ('name', 'author_name')
+
+    def setup(self, connection):
+        """
+        Создание структур поиска в базе данных после миграций, если они не создаются миграциями
+        """
+
+    def search(self, queryset, terms):
+        conditions = [reduce(or_, [Q(**{f'{field}__icontains': term}) for field in self.search_fields])
+                      for term in terms]
+        return queryset.filter(reduce(and_, conditions)).distinct()
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск по столбцу search_vector (GIN индекс, поддерживается триггером)
+    и поиск по триграммному сходству name и author_name (GIN индексы gin_trgm_ops)
+    """
+    config = 'simple'
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+
+        text = ' '.join(terms)
+        query = SearchQuery(' & '.join(f'{word}:*' for word in get_words(terms)) or "''",
+                            search_type='raw', config=self.config)
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_similar=text) | Q(author_name__trigram_similar=text)
+        ).annotate(
+            search_rank=SearchRank(F('search_vector'), query) + Greatest(
+                TrigramSimilarity('name', text), TrigramSimilarity('author_name', text))
+        ).order_by('-search_rank', 'id')
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск по виртуальной таблице FTS5 store_book_fts,
+    которая поддерживается триггерами (см. миграцию 0005).
+    SQLite пересоздает таблицу store_book при изменении её столбцов и удаляет триггеры,
+    поэтому они восстанавливаются после каждой миграции в setup.
+    """
+    table = 'store_book_fts'
+    setup_sql = (
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS store_book_fts USING fts5(
+            name, author_name, content='store_book', content_rowid='id'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS store_book_fts_insert AFTER INSERT ON store_book BEGIN
+            INSERT INTO store_book_fts(rowid, name, author_name) VALUES (new.id, new.name, new.author_name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS store_book_fts_delete AFTER DELETE ON store_book BEGIN
+            INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name)
+            VALUES ('delete', old.id, old.name, old.author_name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS store_book_fts_update AFTER UPDATE OF name, author_name ON store_book BEGIN
+            INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name)
+            VALUES ('delete', old.id, old.name, old.author_name);
+            INSERT INTO store_book_fts(rowid, name, author_name) VALUES (new.id, new.name, new.author_name);
+        END
+        """,
+        "INSERT INTO store_book_fts(store_book_fts) VALUES ('rebuild')",
+    )
+
+    def setup(self, connection):
+        with connection.cursor() as cursor:
+            for statement in self.setup_sql:
+                cursor.execute(statement)
+
+    def search(self, queryset, terms):
+        match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in get_words(terms))
+        if not match:
+            return queryset.none()
+        rank = RawSQL(f'SELECT -{self.table}.rank FROM {self.table} '
+                      f'WHERE {self.table} MATCH %s AND {self.table}.rowid = store_book.id',
+                      (match,), output_field=FloatField())
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,))
+        ).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_words(terms):
+    """
+    Слова для полнотекстового запроса, без служебных символов
+    """
+    return [word for term in terms for word in re.findall(r'\w+', term)]
+
+
+def get_search_backend(using=None):
+    """
+    Движок из settings.BOOK_SEARCH_BACKEND, либо подходящий для текущей базы данных
+    """
+    backend_path = getattr(settings, 'BOOK_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    vendor = connections[using].vendor if using else connection.vendor
+    return SEARCH_BACKENDS.get(vendor, SearchBackend)()
+
+
+def setup_search(using, **kwargs):
+    """
+    Обработчик post_migrate: создание структур поиска для базы данных
+    """
+    get_search_backend(using).setup(connections[using])
@@ -0,0 +1,24 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Проверка бюджетов SQL запросов действий представлений (атрибут query_budgets представления):
+    запрос, выполненный в assertQueryBudget, вместе с чтением потокового ответа не должен делать
+    больше запросов, чем задано для действия
+    """
+    def assertQueryBudget(self, view_class, action, request, *args, using=DEFAULT_DB_ALIAS, **kwargs):
+        budget = getattr(view_class, 'query_budgets', {}).get(action)
+        if budget is None:
+            self.fail(f'{view_class.__name__}.{action} has no query budget')
+        with CaptureQueriesContext(connections[using]) as context:
+            response = request(*args, **kwargs)
+            if getattr(response, 'streaming', False):
+                # запросы потокового ответа выполняются при чтении содержимого
+                response.streaming_content = [b''.join(response.streaming_content)]
+        if len(context) > budget:
+            queries = '\n'.join(f'{index}. {query["sql"]}'
+                                for index, query in enumerate(context.captured_queries, start=1))
+            self.fail(f'{view_class.__name__}.{action} made {len(context)} queries, budget {budget}:\n{queries}')
+        return response
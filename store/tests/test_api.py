@@ -1,14 +1,42 @@
+import asyncio
+import csv
 import json
+import time
+from base64 import b64encode
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.db.models import Count, Case, When, F
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.module_loading import import_string
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.exceptions import ErrorDetail
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from store.models import Book, UserBookRelation
+from books.asgi import AsyncApiHandler, application
+from store import renderers
+from store.benchmarks.runner import asgi_get
+from store.middleware import ServerTimingMiddleware
+from store.models import Book, UserBookRelation, BookRanking, DirtyBookSimilarity, AuthorStats
 from store.serializers import BooksSerializer, UserBookRelationSerializer
+from store.services.getqueryfromdb import get_books_with_annotate
+from store.services.logic import set_relations
+from store.tests.querybudget import QueryBudgetMixin
+from store.views import BookViewSet, UserBookRelationView, LeaderboardView, LibraryView, AuthorViewSet
 
 
 class BooksApiTestCase(APITestCase):
@@ -75,7 +103,30 @@ class BooksApiTestCase(APITestCase):
             owner_name=F('owner__username')
         ).prefetch_related('readers').order_by('id')
         serializer_data = BooksSerializer(books, many=True).data
-        self.assertEqual(serializer_data, response.data['results'])
+        self.assertCountEqual(serializer_data, response.data['results'])
+        # результаты сортируются по релевантности: у book_3 слово Author есть в обоих полях
+        self.assertEqual([self.book_3.id, self.book_2.id], [book['id'] for book in response.data['results']])
+
+    def test_get_search_prefix(self):
+        """
+        Тестирование поиска по началу слова и поиска без результатов
+        """
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'Auth'}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(4, response.data['count'])
+        response = self.client.get(url, data={'search': 'Summerfield'}, format='json')
+        self.assertEqual(0, response.data['count'])
+
+    def test_get_search_updated_book(self):
+        """
+        Тестирование поиска по измененному названию книги
+        """
+        self.book_4.name = 'Programming in Python 3'
+        self.book_4.save()
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'python'}, format='json')
+        self.assertEqual([self.book_4.id], [book['id'] for book in response.data['results']])
 
     def test_get_ordering_price(self):
         """
@@ -232,6 +283,358 @@ class BooksApiTestCase(APITestCase):
         self.assertEqual(first_count_books - 1, Book.objects.all().count())
 
 
+    def test_get_cursor(self):
+        """
+        Тестирование постраничного вывода по ключу с сортировкой по price и id
+        """
+        url = reverse('book-list')
+        # страница книг и читатели книг страницы
+        with self.assertNumQueries(2):
+            response = self.client.get(url, data={'pagination': 'cursor', 'ordering': 'price', 'page_size': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotIn('count', response.data)
+        self.assertEqual([self.book_1.id, self.book_4.id], [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.book_2.id, self.book_3.id], [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.book_1.id, self.book_4.id], [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['previous'])
+
+    def test_get_cursor_desc_filter(self):
+        """
+        Тестирование постраничного вывода по ключу с обратной сортировкой и фильтром
+        """
+        url = reverse('book-list')
+        response = self.client.get(url, data={'pagination': 'cursor', 'ordering': '-author_name',
+                                              'page_size': 1, 'price': 55})
+        self.assertEqual([self.book_3.id], [book['id'] for book in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([self.book_2.id], [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+    def test_get_cursor_invalid(self):
+        """
+        Тестирование некорректного курсора
+        """
+        url = reverse('book-list')
+        response = self.client.get(url, data={'cursor': 'wrong'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+        # измененные значения позиции
+        for position in ({'id': 'abc'}, {'id': None}, {'id': [1]}):
+            cursor = b64encode(json.dumps({'p': position}).encode('utf-8')).decode('ascii')
+            response = self.client.get(url, data={'cursor': cursor})
+            self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code, position)
+
+
+    def test_get_readers(self):
+        """
+        Тестирование постраничного списка читателей книги
+        """
+        user2 = User.objects.create(username='test_user2', first_name='Ivan', last_name='Ivanov')
+        UserBookRelation.objects.create(user=user2, book=self.book_1)
+        url = reverse('book-readers', args=(self.book_1.id,))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, response.data['count'])
+        self.assertEqual([{'first_name': '', 'last_name': ''},
+                          {'first_name': 'Ivan', 'last_name': 'Ivanov'}], response.data['results'])
+
+        url = reverse('book-readers', args=(0,))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(reverse('book-readers', args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_import_csv(self):
+        """
+        Импорт книг из CSV пачками, ошибочные строки возвращаются в errors
+        """
+        first_count_book = Book.objects.all().count()
+        content = ('name,price,author_name\n'
+                   'Programming in Python 3,150,Mark Summerfield\n'
+                   'Wrong book,abc,Author\n'
+                   'Fluent Python,200,Luciano Ramalho\n'
+                   'Two Scoops of Django,120,Daniel Greenfeld\n').encode('utf-8')
+        url = reverse('book-import')
+        self.client.force_login(self.user)
+        response = self.client.post(url, data={'file': SimpleUploadedFile('books.csv', content), 'batch_size': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(3, response.data['created'])
+        self.assertEqual(1, len(response.data['errors']))
+        self.assertEqual(3, response.data['errors'][0]['row'])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(first_count_book + 3, Book.objects.all().count())
+        self.assertEqual(self.user, Book.objects.get(name='Fluent Python').owner)
+
+    def test_import_ndjson(self):
+        """
+        Импорт книг из NDJSON
+        """
+        content = ('{"name": "Fluent Python", "price": 200, "author_name": "Luciano Ramalho"}\n'
+                   '\n'
+                   'not json\n'
+                   '{"name": "No price", "author_name": "Author"}\n').encode('utf-8')
+        url = reverse('book-import')
+        self.client.force_login(self.user)
+        response = self.client.post(url, data={'file': SimpleUploadedFile('books.ndjson', content)})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, response.data['created'])
+        self.assertEqual([3, 4], [error['row'] for error in response.data['errors']])
+
+        response = self.client.get(reverse('book-list'), data={'search': 'Fluent'})
+        self.assertEqual(1, response.data['count'])
+
+    def test_import_not_authenticated(self):
+        """
+        Импорт доступен только авторизованным пользователям
+        """
+        url = reverse('book-import')
+        response = self.client.post(url, data={'file': SimpleUploadedFile('books.csv', b'name\n')})
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    @override_settings(BOOK_EXPORT_CHUNK_SIZE=3)
+    def test_export_ndjson(self):
+        """
+        Потоковая выгрузка книг в NDJSON пачками
+        """
+        url = reverse('book-export')
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        books = get_books_with_annotate()
+        self.assertEqual(json.loads(json.dumps(BooksSerializer(books, many=True).data)), rows)
+
+    def test_export_csv(self):
+        """
+        Потоковая выгрузка книг в CSV с фильтром
+        """
+        url = reverse('book-export')
+        response = self.client.get(url, data={'file_format': 'csv', 'price': 55})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(list(BooksSerializer.Meta.fields), rows[0])
+        self.assertEqual([str(self.book_2.id), str(self.book_3.id)], [row[0] for row in rows[1:]])
+
+        response = self.client.get(url, data={'file_format': 'xml'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class BooksCacheApiTestCase(APITestCase):
+    """
+    Тестирование кэширования ответов Books API
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test_user')
+        self.book_1 = Book.objects.create(name='Test book', price=25,
+                                          author_name='Author 4', owner=self.user)
+
+    def test_get_cached(self):
+        """
+        Повторный запрос берется из кэша без запросов к базе данных
+        """
+        url = reverse('book-list')
+        response = self.client.get(url, data={'price': 25, 'ordering': 'price'})
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(url, data={'ordering': 'price', 'price': 25})
+        self.assertEqual(response.data, cached_response.data)
+
+        url = reverse('book-detail', args=(self.book_1.id,))
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(url)
+        self.assertEqual(response.data, cached_response.data)
+
+    def test_invalidate(self):
+        """
+        Изменение книги или оценки делает закэшированный ответ неактуальным
+        """
+        url = reverse('book-detail', args=(self.book_1.id,))
+        self.client.get(url)
+
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, like=True)
+        response = self.client.get(url)
+        self.assertEqual(1, response.data['count_likes'])
+
+        self.book_1.name = 'New name'
+        self.book_1.save()
+        response = self.client.get(url)
+        self.assertEqual('New name', response.data['name'])
+
+    def test_etag(self):
+        """
+        Запрос с совпадающим If-None-Match получает 304 без запросов к базе данных
+        """
+        url = reverse('book-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, like=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_last_modified(self):
+        """
+        Запрос с If-Modified-Since не раньше Last-Modified книги получает 304
+        """
+        url = reverse('book-detail', args=(self.book_1.id,))
+        response = self.client.get(url)
+        last_modified = response['Last-Modified']
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        Book.objects.filter(pk=self.book_1.pk).update(updated_at=self.book_1.updated_at + timedelta(days=1))
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_list_last_modified(self):
+        """
+        Список книг без Last-Modified: после удаления книги If-Modified-Since не дает 304
+        """
+        book_2 = Book.objects.create(name='Test book 2', price=55, author_name='Author 1')
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        book_2.delete()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.book_1.id], [book['id'] for book in response.data['results']])
+
+    def test_updated_at_counters(self):
+        """
+        Оценка книги изменяет updated_at
+        """
+        updated_at = self.book_1.updated_at
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, rate=4)
+        self.book_1.refresh_from_db()
+        self.assertGreater(self.book_1.updated_at, updated_at)
+
+
+class BooksAsyncApiTestCase(APITransactionTestCase):
+    """
+    Тестирование асинхронных представлений, запросы к БД выполняются в других потоках,
+    поэтому данные должны быть зафиксированы
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test_user')
+        self.book_1 = Book.objects.create(name='Test book', price=25,
+                                          author_name='Author 4', owner=self.user)
+        self.book_2 = Book.objects.create(name='Test book 2', price=55,
+                                          author_name='Author 1')
+
+    def test_get(self):
+        """
+        Асинхронный список и книга совпадают с синхронными
+        """
+        response = self.client.get(reverse('async-book-list'), data={'ordering': '-price'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(self.client.get(reverse('book-list'), data={'ordering': '-price'}).json(), response.json())
+        self.assertEqual([self.book_2.id, self.book_1.id], [book['id'] for book in response.json()['results']])
+
+        response = self.client.get(reverse('async-book-detail', args=(self.book_1.id,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Test book', response.json()['name'])
+
+        response = self.client.get(reverse('async-book-detail', args=(0,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(reverse('async-book-detail', args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(reverse('book-detail', args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_patch(self):
+        """
+        Асинхронная оценка книги
+        """
+        url = reverse('async-userbookrelation-detail', args=(self.book_1.id,))
+        response = self.client.patch(url, data=json.dumps({'rate': 4}), content_type='application/json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+        self.client.force_login(self.user)
+        response = self.client.patch(url, data=json.dumps({'rate': 4}), content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.book_1.refresh_from_db()
+        self.assertEqual('4.0', str(self.book_1.rating))
+
+    @override_settings(BOOK_CACHE_TIMEOUT=0)
+    def test_server_timing(self):
+        """
+        Запросы в потоках пула асинхронных представлений учитываются в Server-Timing
+        """
+        with self.assertLogs('store.timing', level='INFO') as logs:
+            self.client.get(reverse('book-list'))
+            self.client.get(reverse('async-book-list'))
+        self.assertGreater(logs.records[0].timing['queries'], 0)
+        self.assertEqual(logs.records[0].timing['queries'], logs.records[1].timing['queries'])
+
+    @override_settings(BOOK_CACHE_TIMEOUT=0)
+    async def test_async_middleware(self):
+        """
+        В асинхронной цепочке BOOK_ASYNC_MIDDLEWARE все middleware асинхронные,
+        ServerTimingMiddleware учитывает запросы представления
+        """
+        async def get_response(request):
+            pass
+
+        self.assertTrue(asyncio.iscoroutinefunction(ServerTimingMiddleware(get_response)))
+        with override_settings(MIDDLEWARE=settings.BOOK_ASYNC_MIDDLEWARE), \
+                self.assertLogs('store.timing', level='INFO') as logs:
+            response = await self.async_client.get(reverse('async-book-list'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertGreater(logs.records[0].timing['queries'], 0)
+
+    def test_asgi_routing(self):
+        """
+        ASGI приложение: асинхронные запросы обрабатываются цепочкой без синхронных middleware
+        """
+        for middleware in settings.BOOK_ASYNC_MIDDLEWARE:
+            self.assertTrue(getattr(import_string(middleware), 'async_capable', False), middleware)
+        self.assertEqual(200, async_to_sync(asgi_get)(application, reverse('async-book-list')))
+        self.assertEqual(200, async_to_sync(asgi_get)(application, reverse('book-list')))
+
+        # цепочка строится из BOOK_ASYNC_MIDDLEWARE, settings.MIDDLEWARE не изменяется и во время построения
+        handler = AsyncApiHandler()
+        recorder = f'{__name__}.MiddlewareSettingsRecorder'
+        with override_settings(BOOK_ASYNC_MIDDLEWARE=[*settings.BOOK_ASYNC_MIDDLEWARE, recorder]):
+            handler.load_middleware(is_async=True)
+        self.assertEqual(settings.MIDDLEWARE, MiddlewareSettingsRecorder.middleware)
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+
+
+class MiddlewareSettingsRecorder:
+    """
+    Middleware, которое запоминает settings.MIDDLEWARE при создании цепочки
+    """
+    sync_capable = False
+    async_capable = True
+    middleware = None
+
+    def __init__(self, get_response):
+        MiddlewareSettingsRecorder.middleware = list(settings.MIDDLEWARE)
+        self.get_response = get_response
+        self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    async def __call__(self, request):
+        return await self.get_response(request)
+
+
 class BooksRelationsApiTestCase(APITestCase):
     """
     Тестирование RelationsAPI
@@ -319,9 +722,8 @@ class BooksRelationsApiTestCase(APITestCase):
         self.client.force_login(self.user)
         response = self.client.patch(url, data=json_data, content_type='application/json')
         self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
-        relation = UserBookRelation.objects.get(user=self.user,
-                                                book=self.book_1)
-        self.assertEqual(None, relation.rate)
+        # оценка не проходит валидацию до записи в базу данных, поэтому и отношение не создается
+        self.assertFalse(UserBookRelation.objects.filter(user=self.user, book=self.book_1).exists())
 
     def test_put_ok(self):
         """
@@ -342,3 +744,757 @@ class BooksRelationsApiTestCase(APITestCase):
                                                 book=self.book_1)
         relation_data = UserBookRelationSerializer(relation).data
         self.assertEqual(relation_data, response.data)
+
+    def test_upsert(self):
+        """
+        Оценка создается и изменяется без повторов, неуказанные поля не изменяются, счетчики книги обновляются
+        """
+        url = reverse('userbookrelation-detail', args=(self.book_1.id,))
+        self.client.force_login(self.user)
+        response = self.client.patch(url, data={'like': True, 'rate': 3}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': False, 'rate': 3}, response.data)
+
+        response = self.client.patch(url, data={'rate': 5}, format='json')
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': False, 'rate': 5}, response.data)
+        response = self.client.put(url, data={'book': self.book_1.id, 'in_bookmarks': True}, format='json')
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': True, 'rate': 5}, response.data)
+
+        relation = UserBookRelation.objects.get(user=self.user, book=self.book_1)
+        self.assertEqual((True, True, 5), (relation.like, relation.in_bookmarks, relation.rate))
+        self.book_1.refresh_from_db()
+        self.assertEqual((5, 1, '5.0', 1, 1), (self.book_1.rating_sum, self.book_1.rating_count,
+                                               str(self.book_1.rating), self.book_1.likes_count,
+                                               self.book_1.readers_count))
+
+        for book_id in (0, 'abc'):
+            response = self.client.patch(reverse('userbookrelation-detail', args=(book_id,)),
+                                         data={'rate': 5}, format='json')
+            self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual(1, UserBookRelation.objects.count())
+
+    def test_bulk(self):
+        """
+        Оценка нескольких книг одним запросом
+        """
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, like=True, rate=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book_1, rate=3)
+        url = reverse('userbookrelation-bulk')
+        data = [
+            {'book': self.book_1.id, 'rate': 1, 'in_bookmarks': True},
+            {'book': self.book_2.id, 'like': True, 'rate': 4},
+            {'book': self.book_3.id, 'in_bookmarks': True},
+            {'book': self.book_3.id, 'rate': 2},
+        ]
+        json_data = json.dumps(data)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(13):
+            response = self.client.post(url, data=json_data, content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([
+            {'book': self.book_1.id, 'like': True, 'in_bookmarks': True, 'rate': 1},
+            {'book': self.book_2.id, 'like': True, 'in_bookmarks': False, 'rate': 4},
+            {'book': self.book_3.id, 'like': False, 'in_bookmarks': True, 'rate': 2},
+        ], response.data)
+
+        for book in (self.book_1, self.book_2, self.book_3):
+            book.refresh_from_db()
+        self.assertEqual((4, 2, '2.0', 1, 2),
+                         (self.book_1.rating_sum, self.book_1.rating_count, str(self.book_1.rating),
+                          self.book_1.likes_count, self.book_1.readers_count))
+        self.assertEqual((4, 1, '4.0', 1, 1),
+                         (self.book_2.rating_sum, self.book_2.rating_count, str(self.book_2.rating),
+                          self.book_2.likes_count, self.book_2.readers_count))
+        self.assertEqual((2, 1, '2.0', 0, 1),
+                         (self.book_3.rating_sum, self.book_3.rating_count, str(self.book_3.rating),
+                          self.book_3.likes_count, self.book_3.readers_count))
+
+    def test_bulk_wrong(self):
+        """
+        Оценки с несуществующей книгой или неверной оценкой не применяются
+        """
+        url = reverse('userbookrelation-bulk')
+        data = [
+            {'book': self.book_1.id, 'rate': 3},
+            {'book': 0, 'rate': 6},
+        ]
+        self.client.force_login(self.user)
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+        data = [{'book': self.book_1.id, 'rate': 3}, {'book': 100500}]
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertFalse(UserBookRelation.objects.filter(user=self.user).exists())
+
+        response = self.client.post(url, data='[]', content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'non_field_errors': ['This list may not be empty.']}, response.data)
+        with self.assertNumQueries(0):
+            self.assertEqual([], set_relations(self.user, []))
+
+
+class QueryBudgetApiTestCase(QueryBudgetMixin, APITestCase):
+    """
+    Тестирование бюджетов SQL запросов действий BookViewSet и UserBookRelationView,
+    книг и читателей несколько, чтобы N+1 запросы превышали бюджет
+    """
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'test_user_{index}') for index in range(4)]
+        self.user = self.users[0]
+        self.books = [Book.objects.create(name=f'Test book {index}', price=25 + index,
+                                          author_name='Author 1', owner=self.user) for index in range(5)]
+        for user in self.users:
+            for book in self.books:
+                UserBookRelation.objects.create(user=user, book=book, like=True, rate=4)
+        self.client.force_login(self.user)
+
+    def test_budgets_declared(self):
+        """
+        Бюджет задан для каждого действия
+        """
+        for view_class in (BookViewSet, UserBookRelationView):
+            actions = {action.__name__ for action in view_class.get_extra_actions()}
+            actions.update(name for name in ('list', 'retrieve', 'create', 'update', 'partial_update', 'destroy')
+                           if hasattr(view_class, name))
+            self.assertEqual(actions, set(view_class.query_budgets), view_class.__name__)
+
+    def test_book_view_set(self):
+        book = self.books[0]
+        list_url = reverse('book-list')
+        detail_url = reverse('book-detail', args=(book.id,))
+        data = {'name': 'Budget book', 'price': 10, 'author_name': 'Author 2'}
+
+        for params in ({}, {'search': 'book'}, {'ordering': '-price'}, {'pagination': 'cursor'}, {'viewer': 'true'}):
+            response = self.assertQueryBudget(BookViewSet, 'list', self.client.get, list_url, data=params)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            cache.clear()
+        response = self.assertQueryBudget(BookViewSet, 'retrieve', self.client.get, detail_url,
+                                          data={'viewer': 'true'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'readers', self.client.get,
+                                          reverse('book-readers', args=(book.id,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'similar', self.client.get,
+                                          reverse('book-similar', args=(book.id,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'export_books', self.client.get, reverse('book-export'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'create', self.client.post, list_url, data=data)
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'update', self.client.put, detail_url, data=data)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'partial_update', self.client.patch, detail_url,
+                                          data={'price': 20})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        upload = SimpleUploadedFile('books.csv', b'name,price,author_name\nA,1,B\nC,2,D\n')
+        response = self.assertQueryBudget(BookViewSet, 'import_books', self.client.post, reverse('book-import'),
+                                          data={'file': upload}, format='multipart')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(BookViewSet, 'destroy', self.client.delete, detail_url)
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+
+    def test_user_book_relation_view(self):
+        book = Book.objects.create(name='New book', price=10, author_name='Author 2')
+        url = reverse('userbookrelation-detail', args=(book.id,))
+        response = self.assertQueryBudget(UserBookRelationView, 'partial_update', self.client.patch, url,
+                                          data={'rate': 3}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(UserBookRelationView, 'update', self.client.put, url,
+                                          data={'book': book.id, 'like': True, 'in_bookmarks': True, 'rate': 5},
+                                          format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        items = [{'book': book.id, 'rate': 2} for book in self.books]
+        response = self.assertQueryBudget(UserBookRelationView, 'bulk', self.client.post,
+                                          reverse('userbookrelation-bulk'), data=items, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_author_view_set(self):
+        for params in ({}, {'search': 'author', 'ordering': '-rating'}):
+            response = self.assertQueryBudget(AuthorViewSet, 'list', self.client.get, reverse('authorstats-list'),
+                                              data=params)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.assertQueryBudget(AuthorViewSet, 'retrieve', self.client.get,
+                                          reverse('authorstats-detail', args=('Author 1',)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_query_budget_exceeded(self):
+        """
+        Запросы в цикле по книгам превышают бюджет
+        """
+        with self.assertRaisesRegex(AssertionError, 'made 6 queries, budget 2'), \
+                patch.dict(UserBookRelationView.query_budgets, bulk=2):
+            self.assertQueryBudget(UserBookRelationView, 'bulk', lambda: [
+                list(book.userbookrelation_set.all()) for book in Book.objects.all()])
+
+    def test_server_timing(self):
+        """
+        Заголовок Server-Timing и лог store.timing
+        """
+        with self.assertLogs('store.timing', level='INFO') as logs:
+            response = self.client.get(reverse('book-list'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", view;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertIn('view=BookViewSet.list', logs.output[0])
+        self.assertEqual('BookViewSet.list', logs.records[0].timing['view'])
+        self.assertGreater(logs.records[0].timing['queries'], 0)
+
+        # потоковый ответ пишется в лог после отправки вместе с запросами выгрузки
+        with self.assertLogs('store.timing', level='INFO') as logs:
+            response = self.client.get(reverse('book-export'))
+            self.assertEqual([], logs.records)
+            self.assertEqual(5, len(b''.join(response.streaming_content).splitlines()))
+        self.assertEqual('BookViewSet.export_books', logs.records[0].timing['view'])
+        self.assertEqual(4, logs.records[0].timing['queries'])
+
+        with override_settings(BOOK_SERVER_TIMING=False, BOOK_CACHE_TIMEOUT=0):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('book-list')))
+
+        with self.assertLogs('store.timing', level='WARNING') as logs, \
+                patch.dict(BookViewSet.query_budgets, list=0):
+            cache.clear()
+            self.client.get(reverse('book-list'))
+        self.assertIn('Query budget exceeded: BookViewSet.list', logs.output[0])
+
+
+class LeaderboardApiTestCase(QueryBudgetMixin, APITestCase):
+    """
+    Тестирование лидербордов книг
+    """
+    def setUp(self):
+        self.users = [User.objects.create(username=f'test_user_{index}') for index in range(3)]
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name='Test book 2', price=55, author_name='Author 2')
+        self.book_3 = Book.objects.create(name='Test book 3', price=35, author_name='Author 1')
+        self.book_4 = Book.objects.create(name='Test book 4', price=45, author_name='Author 2')
+        for user in self.users:
+            UserBookRelation.objects.create(user=user, book=self.book_1, rate=5)
+        UserBookRelation.objects.create(user=self.users[0], book=self.book_2, rate=5, like=True)
+        UserBookRelation.objects.create(user=self.users[1], book=self.book_2, like=True)
+        UserBookRelation.objects.create(user=self.users[0], book=self.book_3, rate=1, like=True)
+
+    def get_board(self, board, **params):
+        response = self.assertQueryBudget(LeaderboardView, 'get', self.client.get,
+                                          reverse('leaderboard', args=(board,)), data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def test_rating(self):
+        """
+        Байесовское среднее: 3 оценки 5 выше одной оценки 5, книги без оценок нет в рейтинге
+        """
+        results = self.get_board('rating')['results']
+        self.assertEqual([self.book_1.id, self.book_2.id, self.book_3.id], [row['book'] for row in results])
+        self.assertEqual({'book': self.book_1.id, 'name': 'Test book 1', 'author_name': 'Author 1',
+                          'rating': '5.0', 'likes_count': 0, 'score': 3.75}, results[0])
+        self.assertAlmostEqual(20 / 6, results[1]['score'])
+
+        results = self.get_board('rating', author='Author 1')['results']
+        self.assertEqual([self.book_1.id, self.book_3.id], [row['book'] for row in results])
+
+    def test_likes(self):
+        """
+        Рейтинг по лайкам обновляется при изменении оценок и удалении книг
+        """
+        results = self.get_board('likes')['results']
+        self.assertEqual([(self.book_2.id, 2), (self.book_3.id, 1)], [(row['book'], row['score']) for row in results])
+
+        UserBookRelation.objects.create(user=self.users[1], book=self.book_3, like=True)
+        UserBookRelation.objects.create(user=self.users[2], book=self.book_3, like=True)
+        relation = UserBookRelation.objects.get(user=self.users[1], book=self.book_2)
+        relation.like = False
+        relation.save()
+        self.book_4.author_name = 'Author 3'
+        self.book_4.save()
+        UserBookRelation.objects.create(user=self.users[0], book=self.book_4, like=True)
+        self.book_2.delete()
+
+        results = self.get_board('likes')['results']
+        self.assertEqual([(self.book_3.id, 3), (self.book_4.id, 1)], [(row['book'], row['score']) for row in results])
+        results = self.get_board('likes', author='Author 3')['results']
+        self.assertEqual([self.book_4.id], [row['book'] for row in results])
+
+    def test_pagination(self):
+        """
+        Постраничный вывод по ключу (score, id)
+        """
+        data = self.get_board('rating', page_size=2)
+        self.assertEqual(2, len(data['results']))
+        self.assertIsNone(data['previous'])
+        response = self.client.get(data['next'])
+        self.assertEqual([self.book_3.id], [row['book'] for row in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(reverse('leaderboard', args=('price',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_rebuild(self):
+        """
+        Полное перестроение рейтингов командой
+        """
+        expected = self.get_board('rating')['results']
+        BookRanking.objects.all().delete()
+        Book.objects.bulk_create([Book(name='Bulk book', price=10, author_name='Author 1', likes_count=7)])
+        self.assertEqual([], self.get_board('likes')['results'])
+
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        self.assertEqual(8 + 2, BookRanking.objects.count())
+        self.assertEqual(expected, self.get_board('rating')['results'])
+        self.assertEqual(['Bulk book', 'Test book 2', 'Test book 3'],
+                         [row['name'] for row in self.get_board('likes')['results']])
+
+
+@override_settings(BOOK_SIMILAR_WORKER=None)
+class SimilarBooksApiTestCase(QueryBudgetMixin, APITestCase):
+    """
+    Тестирование похожих книг
+    """
+    def setUp(self):
+        self.users = [User.objects.create(username=f'test_user_{index}') for index in range(3)]
+        self.books = [Book.objects.create(name=f'Test book {index}', price=25, author_name='Author 1')
+                      for index in range(4)]
+        for user in self.users:
+            UserBookRelation.objects.create(user=user, book=self.books[0], like=True)
+        for user in self.users[:2]:
+            UserBookRelation.objects.create(user=user, book=self.books[1], rate=5)
+        UserBookRelation.objects.create(user=self.users[0], book=self.books[2], rate=4, like=True)
+
+    def get_similar(self, book):
+        response = self.assertQueryBudget(BookViewSet, 'similar', self.client.get,
+                                          reverse('book-similar', args=(book.id,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def test_similar(self):
+        self.assertEqual([], self.get_similar(self.books[0]))
+        call_command('similar_books', rebuild=True, stdout=StringIO())
+
+        data = self.get_similar(self.books[0])
+        self.assertEqual([self.books[1].id, self.books[2].id], [row['book'] for row in data])
+        self.assertEqual({'book': self.books[1].id, 'name': 'Test book 1', 'author_name': 'Author 1',
+                          'rating': '5.0', 'likes_count': 0}, {key: data[0][key] for key in data[0] if key != 'score'})
+        self.assertAlmostEqual(2 / 6 ** 0.5, data[0]['score'])
+        self.assertEqual([], self.get_similar(self.books[3]))
+
+        response = self.client.get(reverse('book-similar', args=(self.books[3].id + 100,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(reverse('book-similar', args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_marks(self):
+        """
+        Оценка через API отмечает книгу, команда пересчитывает отмеченные книги
+        """
+        self.client.force_login(self.users[2])
+        response = self.client.patch(reverse('userbookrelation-detail', args=(self.books[3].id,)),
+                                     data={'rate': 5}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        call_command('similar_books', once=True, stdout=StringIO())
+        self.assertEqual([self.books[0].id], [row['book'] for row in self.get_similar(self.books[3])])
+        self.assertFalse(DirtyBookSimilarity.objects.exists())
+
+
+class LibraryApiTestCase(QueryBudgetMixin, APITestCase):
+    """
+    Тестирование личной библиотеки пользователя
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='test_username', first_name='Ivan', last_name='Petrov')
+        self.user_2 = User.objects.create(username='test_username2')
+        self.books = [Book.objects.create(name=f'Test book {index}', price=25 + index, author_name='Author 1')
+                      for index in range(5)]
+        for book in self.books[:4]:
+            UserBookRelation.objects.create(user=self.user, book=book, in_bookmarks=True)
+        UserBookRelation.objects.filter(book=self.books[1]).update(like=True, rate=4)
+        UserBookRelation.objects.create(user=self.user, book=self.books[4], rate=2)
+        UserBookRelation.objects.create(user=self.user_2, book=self.books[0], like=True)
+        self.client.force_login(self.user)
+
+    def get_shelf(self, url, **params):
+        response = self.assertQueryBudget(LibraryView, 'get', self.client.get, url, data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def get_expected(self, books):
+        ids = [book.id for book in books]
+        queryset = get_books_with_annotate().filter(id__in=ids)
+        return sorted(BooksSerializer(queryset, many=True).data, key=lambda book: ids.index(book['id']))
+
+    def test_shelves(self):
+        url = reverse('library', args=('bookmarks',))
+        data = self.get_shelf(url, page_size=3)
+        self.assertEqual(self.get_expected(self.books[3:0:-1]), data['results'])
+        data = self.get_shelf(data['next'])
+        self.assertEqual(self.get_expected(self.books[:1]), data['results'])
+        self.assertIsNone(data['next'])
+
+        self.assertEqual(self.get_expected([self.books[1]]), self.get_shelf(reverse('library', args=('likes',)))[
+            'results'])
+        expected = self.get_expected([self.books[4], self.books[1]])
+        self.assertEqual(expected, self.get_shelf(reverse('library', args=('rated',)))['results'])
+        with self.settings(BOOK_FAST_SERIALIZATION=False):
+            self.assertEqual(expected, self.get_shelf(reverse('library', args=('rated',)))['results'])
+
+    def test_errors(self):
+        response = self.client.get(reverse('library', args=('read',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.client.logout()
+        response = self.client.get(reverse('library', args=('bookmarks',)))
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+
+class ViewerStateApiTestCase(APITestCase):
+    """
+    Тестирование оценки текущего пользователя в списке книг
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='test_username')
+        self.user_2 = User.objects.create(username='test_username2')
+        self.books = [Book.objects.create(name=f'Test book {index}', price=25, author_name='Author 1')
+                      for index in range(3)]
+        UserBookRelation.objects.create(user=self.user, book=self.books[0], like=True, rate=4)
+        UserBookRelation.objects.create(user=self.user_2, book=self.books[1], in_bookmarks=True)
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_list(self):
+        url = reverse('book-list')
+        with self.assertNumQueries(5):
+            self.client.get(url, data={'page_size': 2})
+        cache.clear()
+        with self.assertNumQueries(6):
+            response = self.client.get(url, data={'viewer': 'true'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([{'like': True, 'in_bookmarks': False, 'rate': 4}, None, None],
+                         [book['viewer_relation'] for book in response.data['results']])
+
+        # из кэша берется общий ответ, оценка пользователя выбирается одним запросом
+        self.client.force_login(self.user_2)
+        with self.assertNumQueries(3):
+            response_2 = self.client.get(url, data={'viewer': 'true'})
+        self.assertEqual([None, {'like': False, 'in_bookmarks': True, 'rate': None}, None],
+                         [book['viewer_relation'] for book in response_2.data['results']])
+        self.assertNotEqual(response['ETag'], response_2['ETag'])
+
+        self.client.patch(reverse('userbookrelation-detail', args=(self.books[2].id,)), data={'like': True},
+                          format='json')
+        response = self.client.get(url, data={'viewer': 'true'}, HTTP_IF_NONE_MATCH=response_2['ETag'])
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'like': True, 'in_bookmarks': False, 'rate': None},
+                         response.data['results'][2]['viewer_relation'])
+
+    def test_retrieve(self):
+        url = reverse('book-detail', args=(self.books[0].id,))
+        response = self.client.get(url, data={'viewer': '1'})
+        self.assertEqual({'like': True, 'in_bookmarks': False, 'rate': 4}, response.data['viewer_relation'])
+        response = self.client.get(url)
+        self.assertNotIn('viewer_relation', response.data)
+
+    def test_not_modified(self):
+        """
+        Ответ с оценкой пользователя без Last-Modified: изменение закладки не изменяет updated_at книги
+        """
+        url = reverse('book-detail', args=(self.books[0].id,))
+        response = self.client.get(url, data={'viewer': 'true'})
+        self.assertNotIn('Last-Modified', response)
+        self.client.patch(reverse('userbookrelation-detail', args=(self.books[0].id,)), data={'in_bookmarks': True},
+                          format='json')
+        response = self.client.get(url, data={'viewer': 'true'}, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'like': True, 'in_bookmarks': True, 'rate': 4}, response.data['viewer_relation'])
+        self.assertIn('Last-Modified', self.client.get(url))
+
+    def test_anonymous(self):
+        self.client.logout()
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('book-list'), data={'viewer': 'true'})
+        self.assertNotIn('viewer_relation', response.data['results'][0])
+
+
+class BookFilterApiTestCase(APITestCase):
+    """
+    Тестирование фильтров книг по диапазонам цены и автору
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='test_username')
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name='Test book 2', price=55, discount=40, author_name='Author 2')
+        self.book_3 = Book.objects.create(name='Test book 3', price=35, discount='5.50', author_name='Author 1')
+        self.book_4 = Book.objects.create(name='Test book 4', price=45, author_name='Author 3')
+
+    def get_ids(self, **params):
+        response = self.client.get(reverse('book-list'), data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [book['id'] for book in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual([self.book_2.id, self.book_3.id, self.book_4.id], self.get_ids(price_min=30))
+        self.assertEqual([self.book_1.id, self.book_3.id], self.get_ids(price_min=25, price_max=35))
+        self.assertEqual([self.book_1.id, self.book_2.id, self.book_3.id],
+                         self.get_ids(price_with_discount_max='29.50'))
+        self.assertEqual([self.book_1.id, self.book_3.id], self.get_ids(author='Author 1'))
+        self.assertEqual([self.book_3.id], self.get_ids(author='Author 1', price_with_discount_min=26))
+        self.assertEqual([self.book_2.id], self.get_ids(price=55))
+
+        response = self.client.get(reverse('book-list'), data={'price_min': 'abc'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_ordering(self):
+        expected = [self.book_2.id, self.book_1.id, self.book_3.id, self.book_4.id]
+        self.assertEqual(expected, self.get_ids(ordering='effective_price'))
+
+        response = self.client.get(reverse('book-list'), data={'ordering': 'effective_price', 'pagination': 'cursor',
+                                                              'page_size': 3})
+        self.assertEqual(expected[:3], [book['id'] for book in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(expected[3:], [book['id'] for book in response.data['results']])
+
+    def test_effective_price(self):
+        """
+        Цена с учетом скидки обновляется при изменении книги через API и при импорте
+        """
+        self.assertEqual(Decimal('29.50'), Book.objects.get(pk=self.book_3.id).effective_price)
+        self.book_4.owner = self.user
+        self.book_4.discount = 10
+        self.book_4.save()
+        self.assertEqual(Decimal('35.00'), Book.objects.get(pk=self.book_4.id).effective_price)
+        self.client.force_login(self.user)
+        response = self.client.patch(reverse('book-detail', args=(self.book_4.id,)), data={'price': 50})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(Decimal('40.00'), Book.objects.get(pk=self.book_4.id).effective_price)
+
+        Book.objects.filter(pk=self.book_1.pk).update(price=100)
+        book = Book.objects.get(pk=self.book_1.id)
+        book.discount = 1
+        book.save(update_fields=['discount'])
+        self.assertEqual(Decimal('99.00'), Book.objects.get(pk=self.book_1.id).effective_price)
+
+        upload = SimpleUploadedFile('books.csv', b'name,price,author_name\nImported,20,Author 4\n')
+        response = self.client.post(reverse('book-import'), data={'file': upload}, format='multipart')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(Decimal('20.00'), Book.objects.get(name='Imported').effective_price)
+
+
+class AuthorApiTestCase(APITestCase):
+    """
+    Тестирование статистики авторов
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='test_username')
+        self.user_2 = User.objects.create(username='test_username2')
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 1', owner=self.user)
+        self.book_2 = Book.objects.create(name='Test book 2', price='55.50', author_name='Author 1')
+        self.book_3 = Book.objects.create(name='Test book 3', price=35, author_name='Author 2', owner=self.user)
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, like=True, rate=5)
+        UserBookRelation.objects.create(user=self.user_2, book=self.book_1, rate=4)
+        UserBookRelation.objects.create(user=self.user_2, book=self.book_2, like=True, rate=2)
+
+    def get_author(self, author_name):
+        response = self.client.get(reverse('authorstats-detail', args=(author_name,)))
+        return response.data if response.status_code == status.HTTP_200_OK else None
+
+    def test_get(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('authorstats-list'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([
+            {'author_name': 'Author 1', 'books_count': 2, 'rating': '3.7', 'rating_count': 3, 'likes_count': 2,
+             'readers_count': 3, 'min_price': '25.00', 'max_price': '55.50'},
+            {'author_name': 'Author 2', 'books_count': 1, 'rating': None, 'rating_count': 0, 'likes_count': 0,
+             'readers_count': 0, 'min_price': '35.00', 'max_price': '35.00'},
+        ], response.data['results'])
+
+        response = self.client.get(reverse('authorstats-list'), data={'ordering': '-rating', 'search': 'author'})
+        self.assertEqual(['Author 1', 'Author 2'], [row['author_name'] for row in response.data['results']])
+        with self.assertNumQueries(1):
+            self.assertEqual(1, self.get_author('Author 2')['books_count'])
+        self.assertIsNone(self.get_author('Author 3'))
+
+    def test_incremental(self):
+        """
+        Статистика обновляется при изменении оценок, создании, изменении и удалении книг через API
+        """
+        relation = UserBookRelation.objects.get(user=self.user_2, book=self.book_2)
+        relation.rate = 5
+        relation.like = False
+        relation.save()
+        author = self.get_author('Author 1')
+        self.assertEqual(('4.7', 1), (author['rating'], author['likes_count']))
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('book-list'), data={'name': 'New', 'price': 10, 'author_name': 'Author 3'})
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual('10.00', self.get_author('Author 3')['min_price'])
+
+        response = self.client.patch(reverse('book-detail', args=(self.book_3.id,)), data={'author_name': 'Author 3'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertIsNone(self.get_author('Author 2'))
+        self.assertEqual((2, '35.00'), (self.get_author('Author 3')['books_count'],
+                                        self.get_author('Author 3')['max_price']))
+
+        response = self.client.delete(reverse('book-detail', args=(self.book_1.id,)))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual({'author_name': 'Author 1', 'books_count': 1, 'rating': '5.0', 'rating_count': 1,
+                          'likes_count': 0, 'readers_count': 1, 'min_price': '55.50', 'max_price': '55.50'},
+                         self.get_author('Author 1'))
+
+        expected = self.client.get(reverse('authorstats-list')).data
+        AuthorStats.objects.all().delete()
+        call_command('rebuild_authors', stdout=StringIO())
+        self.assertEqual(expected, self.client.get(reverse('authorstats-list')).data)
+
+    def test_queryset_delete(self):
+        """
+        Статистика обновляется и при удалении книг QuerySet.delete()
+        """
+        Book.objects.filter(pk__in=[self.book_1.id, self.book_3.id]).delete()
+        self.assertEqual({'author_name': 'Author 1', 'books_count': 1, 'rating': '2.0', 'rating_count': 1,
+                          'likes_count': 1, 'readers_count': 1, 'min_price': '55.50', 'max_price': '55.50'},
+                         self.get_author('Author 1'))
+        self.assertIsNone(self.get_author('Author 2'))
+
+
+class SparseFieldsApiTestCase(APITestCase):
+    """
+    Тестирование выбора полей ответа ?fields= и ?exclude=
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='test_username')
+        self.books = [Book.objects.create(name=f'Test book {index}', price=30 - index, discount=index or None,
+                                          author_name='Author 1', owner=self.user) for index in range(3)]
+        UserBookRelation.objects.create(user=self.user, book=self.books[0], like=True, rate=5)
+
+    def get_expected(self, fields):
+        books = BooksSerializer(get_books_with_annotate(), many=True).data
+        return [{name: book[name] for name in fields} for book in books]
+
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-list'), data={'fields': 'id,name,price', 'pagination': 'cursor'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(self.get_expected(['id', 'name', 'price']), response.data['results'])
+        # один запрос книг без соединений и лишних столбцов
+        self.assertEqual(1, len(queries))
+        sql = queries[-1]['sql']
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('author_name', sql)
+
+        fields = ['id', 'price_with_discount', 'owner_name', 'count_likes', 'readers']
+        for fast in (True, False):
+            with self.settings(BOOK_FAST_SERIALIZATION=fast):
+                cache.clear()
+                response = self.client.get(reverse('book-list'), data={'fields': ','.join(reversed(fields))})
+                self.assertEqual(self.get_expected(fields), response.data['results'])
+
+    def test_exclude(self):
+        fields = ['id', 'name', 'price', 'author_name', 'owner_name', 'rating', 'price_with_discount', 'count_likes']
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('book-list'), data={'exclude': 'readers,readers_count'})
+        self.assertEqual(self.get_expected(fields), response.data['results'])
+
+        response = self.client.get(reverse('book-detail', args=(self.books[1].id,)), data={'fields': 'name'})
+        self.assertEqual({'name': 'Test book 1'}, response.data)
+
+    def test_ordering(self):
+        """
+        Столбцы сортировки выбираются для курсора, даже если их нет в ответе
+        """
+        for fast in (True, False):
+            with self.settings(BOOK_FAST_SERIALIZATION=fast):
+                cache.clear()
+                response = self.client.get(reverse('book-list'), data={
+                    'fields': 'name', 'ordering': 'price', 'pagination': 'cursor', 'page_size': 2})
+                self.assertEqual([{'name': 'Test book 2'}, {'name': 'Test book 1'}], response.data['results'])
+                with self.assertNumQueries(1):
+                    response = self.client.get(response.data['next'])
+                self.assertEqual([{'name': 'Test book 0'}], response.data['results'])
+
+    def test_viewer(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book-list'), data={'fields': 'name', 'viewer': 'true'})
+        self.assertEqual({'name': 'Test book 0', 'viewer_relation': {'like': True, 'in_bookmarks': False, 'rate': 5}},
+                         response.data['results'][0])
+
+    def test_viewer_anonymous_first(self):
+        """
+        Общий кэш ответа ?viewer=true не зависит от того, кто запросил его первым
+        """
+        url = reverse('book-list')
+        params = {'fields': 'name', 'viewer': 'true'}
+        response = self.client.get(url, data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'name': 'Test book 0'}, response.data['results'][0])
+
+        self.client.force_login(self.user)
+        response = self.client.get(url, data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'name': 'Test book 0', 'viewer_relation': {'like': True, 'in_bookmarks': False, 'rate': 5}},
+                         response.data['results'][0])
+
+        self.client.logout()
+        response = self.client.get(url, data=params)
+        self.assertEqual({'name': 'Test book 0'}, response.data['results'][0])
+
+    def test_unknown(self):
+        response = self.client.get(reverse('book-list'), data={'fields': 'name,password', 'exclude': 'secret'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'fields': ['Unknown fields: password.'], 'exclude': ['Unknown fields: secret.']},
+                         response.data)
+
+
+class RenderersApiTestCase(APITestCase):
+    """
+    Тестирование форматов ответа orjson и MessagePack
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='test_username', first_name='Иван', last_name='Line\u2028break')
+        self.book = Book.objects.create(name='Книга', price='25.50', discount=5, author_name='Author 1')
+        UserBookRelation.objects.create(user=self.user, book=self.book, like=True, rate=4)
+        self.client.force_login(self.user)
+
+    @skipUnless(renderers.orjson is not None, 'orjson is not installed')
+    def test_fast_json(self):
+        for url in (reverse('book-list'), reverse('book-detail', args=(self.book.id,))):
+            expected = self.client.get(url).content
+            response = self.client.get(url, HTTP_ACCEPT='application/vnd.books.fast+json')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual('application/vnd.books.fast+json', response['Content-Type'])
+            self.assertEqual(expected, response.content)
+            self.assertIn(b'\\u2028', response.content)
+
+        # с отступами - обычный JSONRenderer
+        expected = self.client.get(url, HTTP_ACCEPT='application/json; indent=2').content
+        response = self.client.get(url, HTTP_ACCEPT='application/vnd.books.fast+json; indent=2')
+        self.assertEqual(expected, response.content)
+
+    @skipUnless(renderers.orjson is not None, 'orjson is not installed')
+    def test_fast_json_floats(self):
+        """
+        Числа с экспонентой записываются иначе, чем в JSONRenderer, значения совпадают
+        """
+        data = {'small': 1e-05, 'large': 1e16, 'rating': 4.5, 'third': 1 / 3}
+        expected = JSONRenderer().render(data)
+        content = renderers.FastJSONRenderer().render(data)
+        self.assertEqual(b'{"small":1e-05,"large":1e+16,"rating":4.5,"third":0.3333333333333333}', expected)
+        self.assertEqual(b'{"small":0.00001,"large":1e16,"rating":4.5,"third":0.3333333333333333}', content)
+        self.assertEqual(json.loads(expected), json.loads(content))
+
+    @skipUnless(renderers.msgpack is not None, 'msgpack is not installed')
+    def test_msgpack(self):
+        url = reverse('book-list')
+        expected = json.loads(self.client.get(url).content.decode('utf-8'))
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual('application/msgpack', response['Content-Type'])
+        self.assertEqual(expected, renderers.msgpack.unpackb(response.content, raw=False))
+
+        url = reverse('userbookrelation-detail', args=(self.book.id,))
+        response = self.client.patch(url, data=renderers.msgpack.packb({'rate': 2}),
+                                     content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'book': self.book.id, 'like': True, 'in_bookmarks': False, 'rate': 2},
+                         renderers.msgpack.unpackb(response.content, raw=False))
+
+        response = self.client.patch(url, data=b'\xc1', content_type='application/msgpack')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
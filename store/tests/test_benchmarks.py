@@ -0,0 +1,79 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+
+from store.benchmarks.generator import generate_data
+from store.benchmarks.runner import CASES, run_benchmarks, compare_results, percentile
+from store.models import Book, UserBookRelation
+
+
+class BenchmarkTestCase(TestCase):
+    """
+    Тестируем генерацию данных и замеры на небольшом объеме
+    """
+    def setUp(self):
+        self.created = generate_data(books=30, users=5, relations=40, seed=1, batch_size=7)
+
+    def test_generate_data(self):
+        """
+        Тестируем количество записей, счетчики книг и воспроизводимость по seed
+        """
+        self.assertEqual({'users': 5, 'books': 30, 'relations': 40}, self.created)
+        self.assertEqual(40, UserBookRelation.objects.count())
+        self.assertEqual(40, sum(Book.objects.values_list('readers_count', flat=True)))
+        self.assertEqual(UserBookRelation.objects.filter(like=True).count(),
+                         sum(Book.objects.values_list('likes_count', flat=True)))
+        with self.assertRaises(ValueError):
+            generate_data(books=1, users=1, relations=1)
+
+        first = list(UserBookRelation.objects.order_by('id').values_list('book__name', 'user__username', 'rate'))
+        UserBookRelation.objects.all().delete()
+        Book.objects.all().delete()
+        User.objects.all().delete()
+        generate_data(books=30, users=5, relations=40, seed=1, batch_size=7)
+        self.assertEqual(first, list(UserBookRelation.objects.order_by('id').values_list(
+            'book__name', 'user__username', 'rate')))
+
+    def test_run_benchmarks(self):
+        """
+        Тестируем результаты замеров, откат изменений и сравнение запусков
+        """
+        relations = list(UserBookRelation.objects.order_by('id').values_list('id', 'rate'))
+        result = run_benchmarks(repeat=3, warmup=1)
+        self.assertEqual(list(CASES), list(result['results']))
+        self.assertEqual(30, result['meta']['books'])
+        for stats in result['results'].values():
+            self.assertEqual(3, stats['runs'])
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertGreater(stats['queries'], 0)
+        self.assertEqual(relations, list(UserBookRelation.objects.order_by('id').values_list('id', 'rate')))
+
+        slower = {'results': {name: dict(stats, p95_ms=stats['p95_ms'] * 2 + 1, queries=stats['queries'] + 1)
+                              for name, stats in result['results'].items()}}
+        rows, regressions = compare_results(result, slower)
+        self.assertEqual(3 * len(CASES), len(rows))
+        self.assertEqual(2 * len(CASES), len(regressions))
+        self.assertEqual([], compare_results(result, result)[1])
+
+    def test_renderers(self):
+        result = run_benchmarks(cases=['book_list'], repeat=2, warmup=0, renderers=True)
+        self.assertIn('application/json', result['renderers'])
+        for stats in result['renderers'].values():
+            self.assertGreater(stats['bytes'], 0)
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+
+    def test_percentile(self):
+        self.assertEqual(2.5, percentile([4, 1, 3, 2], 50))
+        self.assertEqual(4, percentile([4, 1, 3, 2], 100))
+
+
+class AsyncBenchmarkTestCase(TransactionTestCase):
+    """
+    Тестируем замер параллельных запросов через ASGI, данные зафиксированы для потоков пула
+    """
+    def test_concurrency(self):
+        generate_data(books=10, users=3, relations=10, seed=1)
+        result = run_benchmarks(cases=['book_list'], repeat=4, warmup=0, concurrency=2)
+        self.assertEqual(['middleware', 'async_middleware'], list(result['async']))
+        for stats in result['async'].values():
+            self.assertEqual(4, stats['requests'])
+            self.assertGreater(stats['rps'], 0)
@@ -0,0 +1,123 @@
+import logging
+import os
+import tempfile
+import threading
+from contextlib import redirect_stderr
+from io import StringIO
+
+from django.test import SimpleTestCase
+
+from store.loghandlers import QueueFileHandler
+
+
+class QueueFileHandlerTestCase(SimpleTestCase):
+    """
+    Тестирование фоновой записи логов
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'test.log')
+        self.logger = logging.getLogger('store.tests.loghandlers')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+            handler.close()
+        self.directory.cleanup()
+
+    def get_handler(self, **kwargs):
+        handler = QueueFileHandler(self.filename, **dict({'flush_interval': 0.05}, **kwargs))
+        self.logger.addHandler(handler)
+        return handler
+
+    def read(self, filename=None):
+        with open(filename or self.filename, encoding='utf-8') as log:
+            return log.read().splitlines()
+
+    def test_write(self):
+        """
+        Записи попадают в файл пачками в порядке поступления
+        """
+        handler = self.get_handler(batch_size=3)
+        for index in range(10):
+            self.logger.info('record %d', index)
+        handler.flush()
+        self.assertEqual([f'record {index}' for index in range(10)], self.read())
+        self.assertEqual(0, handler.dropped)
+
+    def test_rotation(self):
+        """
+        Ротация файла по размеру
+        """
+        handler = self.get_handler(max_bytes=100, backup_count=2, batch_size=1)
+        for index in range(30):
+            self.logger.info('record %02d', index)
+        handler.close()
+        self.assertTrue(os.path.exists(f'{self.filename}.1'))
+        self.assertTrue(os.path.exists(f'{self.filename}.2'))
+        self.assertFalse(os.path.exists(f'{self.filename}.3'))
+        self.assertLess(os.path.getsize(f'{self.filename}.1'), 100 + len('record 00\n'))
+        self.assertEqual('record 29', (self.read(f'{self.filename}.1') + self.read())[-1])
+
+    def test_shutdown(self):
+        """
+        logging.shutdown() записывает последнюю пачку: файл открыт не через зарегистрированный
+        logging.Handler, который был бы закрыт раньше
+        """
+        handlers = len(logging._handlerList)
+        handler = self.get_handler(flush_interval=0.5, batch_size=1000)
+        self.logger.info('record 0')
+        handler.flush()
+        for index in range(1, 10):
+            self.logger.info('record %d', index)
+        # logging.shutdown() закрывает обработчики в порядке, обратном регистрации
+        logging.shutdown(logging._handlerList[handlers:])
+        self.assertEqual([f'record {index}' for index in range(10)], self.read())
+
+    def test_write_error(self):
+        """
+        Ошибка записи пачки (не только OSError) не останавливает фоновый поток
+        """
+        handler = self.get_handler(encoding='ascii', batch_size=1)
+        with redirect_stderr(StringIO()) as stderr:
+            self.logger.info('запись')
+            handler.flush()
+        self.assertIn('UnicodeEncodeError', stderr.getvalue())
+        self.assertTrue(handler.thread.is_alive())
+        self.logger.info('record')
+        handler.flush()
+        self.assertEqual(['record'], self.read())
+        self.assertEqual(1, handler.dropped)
+
+    def test_queue_full(self):
+        """
+        При переполнении очереди записи отбрасываются и учитываются в счетчике
+        """
+        handler = self.get_handler(queue_size=2)
+        # фоновый поток еще не забирает записи из очереди
+        handler.pid = os.getpid()
+        handler.thread = threading.Thread(target=handler.run, daemon=True)
+        for index in range(5):
+            self.logger.info('record %d', index)
+        self.assertEqual(3, handler.dropped)
+
+        handler.thread.start()
+        self.logger.info('record 5')
+        handler.flush()
+        self.assertEqual(['record 0', 'record 1', 'record 5', '3 log records dropped, queue is full'], self.read())
+
+    def test_sample_successful_get(self):
+        """
+        Успешные GET запросы записываются с долей sample_rate, остальные записи всегда
+        """
+        handler = self.get_handler(sample_rate=0)
+        for method, status in (('GET', 200), ('GET', 304), ('GET', 404), ('POST', 201)):
+            self.logger.info('%s %s', method, status, extra={'timing': {'method': method, 'status': status}})
+        self.logger.info({'request': {'method': 'GET'}, 'response': {'status_code': 200}})
+        self.logger.info({'request': {'method': 'PATCH'}, 'response': {'status_code': 200}})
+        self.logger.info('plain record')
+        handler.flush()
+        self.assertEqual(['GET 404', 'POST 201', "{'request': {'method': 'PATCH'}, 'response': {'status_code': 200}}",
+                          'plain record'], self.read())
@@ -1,9 +1,17 @@
+import math
+from unittest import mock, skipUnless
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from store.services.getqueryfromdb import get_books_with_annotate, get_user_book_relation
-from store.services.logic import set_rating
-from store.models import Book, UserBookRelation
+from store.services.logic import set_rating, rebuild_book_counters, upsert_relation, recompute_ratings, get_deleting
+from store.services import recommendations
+from store.services.ratingworker import process_dirty_ratings
+from store.services.recommendations import compute_similar, process_dirty_similar, rebuild_similar
+from store.models import Book, UserBookRelation, DirtyBookRating, BookSimilarity, DirtyBookSimilarity
 
 
 class SetRatingTestCase(TestCase):
@@ -46,3 +54,282 @@ class SetRatingTestCase(TestCase):
         self.book_2.refresh_from_db()
         self.assertEqual('4.7', str(self.book_1.rating))
         self.assertEqual('4.0', str(self.book_2.rating))
+
+    def test_counters(self):
+        """
+        Тестируем сумму и количество оценок, которые заполняются при создании оценок
+        """
+        self.book_1.refresh_from_db()
+        self.assertEqual(14, self.book_1.rating_sum)
+        self.assertEqual(3, self.book_1.rating_count)
+        self.assertEqual('4.7', str(self.book_1.rating))
+
+    def test_change_rate(self):
+        """
+        Тестируем пересчет рейтинга при изменении, удалении оценки и добавлении новой
+        """
+        relation = UserBookRelation.objects.get(user__username='test_user3', book=self.book_1)
+        relation.rate = 2
+        relation.save()
+        self.book_1.refresh_from_db()
+        self.assertEqual(12, self.book_1.rating_sum)
+        self.assertEqual(3, self.book_1.rating_count)
+        self.assertEqual('4.0', str(self.book_1.rating))
+
+        relation.rate = None
+        relation.save()
+        self.book_1.refresh_from_db()
+        self.assertEqual(10, self.book_1.rating_sum)
+        self.assertEqual(2, self.book_1.rating_count)
+        self.assertEqual('5.0', str(self.book_1.rating))
+
+        UserBookRelation.objects.get(user__username='test_user1', book=self.book_1).delete()
+        UserBookRelation.objects.get(user__username='test_user2', book=self.book_1).delete()
+        self.book_1.refresh_from_db()
+        self.assertEqual(0, self.book_1.rating_sum)
+        self.assertEqual(0, self.book_1.rating_count)
+        self.assertIsNone(self.book_1.rating)
+
+    def test_book_save_keeps_counters(self):
+        """
+        Сохранение книги, загруженной до выставления оценки, не затирает счетчики
+        """
+        book = Book.objects.get(pk=self.book_2.pk)
+        user = User.objects.create(username='test_user4')
+        UserBookRelation.objects.create(user=user, book=self.book_2, rate=1)
+        book.name = 'New name'
+        book.save()
+        self.book_2.refresh_from_db()
+        self.assertEqual('New name', self.book_2.name)
+        self.assertEqual(9, self.book_2.rating_sum)
+        self.assertEqual(3, self.book_2.rating_count)
+        self.assertEqual('3.0', str(self.book_2.rating))
+
+    def test_likes_count(self):
+        """
+        Тестируем количество лайков при изменении и удалении отношения к книге
+        """
+        self.book_1.refresh_from_db()
+        self.assertEqual(3, self.book_1.likes_count)
+
+        relation = UserBookRelation.objects.get(user__username='test_user1', book=self.book_1)
+        relation.like = False
+        relation.save()
+        relation.in_bookmarks = True
+        relation.save()
+        self.book_1.refresh_from_db()
+        self.assertEqual(2, self.book_1.likes_count)
+
+        UserBookRelation.objects.get(user__username='test_user2', book=self.book_1).delete()
+        self.book_1.refresh_from_db()
+        self.assertEqual(1, self.book_1.likes_count)
+        self.assertEqual(1, get_books_with_annotate().get(pk=self.book_1.pk).count_likes)
+
+    def test_cascade_delete(self):
+        """
+        Тестируем счетчики при каскадном удалении оценок вместе с пользователем и при QuerySet.delete()
+        """
+        User.objects.get(username='test_user1').delete()
+        self.book_1.refresh_from_db()
+        self.book_2.refresh_from_db()
+        self.assertEqual((9, 2, '4.5', 2, 2), (self.book_1.rating_sum, self.book_1.rating_count,
+                                               str(self.book_1.rating), self.book_1.likes_count,
+                                               self.book_1.readers_count))
+        self.assertEqual((4, 1, '4.0', 1, 1), (self.book_2.rating_sum, self.book_2.rating_count,
+                                               str(self.book_2.rating), self.book_2.likes_count,
+                                               self.book_2.readers_count))
+
+        UserBookRelation.objects.filter(user__username='test_user2').delete()
+        self.book_1.refresh_from_db()
+        self.assertEqual((4, 1, 1, 1), (self.book_1.rating_sum, self.book_1.rating_count,
+                                        self.book_1.likes_count, self.book_1.readers_count))
+
+        # оценки удаляются каскадно, счетчики удаляемой книги не обновляются для каждой оценки
+        with CaptureQueriesContext(connection) as queries:
+            self.book_1.delete()
+        self.assertFalse(UserBookRelation.objects.filter(book_id=self.book_1.id).exists())
+        self.assertFalse([query['sql'] for query in queries if query['sql'].startswith('UPDATE "store_book"')])
+        self.assertFalse(get_deleting('books'))
+
+    def test_rebuild_book_counters(self):
+        """
+        Тестируем полный пересчет счетчиков после загрузки оценок через bulk_create
+        """
+        user = User.objects.create(username='test_user4')
+        UserBookRelation.objects.bulk_create([UserBookRelation(user=user, book=self.book_2, rate=1)])
+        Book.objects.update(rating_sum=0, rating_count=0, rating=None, likes_count=0, readers_count=0)
+
+        self.assertEqual(2, rebuild_book_counters())
+        self.book_1.refresh_from_db()
+        self.book_2.refresh_from_db()
+        self.assertEqual((14, 3, '4.7', 3, 3), (self.book_1.rating_sum, self.book_1.rating_count,
+                                                str(self.book_1.rating), self.book_1.likes_count,
+                                                self.book_1.readers_count))
+        self.assertEqual((9, 3, '3.0', 2, 3), (self.book_2.rating_sum, self.book_2.rating_count,
+                                               str(self.book_2.rating), self.book_2.likes_count,
+                                               self.book_2.readers_count))
+
+    def test_unique_relation(self):
+        """
+        Тестируем, что повторная оценка книги пользователем не создается
+        """
+        user = User.objects.get(username='test_user1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserBookRelation.objects.create(user=user, book=self.book_1, rate=1)
+
+        relation = upsert_relation(user, self.book_1.id, {'rate': 1})
+        self.assertEqual((True, 1), (relation.like, relation.rate))
+        self.assertEqual(3, UserBookRelation.objects.filter(book=self.book_1).count())
+        self.book_1.refresh_from_db()
+        self.assertEqual((10, 3, '3.3'), (self.book_1.rating_sum, self.book_1.rating_count, str(self.book_1.rating)))
+
+
+@override_settings(BOOK_RATING_MODE='deferred', BOOK_RATING_WORKER=None)
+class DeferredRatingTestCase(TestCase):
+    """
+    Тестируем отложенный пересчет рейтинга
+    """
+    def setUp(self) -> None:
+        self.users = [User.objects.create(username=f'test_user{number}') for number in range(3)]
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 4')
+        self.book_2 = Book.objects.create(name='Test book 2', price=55, author_name='Author 1')
+
+    def test_deferred(self):
+        """
+        Оценки только отмечают книгу, все отметки книги пересчитываются одним пересчетом
+        """
+        for user, rate in zip(self.users, (5, 4, 4)):
+            UserBookRelation.objects.create(user=user, book=self.book_1, like=True, rate=rate)
+        relation = UserBookRelation.objects.create(user=self.users[0], book=self.book_2, rate=1)
+        relation.rate = 2
+        relation.save()
+
+        self.book_1.refresh_from_db()
+        self.assertIsNone(self.book_1.rating)
+        self.assertEqual(3, self.book_1.likes_count)
+        self.assertEqual(5, DirtyBookRating.objects.count())
+
+        # 5 отметок двух книг - два пересчета по одной книге в пачке
+        with self.assertNumQueries(24):
+            self.assertEqual(2, process_dirty_ratings(batch_size=1))
+
+        self.book_1.refresh_from_db()
+        self.book_2.refresh_from_db()
+        self.assertEqual((13, 3, '4.3'), (self.book_1.rating_sum, self.book_1.rating_count, str(self.book_1.rating)))
+        self.assertEqual((2, 1, '2.0'), (self.book_2.rating_sum, self.book_2.rating_count, str(self.book_2.rating)))
+        self.assertFalse(DirtyBookRating.objects.exists())
+        self.assertEqual(0, process_dirty_ratings())
+
+    def test_late_mark(self):
+        """
+        Удаляются только прочитанные отметки: отметка с меньшим id, зафиксированная во время пересчета,
+        пересчитывается следующей пачкой, а не удаляется
+        """
+        UserBookRelation.objects.create(user=self.users[0], book=self.book_1, rate=5)
+        DirtyBookRating.objects.create(id=100, book=self.book_2)
+        calls = []
+
+        def recompute(book_ids):
+            if not calls:
+                DirtyBookRating.objects.create(id=50, book=self.book_1)
+            calls.append(book_ids)
+            return recompute_ratings(book_ids)
+
+        with mock.patch('store.services.logic.recompute_ratings', side_effect=recompute):
+            self.assertEqual(3, process_dirty_ratings())
+        self.assertEqual([[self.book_1.id, self.book_2.id], [self.book_1.id]], calls)
+        self.assertFalse(DirtyBookRating.objects.exists())
+
+    def test_like_not_marked(self):
+        """
+        Изменение лайка без оценки не отмечает книгу
+        """
+        UserBookRelation.objects.create(user=self.users[0], book=self.book_1, like=True)
+        self.assertFalse(DirtyBookRating.objects.exists())
+
+
+@override_settings(BOOK_SIMILAR_WORKER=None)
+class SimilarBooksTestCase(TestCase):
+    """
+    Тестируем расчет похожих книг
+    """
+    def setUp(self) -> None:
+        self.users = [User.objects.create(username=f'test_user{number}') for number in range(4)]
+        self.books = [Book.objects.create(name=f'Test book {number}', price=25, author_name='Author 1')
+                      for number in range(5)]
+        # книга 0 нравится всем, книга 1 - трем пользователям из четырех, книга 2 - одному,
+        # низкая оценка книги 3 и закладка книги 4 не учитываются
+        for user in self.users:
+            UserBookRelation.objects.create(user=user, book=self.books[0], like=True)
+        for user in self.users[:3]:
+            UserBookRelation.objects.create(user=user, book=self.books[1], rate=5)
+        UserBookRelation.objects.create(user=self.users[0], book=self.books[2], rate=4)
+        UserBookRelation.objects.create(user=self.users[0], book=self.books[3], rate=2)
+        UserBookRelation.objects.create(user=self.users[1], book=self.books[4], in_bookmarks=True)
+
+    def get_expected(self):
+        book_0, book_1, book_2 = (book.id for book in self.books[:3])
+        return {
+            book_0: [(book_1, 3 / math.sqrt(12)), (book_2, 1 / 2)],
+            book_1: [(book_0, 3 / math.sqrt(12)), (book_2, 1 / math.sqrt(3))],
+            book_2: [(book_1, 1 / math.sqrt(3)), (book_0, 1 / 2)],
+            self.books[3].id: [],
+        }
+
+    def assertSimilar(self, expected, actual):
+        self.assertEqual(set(expected), set(actual))
+        for book_id, items in expected.items():
+            self.assertEqual([other for other, _ in items], [other for other, _ in actual[book_id]])
+            for (_, score), (_, actual_score) in zip(items, actual[book_id]):
+                self.assertAlmostEqual(score, actual_score)
+
+    def test_compute_python(self):
+        with mock.patch.object(recommendations, 'sparse', None):
+            self.assertIs(recommendations.PythonCooccurrence, recommendations.get_cooccurrence_class())
+            self.assertSimilar(self.get_expected(), compute_similar(self.get_expected()))
+
+    @skipUnless(recommendations.sparse is not None, 'NumPy/SciPy are not installed')
+    def test_compute_sparse(self):
+        self.assertIs(recommendations.SparseCooccurrence, recommendations.get_cooccurrence_class())
+        with self.assertNumQueries(2):
+            similar = compute_similar(self.get_expected())
+        self.assertSimilar(self.get_expected(), similar)
+        # top_k меньше количества соседей
+        self.assertEqual([self.books[1].id], [other for other, _ in compute_similar([self.books[0].id], 1)[
+            self.books[0].id]])
+
+    def test_incremental(self):
+        """
+        Изменения оценок отмечают книги, пересчет отмеченных книг совпадает с полным пересчетом
+        """
+        self.assertEqual(3, rebuild_similar(chunk_size=2))
+        self.assertFalse(DirtyBookSimilarity.objects.exists())
+        self.assertEqual(6, BookSimilarity.objects.count())
+
+        # закладка не меняет похожие книги, лайк - меняет
+        UserBookRelation.objects.filter(user=self.users[2], book=self.books[0]).update(in_bookmarks=True)
+        relation = UserBookRelation.objects.get(user=self.users[3], book=self.books[0])
+        relation.in_bookmarks = True
+        relation.save()
+        self.assertFalse(DirtyBookSimilarity.objects.exists())
+        # оценка остается положительной - похожие книги не меняются
+        relation = UserBookRelation.objects.get(user=self.users[0], book=self.books[1])
+        relation.rate = 4
+        relation.save()
+        self.assertFalse(DirtyBookSimilarity.objects.exists())
+        # отмечается только книга 2, её соседи пересчитываются обработчиком
+        UserBookRelation.objects.create(user=self.users[3], book=self.books[2], like=True)
+        self.assertEqual([self.books[2].id], list(DirtyBookSimilarity.objects.values_list('book_id', flat=True)))
+
+        self.assertEqual(3, process_dirty_similar())
+        self.assertFalse(DirtyBookSimilarity.objects.exists())
+        book_2 = self.books[2].id
+        self.assertEqual([(self.books[0].id, 1 / math.sqrt(2)), (self.books[1].id, 1 / math.sqrt(6))],
+                         list(BookSimilarity.objects.filter(book_id=book_2).order_by('-score').values_list(
+                             'similar_id', 'score')))
+        incremental = list(BookSimilarity.objects.order_by('book_id', '-score').values_list(
+            'book_id', 'similar_id', 'score'))
+
+        rebuild_similar()
+        self.assertEqual(list(BookSimilarity.objects.order_by('book_id', '-score').values_list(
+            'book_id', 'similar_id', 'score')), incremental)
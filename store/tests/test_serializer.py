@@ -1,9 +1,10 @@
 from django.db.models import Count, Case, When, F
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
 
 from store.models import Book, UserBookRelation
-from store.serializers import BooksSerializer
+from store.serializers import BooksSerializer, BooksFastSerializer
 from store.services.getqueryfromdb import get_books_with_annotate
 
 
@@ -57,7 +58,8 @@ class BookSerializerTestCase(TestCase):
                         'first_name': 'Ivan',
                         'last_name': 'Boboka'
                     }
-                ]
+                ],
+                'readers_count': 3
             },
             {
                 'id': book_2.id,
@@ -67,7 +69,7 @@ class BookSerializerTestCase(TestCase):
                 'owner_name': None,
                 'price_with_discount': None,
                 'count_likes': 2,
-                'rating': '3.5',
+                'rating': '3.7',
                 'readers': [
                     {
                         'first_name': 'Ivan',
@@ -81,7 +83,32 @@ class BookSerializerTestCase(TestCase):
                         'first_name': 'Ivan',
                         'last_name': 'Boboka'
                     }
-                ]
+                ],
+                'readers_count': 3
             }
         ]
         self.assertEqual(expected_data, data)
+
+        fast_data = BooksFastSerializer(BooksFastSerializer.prepare(books)).data
+        self.assertEqual(expected_data, fast_data)
+        self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(fast_data))
+
+    @override_settings(BOOK_READERS_LIMIT=2)
+    def test_readers_limit(self):
+        """
+        Тестируем ограничение количества встроенных читателей
+        """
+        book = Book.objects.create(name='Test book 1', price=25, author_name='Author 4')
+        for number in range(3):
+            user = User.objects.create(username=f'test_user{number}', first_name='Ivan', last_name=f'Ivanov{number}')
+            UserBookRelation.objects.create(user=user, book=book)
+        # ограничение действует для каждой книги отдельно
+        book_2 = Book.objects.create(name='Test book 2', price=25, author_name='Author 4')
+        UserBookRelation.objects.create(user=user, book=book_2)
+
+        with self.assertNumQueries(2):
+            data = BooksSerializer(get_books_with_annotate(), many=True).data
+        self.assertEqual([{'first_name': 'Ivan', 'last_name': 'Ivanov0'},
+                          {'first_name': 'Ivan', 'last_name': 'Ivanov1'}], data[0]['readers'])
+        self.assertEqual(3, data[0]['readers_count'])
+        self.assertEqual([{'first_name': 'Ivan', 'last_name': 'Ivanov2'}], data[1]['readers'])
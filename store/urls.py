@@ -1,6 +1,8 @@
+from django.urls import path
 from rest_framework.routers import SimpleRouter
 
-from store.views import BookViewSet, UserBookRelationView
+from store.asyncviews import book_list, book_detail, book_relation
+from store.views import BookViewSet, UserBookRelationView, LeaderboardView, LibraryView, AuthorViewSet
 
 """
 создаем url для пользования API
@@ -8,5 +10,18 @@ from store.views import BookViewSet, UserBookRelationView
 router = SimpleRouter()
 router.register(r'book', BookViewSet)
 router.register(r'book_relation', UserBookRelationView)
+router.register(r'author', AuthorViewSet)
 
-urlpatterns = router.urls
+"""
+асинхронные url для ASGI приложения
+"""
+async_urlpatterns = [
+    path('async/book/', book_list, name='async-book-list'),
+    path('async/book/<str:pk>/', book_detail, name='async-book-detail'),
+    path('async/book_relation/<str:book>/', book_relation, name='async-userbookrelation-detail'),
+]
+
+urlpatterns = router.urls + async_urlpatterns + [
+    path('leaderboard/<str:board>/', LeaderboardView.as_view(), name='leaderboard'),
+    path('library/<str:shelf>/', LibraryView.as_view(), name='library'),
+]
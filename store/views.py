@@ -1,28 +1,78 @@
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.generics import ListAPIView, get_object_or_404
 from rest_framework.mixins import UpdateModelMixin
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ReadOnlyModelViewSet
 
-from store.models import UserBookRelation
+from store.filters import BookSearchFilter, BookFilter
+from store.mixins import BooksCacheMixin, FastReadMixin, ViewerStateMixin, SparseFieldsMixin
+from store.models import Book
+from store.pagination import KeysetPagination
 from store.permissions import IsOwnerOrStaffReadOnly
-from store.serializers import BooksSerializer, UserBookRelationSerializer
-from store.services.getqueryfromdb import get_books_with_annotate, get_user_book_relation
+from store.renderers import get_renderer_classes, get_parser_classes
+from store.serializers import BooksSerializer, UserBookRelationSerializer, BookReaderSerializer, \
+    UserBookRelationBulkSerializer, BooksFastSerializer, BookRankingSerializer, \
+    BookSimilaritySerializer, AuthorStatsSerializer
+from store.services.getqueryfromdb import get_books_with_annotate, get_user_book_relation, get_book_readers, \
+    get_user_books, SHELVES
+from store.services.authors import get_authors
+from store.services.leaderboard import get_leaderboard, BOARDS
+from store.services import bookexport
+from store.services.bookimport import import_books, get_import_format, FORMATS
+from store.services.logic import set_relations, upsert_relation, RELATION_FIELDS
+from store.services.recommendations import get_similar_books
 
 
-class BookViewSet(ModelViewSet):
+class BookViewSet(ViewerStateMixin, SparseFieldsMixin, BooksCacheMixin, FastReadMixin, ModelViewSet):
     """
     View для работы с книгами
     Устанавливаем фильтрующие поля, поля поиска и сортировки.
+    Поиск выполняется поисковым движком с сортировкой по релевантности.
+    Ответы list и retrieve кэшируются до изменения книг или оценок
+    и строятся быстрым сериализатором BooksFastSerializer.
+    По запросу ?pagination=cursor вместо постраничного вывода по номеру
+    используется постраничный вывод по ключу (KeysetPagination).
+    По запросу ?viewer=true книги содержат оценку текущего пользователя (ViewerStateMixin).
+    ?fields= и ?exclude= выбирают поля ответа, ненужные аннотации и читатели не запрашиваются.
+    Кроме JSON ответы отдаются в форматах из store/renderers.py по заголовку Accept.
     """
     queryset = get_books_with_annotate()
     serializer_class = BooksSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    fast_serializer_class = BooksFastSerializer
+    filter_backends = [DjangoFilterBackend, BookSearchFilter, OrderingFilter]
     permission_classes = [IsOwnerOrStaffReadOnly]
-    filter_fields = ['price']
+    filterset_class = BookFilter
     search_fields = ['name', 'author_name']
-    ordering_fields = ['price', 'author_name']
+    ordering_fields = ['price', 'effective_price', 'author_name']
+    keyset_pagination_class = KeysetPagination
+    renderer_classes = get_renderer_classes()
+    parser_classes = get_parser_classes()
+    # максимальное количество SQL запросов действий, см. ServerTimingMiddleware и тесты бюджетов,
+    # импорт и выгрузка (вместе с отправкой потокового ответа) - для одной пачки книг
+    query_budgets = {
+        'list': 6, 'retrieve': 6, 'create': 8, 'update': 11, 'partial_update': 8, 'destroy': 15,
+        'readers': 5, 'similar': 4, 'import_books': 6, 'export_books': 4,
+    }
+
+    @property
+    def paginator(self):
+        if (not hasattr(self, '_paginator') and self.action == 'list' and
+                self.keyset_pagination_class.is_requested(self.request)):
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
+
+    def get_sparse_queryset(self, fields):
+        # столбцы сортировки нужны для курсора постраничного вывода по ключу
+        ordering = OrderingFilter().get_ordering(self.request, self.queryset, self) or ()
+        return get_books_with_annotate(fields, [field.lstrip('-') for field in ordering])
 
     def perform_create(self, serializer):
         """
@@ -31,6 +81,60 @@ class BookViewSet(ModelViewSet):
         serializer.validated_data['owner'] = self.request.user
         serializer.save()
 
+    @action(detail=True, pagination_class=PageNumberPagination)
+    def readers(self, request, pk=None):
+        """
+        Полный постраничный список читателей книги
+        """
+        book = get_object_or_404(Book.objects.only('id'), pk=pk)
+        page = self.paginate_queryset(get_book_readers(book.id))
+        serializer = BookReaderSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, pagination_class=None)
+    def similar(self, request, pk=None):
+        """
+        Похожие книги: читатели, которым понравилась книга, также оценили эти книги.
+        Список рассчитывается заранее (см. services/recommendations.py)
+        """
+        book = get_object_or_404(Book.objects.only('id'), pk=pk)
+        return Response(BookSimilaritySerializer(get_similar_books(book.id), many=True).data)
+
+    @action(detail=False, methods=['post'], url_path='import', url_name='import',
+            permission_classes=[IsAuthenticated], parser_classes=[MultiPartParser])
+    def import_books(self, request):
+        """
+        Импорт книг из файла CSV или NDJSON в поле file, формат по расширению или в поле file_format.
+        Владельцем книг становится пользователь, ошибочные строки возвращаются в errors.
+        """
+        upload = request.data.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+        file_format = request.data.get('file_format') or get_import_format(upload.name)
+        if file_format not in FORMATS:
+            raise ValidationError({'file_format': [f'"{file_format}" is not a valid choice.']})
+        try:
+            batch_size = int(request.data.get('batch_size', 0)) or None
+        except ValueError:
+            raise ValidationError({'batch_size': ['A valid integer is required.']})
+
+        result = import_books(upload, file_format, owner=request.user, batch_size=batch_size)
+        return Response(result)
+
+    @action(detail=False, url_path='export', url_name='export')
+    def export_books(self, request):
+        """
+        Потоковая выгрузка книг с учетом фильтров и поиска в NDJSON (по умолчанию) или CSV (?file_format=csv)
+        """
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in bookexport.FORMATS:
+            raise ValidationError({'file_format': [f'"{file_format}" is not a valid choice.']})
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(bookexport.export_books(queryset, file_format),
+                                         content_type=bookexport.CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="books.{file_format}"'
+        return response
+
 
 class UserBookRelationView(UpdateModelMixin,
                            GenericViewSet):
@@ -40,16 +144,73 @@ class UserBookRelationView(UpdateModelMixin,
     - ставить лайк книге
     - добавлять в избраное
     - ставить оценку
+    Оценки сразу нескольких книг отправляются списком POST на book_relation/bulk/.
     """
     permission_classes = [IsAuthenticated]
     queryset = get_user_book_relation()
     serializer_class = UserBookRelationSerializer
     lookup_field = 'book'
+    bulk_max_items = 1000
+    renderer_classes = get_renderer_classes()
+    parser_classes = get_parser_classes()
+    query_budgets = {'update': 13, 'partial_update': 12, 'bulk': 13}
 
-    def get_object(self):
-        obj, created = UserBookRelation.objects.get_or_create(user=self.request.user,
-                                                              book_id=self.kwargs['book'])
-        return obj
+    def update(self, request, *args, **kwargs):
+        """
+        Оценка создается INSERT ... ON CONFLICT DO NOTHING или изменяется с блокировкой строки (upsert_relation)
+        """
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        try:
+            book_id = int(self.kwargs['book'])
+        except ValueError:
+            raise NotFound()
+        values = {field: value for field, value in serializer.validated_data.items() if field in RELATION_FIELDS}
+        relation = upsert_relation(request.user, book_id, values)
+        if relation is None:
+            raise NotFound()
+        return Response(self.get_serializer(relation).data)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Оценка нескольких книг одним запросом: [{book, like, in_bookmarks, rate}, ...]
+        """
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        if len(request.data) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [f'Ensure this list has no more than '
+                                                        f'{self.bulk_max_items} items.']})
+
+        serializer = UserBookRelationBulkSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+
+        book_ids = {item['book'] for item in serializer.validated_data}
+        missing = book_ids - set(Book.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+        if missing:
+            raise ValidationError({'book': [f'Invalid pk "{book_id}" - object does not exist.'
+                                            for book_id in sorted(missing)]})
+
+        relations = set_relations(request.user, serializer.validated_data)
+        return Response(UserBookRelationSerializer(relations, many=True).data)
+
+
+class LeaderboardView(ListAPIView):
+    """
+    Лидерборды книг: rating - лучшие по оценкам, likes - больше всего лайков.
+    ?author=имя - рейтинг книг одного автора. Строки читаются из таблицы BookRanking
+    постранично по ключу, поэтому страница не зависит от количества книг.
+    """
+    serializer_class = BookRankingSerializer
+    pagination_class = KeysetPagination
+    query_budgets = {'get': 1}
+
+    def get_queryset(self):
+        board = self.kwargs['board']
+        if board not in BOARDS:
+            raise NotFound()
+        return get_leaderboard(board, self.request.query_params.get('author'))
 
 
 def auth(request):
@@ -57,3 +218,37 @@ def auth(request):
     аутентификация с помощью GitHub
     '''
     return render(request, 'oauth.html')
+
+
+class LibraryView(FastReadMixin, ListAPIView):
+    """
+    Личная библиотека пользователя: bookmarks - закладки, likes - понравившиеся,
+    rated - оцененные книги. Книги в представлении BooksSerializer, последние добавленные первыми,
+    постранично по ключу: страница - один запрос книг по частичному индексу полки и один запрос читателей.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = BooksSerializer
+    fast_serializer_class = BooksFastSerializer
+    pagination_class = KeysetPagination
+    query_budgets = {'get': 4}
+
+    def get_queryset(self):
+        shelf = self.kwargs['shelf']
+        if shelf not in SHELVES:
+            raise NotFound()
+        return get_user_books(self.request.user, shelf)
+
+
+class AuthorViewSet(ReadOnlyModelViewSet):
+    """
+    Статистика авторов: список с поиском по имени и сортировкой, автор по имени.
+    Данные читаются только из таблицы AuthorStats (см. services/authors.py)
+    """
+    queryset = get_authors()
+    serializer_class = AuthorStatsSerializer
+    lookup_field = 'author_name'
+    lookup_value_regex = '[^/]+'
+    filter_backends = [SearchFilter, OrderingFilter]
+    search_fields = ['author_name']
+    ordering_fields = ['author_name', 'books_count', 'rating', 'likes_count', 'max_price', 'min_price']
+    query_budgets = {'list': 4, 'retrieve': 3}